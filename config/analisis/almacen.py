@@ -0,0 +1,506 @@
+"""Almacén de modelos de n-gramas entrenados.
+
+Los modelos se entrenan una sola vez (normalmente en una tarea en segundo
+plano, ver tareas.py), se guardan en disco en el formato binario de
+formato_binario.py y se registran en la tabla ``ModeloNgramas``. El endpoint
+de sugerencias solo los abre con mmap.
+
+La fuente de un modelo puede ser un ``TextoAnalizado`` o un ``Corpus``; en
+el segundo caso cada documento se cuenta en un proceso distinto y los
+conteos parciales se combinan al final.
+
+El archivo guarda conteos, no probabilidades (se calculan al consultar), así
+que agregar o quitar un documento de un corpus solo cuenta ese documento y
+suma o resta sus conteos a los del modelo guardado.
+"""
+import math
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .models import Corpus, ModeloNgramas
+from .conteo import ContadorIncremental, Vocabulario
+from .formato_binario import ModeloBinario, escribir_modelo
+from .metricas import etapa
+from .cache_textos import cache, candado, clave_compartida, flujo_texto
+from .suavizado import ANCHO_HAZ_DEFECTO, LONGITUD_FRASE_DEFECTO, ModeloSuavizado
+from .utils import TablaPaginada, contar_archivo, contar_archivo_tokens, fila_probabilidad
+
+# Orden y fronteras que usa por defecto la pantalla de autocompletado
+N_GRAMA_DEFECTO = 3
+FRONTERAS_DEFECTO = False
+
+# Modelos ya abiertos en este proceso: (id, fecha_entrenamiento) -> ModeloBinario
+_modelos_cargados = {}
+_candado_modelos = threading.Lock()
+_pool_carga = None
+
+# Candados de este proceso por fuente y las fuentes que ya bloquea cada hilo
+_candados_fuentes = {}
+_fuentes_bloqueadas = threading.local()
+
+
+def contar_texto(texto_obj, ordenes, usar_fronteras=False, progreso=None):
+    """
+    Cuenta los n-gramas de un texto a partir de su flujo de tokens ya
+    codificado (cache_textos.flujo_texto), por lotes y sin copiarlo completo
+    en memoria. progreso(fraccion), si se indica, recibe la fracción de los
+    tokens ya contada (de 0 a 1).
+    """
+    flujo = flujo_texto(texto_obj)
+    contador = ContadorIncremental(ordenes, Vocabulario(flujo.palabras(usar_fronteras)))
+    total = flujo.longitud(usar_fronteras) or 1
+    with etapa('conteo'):
+        for lote in flujo.lotes(usar_fronteras):
+            contador.agregar_ids(lote)
+            if progreso is not None:
+                progreso(min(contador.total / total, 1.0))
+    return contador
+
+
+def procesos_corpus():
+    """Procesos para contar un corpus (ANALISIS_PROCESOS_CORPUS o los núcleos)"""
+    return getattr(settings, 'ANALISIS_PROCESOS_CORPUS', None) or os.cpu_count() or 1
+
+
+def conteo_de_texto(texto_obj, ordenes, usar_fronteras=False):
+    """
+    (función, argumentos) para contar un texto en otro proceso: su flujo de
+    tokens, armado antes aquí si hace falta, o el archivo original si el
+    flujo no se pudo guardar.
+    """
+    try:
+        flujo_texto(texto_obj)
+        ruta = texto_obj.tokens.path
+    except OSError:
+        return contar_archivo, (texto_obj.archivo.path, ordenes, usar_fronteras)
+    return contar_archivo_tokens, (ruta, ordenes, usar_fronteras)
+
+
+def contar_corpus(corpus, ordenes, usar_fronteras=False, progreso=None):
+    """
+    Cuenta los n-gramas de todos los textos de un corpus a partir de sus
+    flujos de tokens. Cada documento se cuenta en un proceso del pool y sus
+    conteos se combinan en el orden de los textos, así el resultado no
+    depende de cuál termina primero.
+    progreso(fraccion) avanza con los bytes de los documentos terminados.
+    """
+    textos = list(corpus.textos.order_by('id'))
+    tamanos = [texto.archivo.size for texto in textos]
+    total_bytes = sum(tamanos) or 1
+    contador = ContadorIncremental(ordenes)
+    conteos = [conteo_de_texto(texto, ordenes, usar_fronteras) for texto in textos]
+
+    def combinar(parciales):
+        leidos = 0
+        for tamano, parcial in zip(tamanos, parciales):
+            contador.combinar(*parcial)
+            leidos += tamano
+            if progreso is not None:
+                progreso(leidos / total_bytes)
+        return contador
+
+    procesos = min(procesos_corpus(), len(textos))
+    if procesos <= 1:
+        return combinar(funcion(*argumentos) for funcion, argumentos in conteos)
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [pool.submit(funcion, *argumentos) for funcion, argumentos in conteos]
+        return combinar(futuro.result() for futuro in futuros)
+
+
+def filtro_fuente(fuente):
+    """Filtro de consultas de modelos y tareas para un texto o un corpus"""
+    if isinstance(fuente, Corpus):
+        return {'corpus': fuente}
+    return {'texto': fuente}
+
+
+def nombre_archivo_modelo(fuente, n, usar_fronteras):
+    """Nombre del archivo en disco para un modelo"""
+    prefijo = 'corpus' if isinstance(fuente, Corpus) else 'texto'
+    sufijo = 'con_fronteras' if usar_fronteras else 'sin_fronteras'
+    return f'{prefijo}_{fuente.id}_{n}gramas_{sufijo}.bin'
+
+
+def ordenes_modelo(n):
+    """Órdenes que guarda un modelo de orden n: todos, para poder retroceder"""
+    return range(1, n + 1)
+
+
+def serializar_modelo(contador, n, usar_fronteras):
+    """
+    Serializa en formato binario las tablas de todos los órdenes del modelo:
+    contexto -> C(contexto) y sus continuaciones con C(contexto, palabra).
+    También se guardan los contextos sin continuación (al final de un
+    documento) para que C(contexto) siga siendo exacto al sumar documentos.
+    """
+    conteos = {orden: contador.conteos[orden] for orden in ordenes_modelo(n)}
+    contenido = escribir_modelo(
+        contador.vocabulario.palabras, conteos, n, usar_fronteras, contador.total
+    )
+    return contenido, len(conteos[n])
+
+
+@contextmanager
+def bloquear_fuente(fuente):
+    """
+    Serializa entre hilos y procesos los cambios a los modelos de un texto o
+    corpus: leer el archivo, sumarle o restarle conteos y reescribirlo, o
+    guardar un entrenamiento completo. Un hilo puede volver a pedirlo.
+    """
+    clave = clave_compartida(('fuente', type(fuente).__name__, fuente.pk))
+    bloqueadas = _fuentes_bloqueadas.__dict__.setdefault('claves', set())
+    if clave in bloqueadas:
+        yield
+        return
+    with _candado_modelos:
+        local = _candados_fuentes.setdefault(clave, threading.Lock())
+    with local, candado(clave):
+        bloqueadas.add(clave)
+        try:
+            yield
+        finally:
+            bloqueadas.discard(clave)
+
+
+def guardar_archivo_modelo(modelo, contenido, total_palabras, total_ngramas):
+    """
+    Reemplaza el archivo de un modelo y actualiza sus totales. El contenido
+    se escribe con un nombre temporal y recién completo ocupa el lugar del
+    anterior (os.replace), así quien abra el modelo mientras tanto nunca
+    encuentra el archivo faltante ni a medio escribir.
+    """
+    modelo.total_palabras = total_palabras
+    modelo.total_ngramas = total_ngramas
+    anterior = modelo.archivo.name if modelo.archivo else None
+    try:
+        # Un archivo de una versión anterior (JSON) se reemplaza por uno .bin
+        ruta = modelo.archivo.path if anterior and anterior.endswith('.bin') else None
+    except NotImplementedError:
+        ruta = None
+
+    if ruta is not None:
+        temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temporal, 'wb') as archivo:
+                archivo.write(contenido)
+            os.replace(temporal, ruta)
+        except OSError:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        modelo.save()
+        return modelo
+
+    # Si no, se guarda con otro nombre y el anterior se borra recién cuando
+    # el registro ya apunta al nuevo
+    modelo.archivo.save(
+        nombre_archivo_modelo(modelo.fuente, modelo.n, modelo.usar_fronteras),
+        ContentFile(contenido),
+        save=False,
+    )
+    modelo.save()
+    if anterior:
+        modelo.archivo.storage.delete(anterior)
+    return modelo
+
+
+def entrenar_modelo_ngramas(fuente, n, usar_fronteras=False, progreso=None):
+    """
+    Entrena el modelo de un texto o corpus y lo guarda (sobrescribe el
+    anterior). Se cuenta sin bloquear la fuente; si mientras tanto cambiaron
+    los textos del corpus, esos cambios se aplicaron al archivo anterior, así
+    que con la fuente bloqueada se vuelve a contar antes de guardar.
+    """
+    es_corpus = isinstance(fuente, Corpus)
+    if es_corpus:
+        textos = ids_textos(fuente)
+        contador = contar_corpus(fuente, ordenes_modelo(n), usar_fronteras, progreso)
+    else:
+        contador = contar_texto(fuente, ordenes_modelo(n), usar_fronteras, progreso)
+
+    with bloquear_fuente(fuente):
+        if es_corpus and ids_textos(fuente) != textos:
+            contador = contar_corpus(fuente, ordenes_modelo(n), usar_fronteras)
+        contenido, total_ngramas = serializar_modelo(contador, n, usar_fronteras)
+        modelo, _ = ModeloNgramas.objects.get_or_create(
+            n=n, usar_fronteras=usar_fronteras, **filtro_fuente(fuente)
+        )
+        return guardar_archivo_modelo(modelo, contenido, contador.total, total_ngramas)
+
+
+def ids_textos(corpus):
+    return list(corpus.textos.order_by('id').values_list('id', flat=True))
+
+
+def abrir_modelo(modelo):
+    """
+    Abre el archivo de un modelo con mmap. Lanza ValueError si no está en el
+    formato binario actual (por ejemplo, un JSON de una versión anterior).
+    """
+    try:
+        ruta = modelo.archivo.path
+    except NotImplementedError:
+        # Almacenamiento sin archivos locales: se lee completo en memoria
+        with modelo.archivo.open('rb') as archivo:
+            return ModeloBinario(archivo.read())
+    return ModeloBinario.abrir(ruta)
+
+
+def aplicar_conteos(modelo, contador, signo=1):
+    """
+    Suma (signo=1) o resta (signo=-1) los conteos de un documento a los de
+    un modelo guardado, sin releer el resto del corpus. contador debe
+    incluir todos los órdenes del modelo (por ejemplo, de contar_texto).
+    Los conteos de continuación y pesos de back-off se recalculan al
+    escribir el archivo. Hay que llamarla con la fuente bloqueada
+    (bloquear_fuente) para no perder cambios simultáneos.
+    """
+    # Otro proceso pudo reescribir el modelo desde que se leyó el registro
+    modelo.refresh_from_db()
+    try:
+        guardado = abrir_modelo(modelo)
+    except ValueError:
+        # Formato anterior: no hay conteos que actualizar, se entrena de nuevo
+        return entrenar_modelo_ngramas(modelo.fuente, modelo.n, modelo.usar_fronteras)
+
+    n = modelo.n
+    palabras = guardado.palabras()
+    conteos = guardado.conteos()
+    vocabulario = Vocabulario(palabras)
+
+    traducir = [vocabulario.id(palabra) for palabra in contador.vocabulario.palabras].__getitem__
+    for orden in ordenes_modelo(n):
+        destino = conteos[orden]
+        for clave, frecuencia in contador.conteos[orden].items():
+            clave = tuple(map(traducir, clave))
+            restante = destino[clave] + signo * frecuencia
+            if restante > 0:
+                destino[clave] = restante
+            else:
+                del destino[clave]
+
+    total_palabras = max(guardado.total_palabras + signo * contador.total, 0)
+    contenido = escribir_modelo(vocabulario.palabras, conteos, n, modelo.usar_fronteras, total_palabras)
+    return guardar_archivo_modelo(modelo, contenido, total_palabras, len(conteos[n]))
+
+
+def actualizar_modelos_corpus(corpus, texto_obj, signo=1):
+    """
+    Suma o resta un documento a todos los modelos ya entrenados de un corpus.
+    El documento se lee una vez por cada opción de fronteras.
+    """
+    modelos = list(corpus.modelos.exclude(archivo=''))
+    for usar_fronteras in {modelo.usar_fronteras for modelo in modelos}:
+        del_grupo = [modelo for modelo in modelos if modelo.usar_fronteras == usar_fronteras]
+        n_maximo = max(modelo.n for modelo in del_grupo)
+        contador = contar_texto(texto_obj, ordenes_modelo(n_maximo), usar_fronteras)
+        for modelo in del_grupo:
+            aplicar_conteos(modelo, contador, signo)
+
+
+def agregar_texto_corpus(corpus, texto_obj):
+    """Agrega un texto a un corpus y actualiza sus modelos con solo ese texto"""
+    with bloquear_fuente(corpus):
+        if corpus.textos.filter(id=texto_obj.id).exists():
+            return
+        corpus.textos.add(texto_obj)
+        actualizar_modelos_corpus(corpus, texto_obj, signo=1)
+
+
+def quitar_texto_corpus(corpus, texto_obj):
+    """Quita un texto de un corpus y descuenta sus conteos de los modelos"""
+    with bloquear_fuente(corpus):
+        if not corpus.textos.filter(id=texto_obj.id).exists():
+            return
+        actualizar_modelos_corpus(corpus, texto_obj, signo=-1)
+        corpus.textos.remove(texto_obj)
+
+
+def buscar_modelo(fuente, n, usar_fronteras=False):
+    """Devuelve el modelo guardado, o None si todavía no se ha entrenado"""
+    return ModeloNgramas.objects.filter(
+        n=n, usar_fronteras=usar_fronteras, **filtro_fuente(fuente)
+    ).exclude(archivo='').first()
+
+
+def obtener_modelo(fuente, n, usar_fronteras=False):
+    """Devuelve el modelo guardado; solo lo entrena si todavía no existe"""
+    modelo = buscar_modelo(fuente, n, usar_fronteras)
+    if modelo is None:
+        modelo = entrenar_modelo_ngramas(fuente, n, usar_fronteras)
+    return modelo
+
+
+def indice_en_memoria(modelo):
+    """El índice del modelo si ya está abierto en este proceso, o None"""
+    return _modelos_cargados.get((modelo.pk, modelo.fecha_entrenamiento))
+
+
+def cargar_indice(modelo):
+    """
+    Abre el índice contexto -> (C(contexto), continuaciones ordenadas)
+    de un modelo guardado, sin recalcular nada del corpus ni deserializarlo
+    """
+    clave = (modelo.pk, modelo.fecha_entrenamiento)
+    indice = _modelos_cargados.get(clave)
+    if indice is not None:
+        return indice
+
+    try:
+        indice = abrir_modelo(modelo)
+    except ValueError:
+        # Modelo guardado con un formato anterior: se vuelve a entrenar
+        modelo = entrenar_modelo_ngramas(modelo.fuente, modelo.n, modelo.usar_fronteras)
+        return cargar_indice(modelo)
+
+    with _candado_modelos:
+        # Se descartan versiones anteriores del mismo modelo
+        for clave_vieja in [c for c in _modelos_cargados if c[0] == modelo.pk]:
+            del _modelos_cargados[clave_vieja]
+        _modelos_cargados[clave] = indice
+    return indice
+
+
+def pool_carga():
+    """Hilos para abrir modelos desde las vistas async (ANALISIS_HILOS_CARGA)"""
+    global _pool_carga
+    with _candado_modelos:
+        if _pool_carga is None:
+            _pool_carga = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ANALISIS_HILOS_CARGA', 4),
+                thread_name_prefix='carga_modelos',
+            )
+    return _pool_carga
+
+
+async def cargar_indice_async(modelo):
+    """
+    cargar_indice para vistas async: si el modelo ya está abierto se
+    devuelve sin esperar; si no, se abre (o reentrena) en pool_carga para
+    no bloquear el bucle de eventos
+    """
+    indice = indice_en_memoria(modelo)
+    if indice is None:
+        indice = await sync_to_async(cargar_indice, thread_sensitive=False, executor=pool_carga())(modelo)
+    return indice
+
+
+def buscar_sugerencias(indice, contexto, max_sugerencias, suavizado='mle', k=1.0, prefijo=''):
+    """
+    Sugerencias para un contexto. Con mle es una búsqueda binaria y un
+    corte; con otro método de suavizado.py, si el contexto no aparece en el
+    corpus se retrocede a contextos más cortos en lugar de no sugerir nada.
+    Con prefijo se completa la palabra que se está escribiendo.
+    """
+    if suavizado != 'mle' or prefijo:
+        estimador = ModeloSuavizado(indice, suavizado, k=k)
+        return [
+            {
+                'palabra': palabra,
+                'probabilidad': probabilidad,
+                'frecuencia_ngrama': frecuencia,
+                'frecuencia_contexto': frecuencia_contexto,
+                'orden': orden,
+                'ngrama_completo': f'{contexto} {palabra}'.lstrip(),
+            }
+            for palabra, probabilidad, frecuencia, frecuencia_contexto, orden
+            in estimador.sugerencias(contexto.split(), max_sugerencias, prefijo)
+        ]
+
+    entrada = indice.get(contexto, limite=max_sugerencias)
+    if entrada is None:
+        return []
+
+    frecuencia_contexto, continuaciones = entrada
+    return [
+        {
+            'palabra': palabra,
+            'probabilidad': frecuencia / frecuencia_contexto if frecuencia_contexto else 0.0,
+            'frecuencia_ngrama': frecuencia,
+            'frecuencia_contexto': frecuencia_contexto,
+            'ngrama_completo': f'{contexto} {palabra}',
+        }
+        for palabra, frecuencia in continuaciones[:max_sugerencias]
+    ]
+
+
+def completar_frases(modelo, contexto, max_frases, suavizado='kneser_ney', k=1.0,
+                     ancho=ANCHO_HAZ_DEFECTO, longitud=LONGITUD_FRASE_DEFECTO):
+    """
+    Frases de hasta `longitud` palabras que continúan el contexto, por
+    búsqueda en haz. Las expansiones de cada contexto quedan en la cache del
+    proceso y se reutilizan entre búsquedas del mismo modelo.
+    """
+    indice = cargar_indice(modelo)
+    estimador = ModeloSuavizado(indice, suavizado, k=k)
+    clave_modelo = ('expansion', modelo.pk, modelo.fecha_entrenamiento, suavizado, k, ancho)
+
+    def expandir(ids):
+        return cache.obtener(clave_modelo + (ids,), lambda: estimador.expansiones(ids, ancho))
+
+    frases = estimador.frases(contexto.split(), max_frases, ancho, longitud, expandir)
+    return [
+        {
+            'frase': ' '.join(palabras),
+            'palabras': palabras,
+            'probabilidad': math.exp(log_probabilidad),
+            'log_probabilidad': log_probabilidad,
+        }
+        for palabras, log_probabilidad in frases
+    ]
+
+
+def cargar_probabilidades(modelo):
+    """
+    Reconstruye a partir del índice guardado el mismo formato que devuelve
+    calcular_probabilidad_ngramas
+    """
+    probabilidades = {}
+    for contexto, (frecuencia_contexto, continuaciones) in cargar_indice(modelo).items():
+        for palabra, frecuencia in continuaciones:
+            ngrama, datos = fila_probabilidad(contexto, palabra, frecuencia, frecuencia_contexto, modelo.n)
+            probabilidades[ngrama] = datos
+    return probabilidades
+
+
+def tabla_probabilidades(modelo, criterio='frecuencia'):
+    """
+    Tabla paginada (utils.TablaPaginada) de los n-gramas de orden n de un
+    modelo guardado, ordenada por frecuencia, probabilidad o contexto. Lee
+    directamente las columnas del archivo: el orden por contexto es el del
+    archivo y los otros dos se ordenan una vez por proceso (cache).
+    """
+    indice = cargar_indice(modelo)
+    tabla = indice.tablas[modelo.n]
+    frecuencias = tabla.frecuencias
+    frecuencias_contexto = tabla.frecuencias_contexto
+
+    def fila(fila_tabla):
+        posicion = tabla.contexto_fila(fila_tabla)
+        contexto = ' '.join(indice.palabra(id_palabra) for id_palabra in tabla.contexto(posicion))
+        return fila_probabilidad(
+            contexto, indice.palabra(tabla.ids[fila_tabla]),
+            frecuencias[fila_tabla], frecuencias_contexto[posicion], modelo.n,
+        )
+
+    if criterio == 'contexto':
+        clave = None
+    elif criterio == 'probabilidad':
+        contextos = tabla.contextos_filas()
+
+        def clave(fila_tabla):
+            return frecuencias[fila_tabla] / frecuencias_contexto[contextos[fila_tabla]], frecuencias[fila_tabla]
+    else:
+        clave = frecuencias.__getitem__
+    return TablaPaginada(
+        tabla.num_continuaciones, lambda: range(tabla.num_continuaciones), fila, clave,
+        cache=cache, clave_cache=('orden_tabla', modelo.pk, modelo.fecha_entrenamiento, criterio),
+    )
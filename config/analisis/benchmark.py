@@ -0,0 +1,208 @@
+"""Herramientas de medición de rendimiento del procesamiento de texto.
+
+Incluye un generador determinista de corpus sintético en español para poder
+comparar resultados entre ejecuciones y máquinas, la medición de tiempos
+(percentiles, throughput y memoria pico) y la comparación contra una línea
+base guardada en JSON. El comando ``benchmark`` arma la suite completa.
+"""
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from .utils import STOPWORDS_ES
+
+# Palabras de contenido con acentos, ñ y ü para ejercitar la normalización
+PALABRAS_CONTENIDO = [
+    'perro', 'gato', 'casa', 'árbol', 'canción', 'niño', 'niña', 'pingüino',
+    'corazón', 'música', 'ciudad', 'camión', 'lápiz', 'jardín', 'montaña',
+    'río', 'océano', 'película', 'teléfono', 'último', 'sistema', 'análisis',
+    'información', 'computadora', 'lingüística', 'español', 'año', 'mañana',
+    'señor', 'señora', 'doctora', 'julieta', 'proceso', 'procesamiento',
+    'texto', 'palabra', 'oración', 'modelo', 'probabilidad', 'frecuencia',
+    'come', 'corre', 'escribe', 'lee', 'canta', 'camina', 'estudia', 'trabaja',
+    'grande', 'pequeño', 'rápido', 'fácil', 'difícil', 'público', 'económico',
+    'político', 'histórico', 'científico', 'nueva', 'vieja', 'hermosa',
+]
+
+PUNTUACION_INTERNA = [',', ',', ';', ':', ' (nota)', ' "cita"']
+FINALES_ORACION = ['.', '.', '.', '!', '?', '...']
+
+
+# Percentiles de tiempo que se informan y tolerancia por defecto al
+# comparar la mediana con la línea base (0.10 = 10 % más lenta)
+PERCENTILES = (50, 90, 99)
+TOLERANCIA_DEFECTO = 0.10
+
+
+def oraciones_sinteticas(semilla=0):
+    """Oraciones en español generadas sin fin; con la misma semilla, siempre las mismas"""
+    generador = random.Random(semilla)
+    vocabulario = PALABRAS_CONTENIDO + sorted(STOPWORDS_ES)
+    # Distribución tipo Zipf para que haya n-gramas repetidos
+    pesos = [1 / (rango + 1) for rango in range(len(vocabulario))]
+    generador.shuffle(pesos)
+
+    while True:
+        palabras = generador.choices(vocabulario, weights=pesos, k=generador.randint(5, 20))
+        palabras[0] = palabras[0].capitalize()
+        if generador.random() < 0.3:
+            posicion = generador.randrange(1, len(palabras))
+            palabras[posicion - 1] += generador.choice(PUNTUACION_INTERNA)
+        inicio = '¿' if generador.random() < 0.05 else ''
+        oracion = inicio + ' '.join(palabras) + generador.choice(FINALES_ORACION)
+        oracion += '\n' if generador.random() < 0.1 else ' '
+        yield oracion
+
+
+def generar_corpus_sintetico(tamano_bytes, semilla=0):
+    """
+    Genera un texto en español de aproximadamente tamano_bytes bytes (UTF-8).
+    Con la misma semilla siempre produce el mismo texto.
+    """
+    partes = []
+    tamano = 0
+    for oracion in oraciones_sinteticas(semilla):
+        if tamano >= tamano_bytes:
+            break
+        partes.append(oracion)
+        tamano += len(oracion.encode('utf-8'))
+
+    return ''.join(partes)
+
+
+def escribir_corpus_sintetico(archivo, tamano_bytes, semilla=0, tamano_bloque=1024 * 1024):
+    """
+    Escribe en un archivo binario el mismo texto que generar_corpus_sintetico,
+    de a bloques, sin tenerlo entero en memoria (para los tamaños grandes).
+    Devuelve los bytes escritos.
+    """
+    partes = []
+    pendiente = tamano = 0
+    for oracion in oraciones_sinteticas(semilla):
+        if tamano >= tamano_bytes:
+            break
+        codificada = oracion.encode('utf-8')
+        partes.append(codificada)
+        tamano += len(codificada)
+        pendiente += len(codificada)
+        if pendiente >= tamano_bloque:
+            archivo.write(b''.join(partes))
+            partes = []
+            pendiente = 0
+    archivo.write(b''.join(partes))
+    return tamano
+
+
+def percentil(valores, porcentaje):
+    """Percentil con interpolación lineal entre los valores ordenados"""
+    ordenados = sorted(valores)
+    posicion = (len(ordenados) - 1) * porcentaje / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+def resumir_tiempos(tiempos, bytes_procesados=None):
+    """Mejor, media y percentiles (en segundos) y, con bytes_procesados, MB/s según la mediana"""
+    resumen = {
+        'repeticiones': len(tiempos),
+        'mejor': min(tiempos),
+        'media': sum(tiempos) / len(tiempos),
+    }
+    for porcentaje in PERCENTILES:
+        resumen[f'p{porcentaje}'] = percentil(tiempos, porcentaje)
+    if bytes_procesados:
+        resumen['mb_por_segundo'] = bytes_procesados / 1_000_000 / resumen['p50'] if resumen['p50'] > 0 else None
+    return resumen
+
+
+def memoria_pico(funcion):
+    """Memoria pico (MB) que reserva Python durante una llamada a funcion()"""
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico / 1_000_000
+
+
+def medir(funcion, repeticiones=3, bytes_procesados=None, memoria=True):
+    """
+    Llama funcion() `repeticiones` veces y resume los tiempos. La memoria
+    pico se mide en una llamada aparte, porque tracemalloc la hace más lenta.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    resultado = resumir_tiempos(tiempos, bytes_procesados)
+    if memoria:
+        resultado['memoria_pico_mb'] = memoria_pico(funcion)
+    return resultado
+
+
+def medir_peticiones(cliente, peticiones, memoria=True, muestra_memoria=20):
+    """
+    Latencias de una lista de peticiones (metodo, url, datos) hechas con un
+    cliente de pruebas de Django. La primera (en frío) se informa aparte;
+    la memoria pico se mide repitiendo las primeras `muestra_memoria`.
+    """
+    def hacer(metodo, url, datos):
+        respuesta = getattr(cliente, metodo)(url, datos)
+        if respuesta.status_code >= 400:
+            raise RuntimeError(f'{metodo.upper()} {url} respondió {respuesta.status_code}')
+
+    tiempos = []
+    for metodo, url, datos in peticiones:
+        inicio = time.perf_counter()
+        hacer(metodo, url, datos)
+        tiempos.append(time.perf_counter() - inicio)
+    resultado = resumir_tiempos(tiempos)
+    resultado['primera'] = tiempos[0]
+    resultado['peticiones_por_segundo'] = len(tiempos) / sum(tiempos)
+    if memoria:
+        resultado['memoria_pico_mb'] = memoria_pico(
+            lambda: [hacer(*peticion) for peticion in peticiones[:muestra_memoria]]
+        )
+    return resultado
+
+
+def entorno():
+    """Datos de la máquina que acompañan a los resultados guardados"""
+    return {
+        'python': platform.python_version(),
+        'implementacion': platform.python_implementation(),
+        'plataforma': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+    }
+
+
+def guardar_resultados(ruta, resultados, parametros):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump({'entorno': entorno(), 'parametros': parametros, 'resultados': resultados}, archivo, indent=2)
+
+
+def cargar_resultados(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)['resultados']
+
+
+def comparar_con_base(resultados, base, tolerancia=TOLERANCIA_DEFECTO):
+    """
+    Compara la mediana de cada medición con la de la línea base:
+    [(nombre, actual, anterior, cambio relativo, es_regresion)] para las
+    mediciones que están en ambas
+    """
+    comparacion = []
+    for nombre, resultado in resultados.items():
+        anterior = base.get(nombre, {}).get('p50')
+        if not anterior:
+            continue
+        cambio = resultado['p50'] / anterior - 1
+        comparacion.append((nombre, resultado['p50'], anterior, cambio, cambio > tolerancia))
+    return comparacion
+
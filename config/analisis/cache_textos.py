@@ -0,0 +1,456 @@
+"""Cache en memoria del proceso de textos tokenizados y tablas de conteo.
+
+Las páginas de análisis y comparación vuelven a pedir el mismo texto con
+distintos ``n``. Cada texto se tokeniza una sola vez, al subirlo
+(``preprocesar_texto``): sus tokens quedan codificados en disco como un
+flujo de ids (formato_tokens.py). Con esta cache ese flujo se carga una sola
+vez por proceso y cada orden de n-gramas se cuenta una sola vez. Las claves
+incluyen la suma SHA-256 del archivo, así un texto reemplazado nunca
+devuelve datos viejos; además las señales de signals.py vacían las entradas
+de un texto al modificarlo o borrarlo.
+
+El tamaño se mide en unidades: una por token guardado y una por n-grama
+distinto de cada tabla (``ANALISIS_CACHE_TAMANO`` en settings).
+
+Detrás de la cache del proceso hay un segundo nivel compartido entre
+procesos: el alias de ``CACHES`` indicado en ``ANALISIS_CACHE_COMPARTIDA``.
+Ahí se guardan las tablas serializadas como arreglos de enteros, así lo
+que calcula un worker lo aprovechan los demás. Un candado (``cache.add``)
+hace que ante una clave fría solo un proceso la calcule
+mientras los demás esperan su resultado.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+
+from .conteo import Vocabulario, contar_multiorden
+from .formato_tokens import FlujoTokens, codificar_tokens, escribir_flujo
+from .models import TextoAnalizado
+from .utils import (
+    estadisticas_procesamiento, leer_bloques, ordenes_procesamiento, resultado_desde_conteos,
+    vista_resultado,
+)
+
+# Unidades por defecto (tokens + n-grama distintos) que puede ocupar la cache
+TAMANO_DEFECTO = 5_000_000
+
+# Campos de TextoAnalizado que se llenan al preprocesar el texto
+CAMPOS_PREPROCESADO = ('estadisticas', 'tokens', 'total_tokens', 'tamano_vocabulario', 'suma')
+
+# Segundos que dura un candado y cada cuánto se revisa mientras se espera
+DURACION_CANDADO = 120
+INTERVALO_ESPERA = 0.05
+
+
+class CacheLRU:
+    """
+    Cache LRU acotada por la suma del costo de sus entradas, segura entre
+    hilos, con contadores de aciertos, fallos y desalojos
+    """
+
+    def __init__(self, tamano_maximo):
+        self.tamano_maximo = tamano_maximo
+        self.tamano = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self._entradas = OrderedDict()
+        self._candado = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def buscar(self, clave):
+        """Valor guardado para la clave, o None si no está"""
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def obtener(self, clave, calcular, costo=len):
+        """Devuelve el valor de la clave; si no está lo calcula y lo guarda"""
+        valor = self.buscar(clave)
+        if valor is None:
+            # El cálculo se hace fuera del candado para no bloquear otros hilos
+            valor = calcular()
+            self.guardar(clave, valor, costo(valor))
+        return valor
+
+    def guardar(self, clave, valor, costo):
+        with self._candado:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.tamano -= anterior[1]
+            if costo > self.tamano_maximo:
+                # Nunca cabría: no vale la pena desalojar todo lo demás
+                return
+            self._entradas[clave] = (valor, costo)
+            self.tamano += costo
+            while self.tamano > self.tamano_maximo:
+                _, (_, costo_viejo) = self._entradas.popitem(last=False)
+                self.tamano -= costo_viejo
+                self.desalojos += 1
+
+    def invalidar(self, predicado):
+        """Elimina las entradas cuya clave cumple el predicado"""
+        with self._candado:
+            for clave in [clave for clave in self._entradas if predicado(clave)]:
+                self.tamano -= self._entradas.pop(clave)[1]
+
+    def vaciar(self):
+        with self._candado:
+            self._entradas.clear()
+            self.tamano = 0
+
+    def estadisticas(self):
+        with self._candado:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'tamano': self.tamano,
+                'tamano_maximo': self.tamano_maximo,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+            }
+
+
+cache = CacheLRU(getattr(settings, 'ANALISIS_CACHE_TAMANO', TAMANO_DEFECTO))
+
+# Contadores del nivel compartido vistos desde este proceso
+estadisticas_compartida = {'aciertos': 0, 'fallos': 0, 'esperas': 0}
+
+
+def cache_compartida():
+    """Backend de CACHES compartido entre procesos, o None si no hay"""
+    alias = getattr(settings, 'ANALISIS_CACHE_COMPARTIDA', None)
+    return caches[alias] if alias else None
+
+
+def clave_compartida(clave):
+    return 'analisis:' + ':'.join(map(str, clave))
+
+
+@contextmanager
+def candado(nombre, espera=DURACION_CANDADO):
+    """
+    Candado entre procesos sobre la cache compartida. Devuelve True si se
+    obtuvo; tras `espera` segundos sin obtenerlo se sigue igualmente (False)
+    para que un proceso caído no bloquee a los demás.
+    """
+    compartida = cache_compartida()
+    if compartida is None:
+        yield True
+        return
+
+    clave = f'{nombre}:candado'
+    dueno = uuid.uuid4().hex
+    limite = time.monotonic() + espera
+    obtenido = compartida.add(clave, dueno, DURACION_CANDADO)
+    if not obtenido:
+        estadisticas_compartida['esperas'] += 1
+    while not obtenido and time.monotonic() < limite:
+        time.sleep(INTERVALO_ESPERA)
+        obtenido = compartida.add(clave, dueno, DURACION_CANDADO)
+    try:
+        yield obtenido
+    finally:
+        if obtenido and compartida.get(clave) == dueno:
+            compartida.delete(clave)
+
+
+def obtener_compartido(clave, calcular, serializar, deserializar):
+    """
+    Valor de la cache compartida; si no está, un solo proceso lo calcula
+    (los demás esperan el candado y luego lo leen)
+    """
+    compartida = cache_compartida()
+    if compartida is None:
+        return calcular()
+
+    nombre = clave_compartida(clave)
+    datos = compartida.get(nombre)
+    if datos is None:
+        with candado(nombre):
+            # Mientras se esperaba el candado otro proceso pudo calcularlo
+            datos = compartida.get(nombre)
+            if datos is None:
+                estadisticas_compartida['fallos'] += 1
+                valor = calcular()
+                compartida.set(nombre, serializar(valor))
+                return valor
+    estadisticas_compartida['aciertos'] += 1
+    return deserializar(datos)
+
+
+def serializar_conteo(conteo):
+    """Counter de tuplas de ids -> (orden, bytes de las claves, bytes de las frecuencias)"""
+    claves = array('I')
+    frecuencias = array('I')
+    for clave, frecuencia in conteo.items():
+        claves.extend(clave)
+        frecuencias.append(frecuencia)
+    orden = len(next(iter(conteo))) if conteo else 0
+    return orden, claves.tobytes(), frecuencias.tobytes()
+
+
+def deserializar_conteo(datos):
+    orden, claves_bytes, frecuencias_bytes = datos
+    if not orden:
+        return Counter()
+    claves = array('I')
+    claves.frombytes(claves_bytes)
+    frecuencias = array('I')
+    frecuencias.frombytes(frecuencias_bytes)
+    iterador = iter(claves)
+    return Counter(dict(zip(zip(*[iterador] * orden), frecuencias)))
+
+
+def suma_archivo(texto_obj):
+    """
+    SHA-256 del archivo de un texto. Se recuerda por nombre, tamaño y fecha
+    de modificación para no releer el archivo en cada petición.
+    """
+    archivo = texto_obj.archivo
+    try:
+        modificado = archivo.storage.get_modified_time(archivo.name)
+    except NotImplementedError:
+        modificado = None
+    huella = (archivo.name, archivo.size, modificado)
+
+    def calcular():
+        suma = hashlib.sha256()
+        with archivo.open('rb') as contenido:
+            for bloque in iter(lambda: contenido.read(1024 * 1024), b''):
+                suma.update(bloque)
+        return suma.hexdigest()
+
+    return cache.obtener(('suma', texto_obj.id, huella), calcular, costo=lambda valor: 1)
+
+
+def nombre_archivo_tokens(texto_obj):
+    """Nombre del archivo en disco para el flujo de tokens de un texto"""
+    return f'texto_{texto_obj.id}.tok'
+
+
+def abrir_flujo(texto_obj):
+    """Abre con mmap el flujo de tokens guardado de un texto"""
+    try:
+        ruta = texto_obj.tokens.path
+    except NotImplementedError:
+        # Almacenamiento sin archivos locales: se lee completo en memoria
+        with texto_obj.tokens.open('rb') as archivo:
+            return FlujoTokens(archivo.read())
+    return FlujoTokens.abrir(ruta)
+
+
+def preprocesar_texto(texto_obj, suma=None):
+    """
+    Lee el archivo de un texto una sola vez para calcular sus estadísticas
+    de procesamiento y codificar sus tokens (formato_tokens.py). El flujo se
+    guarda junto al texto y el total de tokens, el tamaño del vocabulario y
+    la suma del archivo quedan en el registro.
+    """
+    suma = suma or suma_archivo(texto_obj)
+    vocabulario = ids = oraciones = None
+
+    def codificar(tokens):
+        nonlocal vocabulario, ids, oraciones
+        vocabulario, ids, oraciones = codificar_tokens(tokens)
+        return len(ids)
+
+    with texto_obj.archivo.open('rb') as archivo:
+        estadisticas = estadisticas_procesamiento(leer_bloques(archivo), consumir=codificar)
+
+    if texto_obj.tokens:
+        texto_obj.tokens.delete(save=False)
+    texto_obj.tokens.save(
+        nombre_archivo_tokens(texto_obj),
+        ContentFile(escribir_flujo(vocabulario.palabras, ids, oraciones)),
+        save=False,
+    )
+    texto_obj.estadisticas = estadisticas
+    texto_obj.total_tokens = len(ids)
+    texto_obj.tamano_vocabulario = len(vocabulario)
+    texto_obj.suma = suma
+    # update() no dispara las señales que vacían la cache del texto
+    TextoAnalizado.objects.filter(pk=texto_obj.pk).update(
+        **{campo: getattr(texto_obj, campo) for campo in CAMPOS_PREPROCESADO}
+    )
+    return texto_obj
+
+
+def preprocesado(texto_obj, suma):
+    return texto_obj.suma == suma and texto_obj.estadisticas is not None and bool(texto_obj.tokens)
+
+
+def asegurar_preprocesado(texto_obj, suma=None):
+    """
+    Deja al día las estadísticas y el flujo de tokens de un texto: se arman
+    al subirlo y de nuevo si el archivo cambió o el texto es anterior. Un
+    candado evita que dos procesos armen a la vez los del mismo texto.
+    Devuelve la suma del archivo.
+    """
+    suma = suma or suma_archivo(texto_obj)
+    if not preprocesado(texto_obj, suma):
+        with candado(clave_compartida(('preprocesar', texto_obj.id))):
+            # Mientras se esperaba el candado otro proceso pudo armarlos
+            texto_obj.refresh_from_db(fields=CAMPOS_PREPROCESADO)
+            if not preprocesado(texto_obj, suma):
+                preprocesar_texto(texto_obj, suma)
+    return suma
+
+
+def estadisticas_texto(texto_obj):
+    """Estadísticas de procesamiento de un texto (utils.estadisticas_procesamiento)"""
+    asegurar_preprocesado(texto_obj)
+    return texto_obj.estadisticas
+
+
+def flujo_texto(texto_obj, suma=None):
+    """FlujoTokens de un texto, armándolo antes si hace falta"""
+    suma = asegurar_preprocesado(texto_obj, suma)
+    try:
+        return abrir_flujo(texto_obj)
+    except (OSError, ValueError):
+        # Archivo borrado o de otra versión del formato: se vuelve a armar
+        preprocesar_texto(texto_obj, suma)
+        return abrir_flujo(texto_obj)
+
+
+def tokens_texto(texto_obj, usar_fronteras=False, suma=None):
+    """
+    (Vocabulario, arreglo de ids) con los tokens limpios del texto, los mismos
+    que limpiar_texto o limpiar_texto_con_fronteras. Salen del flujo de tokens
+    guardado al subir el texto, sin volver a leer el archivo original.
+    """
+    suma = suma or suma_archivo(texto_obj)
+
+    def calcular():
+        flujo = flujo_texto(texto_obj, suma)
+        return Vocabulario(flujo.palabras(usar_fronteras)), flujo.ids(usar_fronteras)
+
+    return cache.obtener(
+        (texto_obj.id, suma, usar_fronteras, None), calcular, costo=lambda valor: len(valor[1]) + len(valor[0])
+    )
+
+
+def conteos_texto(texto_obj, usar_fronteras, ordenes):
+    """
+    (Vocabulario, arreglo de ids, {orden: Counter}) de un texto. Cada orden
+    se guarda por separado; los que faltan se cuentan juntos en una pasada.
+    """
+    suma = suma_archivo(texto_obj)
+    vocabulario, ids = tokens_texto(texto_obj, usar_fronteras, suma)
+    conteos = {}
+    faltantes = []
+    for orden in sorted(set(ordenes)):
+        conteo = cache.buscar((texto_obj.id, suma, usar_fronteras, orden))
+        if conteo is None:
+            faltantes.append(orden)
+        else:
+            conteos[orden] = conteo
+
+    # Los órdenes que tampoco están en la cache compartida se cuentan juntos
+    # en una sola pasada, la primera vez que hace falta alguno
+    contados = {}
+
+    def contar(orden):
+        if not contados:
+            contados.update(contar_multiorden(ids, faltantes))
+        return contados[orden]
+
+    for orden in faltantes:
+        clave = (texto_obj.id, suma, usar_fronteras, orden)
+        conteo = obtener_compartido(clave, partial(contar, orden), serializar_conteo, deserializar_conteo)
+        conteos[orden] = conteo
+        cache.guardar(clave, conteo, len(conteo) or 1)
+    return vocabulario, ids, conteos
+
+
+def invalidar_texto(texto_id):
+    """Quita de la cache todo lo de un texto (al modificarlo o borrarlo)"""
+    cache.invalidar(
+        lambda clave: clave[0] == texto_id or clave[:2] in (('suma', texto_id), ('vista_resultado', texto_id))
+    )
+
+
+def estadisticas_cache():
+    return dict(cache.estadisticas(), compartida=dict(estadisticas_compartida))
+
+
+class TokensTexto(Sequence):
+    """Lista de solo lectura de los tokens de un texto; decodifica los ids al leerlos"""
+
+    def __init__(self, vocabulario, ids):
+        self.vocabulario = vocabulario
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return list(map(self.vocabulario.palabras.__getitem__, self.ids[posicion]))
+        return self.vocabulario.palabras[self.ids[posicion]]
+
+    def __iter__(self):
+        return map(self.vocabulario.palabras.__getitem__, self.ids)
+
+    def __eq__(self, otro):
+        if isinstance(otro, (TokensTexto, list, tuple)):
+            return list(self) == list(otro)
+        return NotImplemented
+
+
+def palabras_texto(texto_obj, usar_fronteras=False):
+    """Lista de tokens limpios del texto, a partir de los ids guardados"""
+    vocabulario, ids = tokens_texto(texto_obj, usar_fronteras)
+    return list(map(vocabulario.palabras.__getitem__, ids))
+
+
+def procesar_texto_guardado(texto_obj, n_grama=1, usar_fronteras=False, n_gramas_comparacion=None):
+    """procesar_texto_completo con los tokens y conteos de la cache"""
+    if n_gramas_comparacion is None:
+        n_gramas_comparacion = [2, 3, 4, 5]
+    vocabulario, ids = tokens_texto(texto_obj, usar_fronteras)
+    ordenes = ordenes_procesamiento(n_grama, n_gramas_comparacion, len(ids))
+    _, _, conteos = conteos_texto(texto_obj, usar_fronteras, ordenes)
+    return resultado_desde_conteos(
+        vocabulario, TokensTexto(vocabulario, ids), conteos,
+        n_grama, usar_fronteras, n_gramas_comparacion,
+    )
+
+
+def vista_resultado_texto(texto_obj, n_grama=1, usar_fronteras=False, n_gramas_comparacion=None, suma=None):
+    """
+    utils.vista_resultado de un texto, con los tokens y conteos de la cache.
+    El resultado (unas pocas filas) también queda en la cache.
+    """
+    if n_gramas_comparacion is None:
+        n_gramas_comparacion = [2, 3, 4, 5]
+    suma = suma or suma_archivo(texto_obj)
+
+    def calcular():
+        _, ids = tokens_texto(texto_obj, usar_fronteras, suma)
+        ordenes = ordenes_procesamiento(n_grama, n_gramas_comparacion, len(ids))
+        vocabulario, ids, conteos = conteos_texto(texto_obj, usar_fronteras, ordenes)
+        return vista_resultado(vocabulario, len(ids), conteos, n_grama, n_gramas_comparacion)
+
+    clave = ('vista_resultado', texto_obj.id, suma, n_grama, usar_fronteras, tuple(n_gramas_comparacion))
+    return cache.obtener(clave, calcular, costo=lambda vista: 1 + len(vista['palabras_comunes']) + len(vista['ngramas_comunes']))
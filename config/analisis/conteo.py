@@ -0,0 +1,210 @@
+"""Motor de conteo de n-gramas sobre ids enteros.
+
+Cada token se interna una sola vez en un ``Vocabulario`` y el texto pasa a
+ser un arreglo de enteros. Los n-gramas se cuentan como tuplas de ids, sin
+crear cadenas intermedias; las cadenas solo se arman al mostrar resultados.
+"""
+from array import array
+from collections import Counter
+from itertools import islice
+
+from .metricas import etapa_acumulada, medir
+
+# Tokens que se codifican y cuentan de una vez al procesar un flujo
+TAMANO_LOTE = 200_000
+
+
+class Vocabulario:
+    """Asigna un id entero a cada palabra distinta"""
+
+    def __init__(self, palabras=()):
+        self.ids = {}
+        self.palabras = []
+        for palabra in palabras:
+            self.id(palabra)
+
+    def __len__(self):
+        return len(self.palabras)
+
+    def __contains__(self, palabra):
+        return palabra in self.ids
+
+    def id(self, palabra):
+        """Id de una palabra; la agrega si todavía no existe"""
+        id_palabra = self.ids.get(palabra)
+        if id_palabra is None:
+            id_palabra = self.ids[palabra] = len(self.palabras)
+            self.palabras.append(palabra)
+        return id_palabra
+
+    def buscar(self, palabras):
+        """Tupla de ids de palabras ya conocidas; None si alguna no existe"""
+        try:
+            return tuple(self.ids[palabra] for palabra in palabras)
+        except KeyError:
+            return None
+
+    def codificar(self, tokens):
+        """Convierte una lista de tokens en un arreglo compacto de ids"""
+        ids = self.ids
+        palabras = self.palabras
+        resultado = array('I')
+        for token in tokens:
+            id_palabra = ids.get(token)
+            if id_palabra is None:
+                id_palabra = ids[token] = len(palabras)
+                palabras.append(token)
+            resultado.append(id_palabra)
+        return resultado
+
+    def palabra(self, id_palabra):
+        return self.palabras[id_palabra]
+
+    def decodificar(self, clave):
+        """Convierte una tupla de ids en el n-grama como texto"""
+        palabras = self.palabras
+        return ' '.join(palabras[i] for i in clave)
+
+
+def contar_ngramas_ids(ids, n):
+    """Cuenta los n-gramas de un arreglo de ids como tuplas de enteros"""
+    if n < 1 or len(ids) < n:
+        return Counter()
+    if n == 1:
+        return Counter((i,) for i in ids)
+    # Ventanas deslizantes sin copiar el arreglo
+    return Counter(zip(*(islice(ids, desplazamiento, None) for desplazamiento in range(n))))
+
+
+@medir('conteo')
+def contar_multiorden(ids, ordenes):
+    """
+    Cuenta en una sola pasada los n-gramas de todos los órdenes pedidos y de
+    sus contextos (orden n-1). Solo se recorre el texto para el orden más alto
+    de cada bloque de órdenes consecutivos; cada orden inferior se obtiene
+    sumando los prefijos del orden superior. Devuelve {orden: Counter}.
+    """
+    return _contar_multiorden(ids, ordenes)
+
+
+def _contar_multiorden(ids, ordenes):
+    # Sin medir: ContadorIncremental lo llama en cada lote y quien lo usa
+    # mide la llamada completa
+    necesarios = set()
+    for n in ordenes:
+        if n >= 1:
+            necesarios.add(n)
+        if n >= 2:
+            necesarios.add(n - 1)
+
+    total = len(ids)
+    conteos = {}
+    for k in sorted(necesarios, reverse=True):
+        superior = conteos.get(k + 1)
+        if superior is None:
+            conteos[k] = contar_ngramas_ids(ids, k)
+            continue
+
+        # Los k-gramas son los prefijos de los (k+1)-gramas más el último
+        # k-grama del texto, que no tiene continuación
+        conteo = Counter()
+        for clave, frecuencia in superior.items():
+            conteo[clave[:k]] += frecuencia
+        if total >= k:
+            conteo[tuple(ids[total - k:])] += 1
+        conteos[k] = conteo
+
+    return conteos
+
+
+def indexar_ids_por_contexto(freq_ngramas, freq_contextos):
+    """
+    Agrupa n-gramas contados por contexto:
+    contexto (tupla de ids) -> (C(contexto), [(id_palabra, C(contexto, palabra)), ...])
+    con las continuaciones ordenadas de mayor a menor frecuencia
+    """
+    indice = {}
+    for clave, frecuencia in freq_ngramas.items():
+        contexto = clave[:-1]
+        entrada = indice.get(contexto)
+        if entrada is None:
+            entrada = indice[contexto] = (freq_contextos.get(contexto, 0), [])
+        entrada[1].append((clave[-1], frecuencia))
+
+    for _, continuaciones in indice.values():
+        continuaciones.sort(key=lambda x: (-x[1], x[0]))
+
+    return indice
+
+
+class ContadorIncremental:
+    """
+    Acumula conteos multi-orden de un flujo de tokens que llega por lotes.
+    Entre lotes se conservan los últimos ids para contar también los
+    n-gramas que cruzan el borde, así la memoria depende del tamaño del
+    lote y de las tablas, no del texto.
+    """
+
+    def __init__(self, ordenes, vocabulario=None):
+        self.ordenes = list(ordenes)
+        self.vocabulario = vocabulario if vocabulario is not None else Vocabulario()
+        self.conteos = _contar_multiorden(array('I'), self.ordenes)
+        self.total = 0
+        self._solapamiento = max(self.ordenes, default=1) - 1
+        self._anteriores = array('I')
+
+    def agregar(self, tokens):
+        """Cuenta un lote de tokens"""
+        self.agregar_ids(self.vocabulario.codificar(tokens))
+
+    def agregar_ids(self, ids):
+        """Cuenta un lote de ids (array('I')) ya codificados con self.vocabulario"""
+        if not ids:
+            return
+
+        ventana = self._anteriores + ids
+        nuevos = _contar_multiorden(ventana, self.ordenes)
+        if self._anteriores:
+            # Los n-gramas que caen por completo en el lote anterior ya se contaron
+            for orden, conteo in _contar_multiorden(self._anteriores, self.ordenes).items():
+                destino = nuevos[orden]
+                for clave, frecuencia in conteo.items():
+                    restante = destino[clave] - frecuencia
+                    if restante:
+                        destino[clave] = restante
+                    else:
+                        del destino[clave]
+
+        for orden, conteo in nuevos.items():
+            self.conteos[orden].update(conteo)
+        self.total += len(ids)
+        self._anteriores = ventana[-self._solapamiento:] if self._solapamiento else array('I')
+
+    def combinar(self, palabras, conteos, total):
+        """
+        Suma conteos hechos con otro vocabulario (por ejemplo en otro proceso).
+        Los ids se traducen con `palabras`, la lista del vocabulario de origen.
+        Los n-gramas no cruzan de un conteo a otro.
+        """
+        traduccion = [self.vocabulario.id(palabra) for palabra in palabras]
+        traducir = traduccion.__getitem__
+        for orden, destino in self.conteos.items():
+            for clave, frecuencia in conteos[orden].items():
+                destino[tuple(map(traducir, clave))] += frecuencia
+        self.total += total
+        self._anteriores = array('I')
+
+    def agregar_flujo(self, tokens, tamano_lote=TAMANO_LOTE):
+        """Cuenta un iterable de tokens (por ejemplo utils.iterar_tokens) por lotes"""
+        tokens = iter(tokens)
+        # Solo se mide el conteo de los lotes, no la lectura de los tokens
+        conteo = etapa_acumulada('conteo')
+        try:
+            while True:
+                lote = list(islice(tokens, tamano_lote))
+                if not lote:
+                    return self
+                with conteo:
+                    self.agregar(lote)
+        finally:
+            conteo.cerrar()
@@ -0,0 +1,147 @@
+"""Evaluación de modelos con un texto de prueba.
+
+Para cada orden k = 2..n se calcula la log-verosimilitud del texto, la
+entropía cruzada (bits por palabra) y la perplejidad 2^H usando los órdenes
+1..k del modelo con un método de suavizado.py.
+
+El texto de prueba se convierte una sola vez en un arreglo de ids del
+modelo y se cuentan sus n-gramas: cada n-grama distinto se puntúa una sola
+vez y se pondera por su frecuencia, así el costo depende del número de
+n-gramas distintos y no de la longitud del texto.
+
+Con fronteras de oración ``<s>`` solo sirve de contexto: el modelo nunca
+tiene que predecirlo, así que no se puntúa. Al dividir un texto el corte
+cae en el fin de una oración para no repartirla entre entrenamiento y
+prueba.
+"""
+import math
+from array import array
+
+from .conteo import Vocabulario, contar_multiorden, contar_ngramas_ids
+from .formato_binario import ModeloBinario, escribir_modelo
+from .formato_tokens import FIN_ORACION, INICIO_ORACION
+from .suavizado import K_DEFECTO, ModeloSuavizado
+
+# Fracción de un texto que se usa para entrenar al evaluarlo consigo mismo
+DIVISION_DEFECTO = 0.9
+
+
+def traducir_ids(modelo, palabras, ids):
+    """
+    Convierte un arreglo de ids de otro vocabulario (palabras es su lista
+    id -> palabra) a ids del modelo. Las palabras que el modelo no conoce
+    quedan como modelo.num_palabras.
+    """
+    desconocida = modelo.num_palabras
+    traduccion = array('I')
+    for palabra in palabras:
+        id_modelo = modelo.id(palabra)
+        traduccion.append(desconocida if id_modelo is None else id_modelo)
+    return array('I', map(traduccion.__getitem__, ids))
+
+
+def ngramas_evaluacion(ids, orden):
+    """
+    Counter con un n-grama por posición del texto: la palabra y hasta
+    orden-1 palabras anteriores (menos al principio del texto)
+    """
+    conteo = contar_ngramas_ids(ids, orden)
+    for fin in range(1, min(orden - 1, len(ids)) + 1):
+        conteo[tuple(ids[:fin])] += 1
+    return conteo
+
+
+def evaluar(modelo, ids, ordenes=None, metodo='kneser_ney', k=K_DEFECTO):
+    """
+    Métricas de un arreglo de ids del modelo (ver traducir_ids) por orden.
+    Las palabras desconocidas no se puntúan, se informan aparte; los <s>
+    tampoco, porque solo son contexto. Con mle una probabilidad cero deja
+    la perplejidad en None (infinita); con stupid_backoff las puntuaciones
+    no suman 1 y la perplejidad es solo orientativa.
+    """
+    desconocida = modelo.num_palabras
+    inicio_oracion = modelo.id(INICIO_ORACION)
+    resultados = []
+    for orden in ordenes or range(2, modelo.n + 1):
+        estimador = ModeloSuavizado(modelo, metodo, k=k, orden=orden)
+        niveles_por_contexto = {}
+        log_verosimilitud = 0.0
+        tokens = desconocidas = ceros = 0
+        for clave, frecuencia in ngramas_evaluacion(ids, orden).items():
+            if clave[-1] == inicio_oracion:
+                continue
+            if clave[-1] == desconocida:
+                desconocidas += frecuencia
+                continue
+            contexto = clave[:-1]
+            niveles = niveles_por_contexto.get(contexto)
+            if niveles is None:
+                niveles = niveles_por_contexto[contexto] = estimador.niveles_ids(contexto)
+            probabilidad = estimador.puntuar(niveles, clave[-1])
+            tokens += frecuencia
+            if probabilidad > 0:
+                log_verosimilitud += frecuencia * math.log(probabilidad)
+            else:
+                ceros += frecuencia
+
+        entropia = -log_verosimilitud / (tokens * math.log(2)) if tokens else 0.0
+        resultados.append({
+            'orden': orden,
+            'tokens': tokens,
+            'desconocidas': desconocidas,
+            'probabilidad_cero': ceros,
+            'log_verosimilitud': log_verosimilitud,
+            'entropia_cruzada': entropia if not ceros else None,
+            'perplejidad': 2 ** entropia if not ceros else None,
+        })
+    return resultados
+
+
+def modelo_en_memoria(palabras, ids, n, usar_fronteras=False):
+    """
+    ModeloBinario entrenado con un arreglo de ids sin guardarlo en disco.
+    El vocabulario se limita a las palabras que aparecen en ids.
+    """
+    vocabulario = Vocabulario()
+    ids = vocabulario.codificar(palabras[i] for i in ids)
+    conteos = contar_multiorden(ids, range(1, n + 1))
+    contenido = escribir_modelo(vocabulario.palabras, conteos, n, usar_fronteras, len(ids))
+    return ModeloBinario(contenido)
+
+
+def ajustar_corte(palabras, ids, corte):
+    """
+    Mueve el corte justo después del siguiente </s>, para que ninguna
+    oración quede partida. Si la oración cortada es la última se usa el
+    fin de la anterior, así la prueba no queda vacía.
+    """
+    try:
+        fin = palabras.index(FIN_ORACION)
+    except ValueError:
+        return corte
+    if corte and ids[corte - 1] == fin:
+        return corte
+    try:
+        siguiente = ids.index(fin, corte) + 1
+    except ValueError:
+        siguiente = len(ids)
+    if siguiente < len(ids):
+        return siguiente
+    for posicion in range(corte - 1, 0, -1):
+        if ids[posicion] == fin:
+            return posicion + 1
+    return corte
+
+
+def evaluar_division(palabras, ids, n, usar_fronteras=False, division=DIVISION_DEFECTO, **opciones):
+    """
+    Entrena con la primera fracción `division` de un texto y evalúa con el
+    resto; con fronteras el corte se ajusta al fin de una oración. Devuelve
+    (tokens de entrenamiento, tokens de prueba, métricas).
+    """
+    corte = int(len(ids) * division)
+    if usar_fronteras:
+        corte = ajustar_corte(palabras, ids, corte)
+    modelo = modelo_en_memoria(palabras, ids[:corte], n, usar_fronteras)
+    prueba = traducir_ids(modelo, palabras, ids[corte:])
+    return corte, len(prueba), evaluar(modelo, prueba, **opciones)
@@ -0,0 +1,478 @@
+"""Formato binario compacto de los modelos de n-gramas.
+
+El archivo es una secuencia de enteros uint32 (en el orden de bytes de la
+máquina) que se abre con ``mmap``: todos los procesos que sirven peticiones
+comparten las mismas páginas físicas y abrirlo no depende del tamaño del
+modelo. No se crean objetos de Python por n-grama hasta que se consultan.
+
+Secciones, en este orden:
+
+* cabecera (``TAMANO_CABECERA`` enteros, ver ``CAMPOS``)
+* vocabulario: posiciones de inicio de cada palabra en el bloque de texto
+  (``num_palabras + 1`` enteros) y el bloque UTF-8, con relleno hasta un
+  múltiplo de 4 bytes. Las palabras están ordenadas, así que el id de una
+  palabra es su posición y se busca con ``bisect``.
+* directorio: una entrada por orden k = 1..n (ver ``DIRECTORIO``).
+* una tabla por orden k con los contextos de k - 1 palabras (ver
+  ``COLUMNAS``). Las continuaciones de cada contexto están ordenadas por id
+  para buscarlas con ``bisect``; ``orden_frecuencia`` las recorre de mayor a
+  menor frecuencia.
+
+Además de los conteos, cada tabla guarda lo que necesita el suavizado
+(suavizado.py) para no recalcularlo en cada consulta: los conteos de
+continuación de Kneser-Ney, el descuento del orden y, por contexto, el
+denominador y el peso de back-off.
+"""
+import heapq
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, repeat
+
+MAGIA = 0x4D52474E  # 'NGRM'
+# Permite detectar un archivo escrito en una máquina con otro orden de bytes
+ORDEN_BYTES = 0x01020304
+VERSION = 2
+
+CAMPOS = (
+    'magia', 'orden_bytes', 'version', 'n', 'usar_fronteras', 'total_palabras',
+    'num_palabras', 'inicio_vocabulario', 'inicio_texto', 'bytes_texto', 'inicio_directorio',
+)
+TAMANO_CABECERA = 16
+
+# Columnas de cada tabla. Por contexto: claves (k - 1 ids), C(contexto),
+# denominador y peso de back-off (float32) de Kneser-Ney, e inicio de sus
+# continuaciones. Por continuación: id, C(contexto, palabra), conteo de
+# Kneser-Ney y el orden por frecuencia.
+COLUMNAS = (
+    'claves', 'frecuencias_contexto', 'denominadores', 'pesos', 'inicios',
+    'ids', 'frecuencias', 'frecuencias_kn', 'orden_frecuencia',
+)
+DIRECTORIO = ('num_contextos', 'num_continuaciones', 'descuento') + COLUMNAS
+COLUMNAS_FLOTANTES = {'pesos', 'descuento'}
+
+# Descuento de Kneser-Ney cuando no hay datos para estimarlo
+DESCUENTO_DEFECTO = 0.75
+
+
+def descuento_absoluto(frecuencias):
+    """Descuento D = n1 / (n1 + 2 n2), con n1 y n2 los conteos iguales a 1 y a 2"""
+    n1 = n2 = 0
+    for frecuencia in frecuencias:
+        if frecuencia == 1:
+            n1 += 1
+        elif frecuencia == 2:
+            n2 += 1
+    if n1 == 0 or n2 == 0:
+        return DESCUENTO_DEFECTO
+    return n1 / (n1 + 2 * n2)
+
+
+def _flotante_como_entero(valor):
+    return array('I', array('f', [valor]).tobytes())[0]
+
+
+def _escribir_tabla(orden, n, conteos, total_palabras, rango, original):
+    """Columnas (arrays) y descuento de la tabla de un orden"""
+    base = len(rango) or 1
+
+    def codificar(clave):
+        # Un n-grama como un solo entero en base |V| con los ids ya
+        # renumerados: ordenar enteros es mucho más rápido que ordenar tuplas
+        codigo = 0
+        for id_palabra in clave:
+            codigo = codigo * base + rango[id_palabra]
+        return codigo
+
+    ngramas = conteos[orden]
+    if orden < n:
+        # Conteo de continuación: con cuántas palabras distintas a la
+        # izquierda aparece cada n-grama
+        frecuencias_kn = Counter(clave[1:] for clave in conteos[orden + 1])
+    else:
+        frecuencias_kn = ngramas
+    descuento = descuento_absoluto(frecuencias_kn.values())
+
+    # Ordenados por código, los n-gramas quedan agrupados por contexto y las
+    # continuaciones de cada uno ordenadas por id
+    claves = list(ngramas)
+    codigos = list(map(codificar, claves))
+    permutacion = sorted(range(len(codigos)), key=codigos.__getitem__)
+
+    columnas = {nombre: array('f' if nombre in COLUMNAS_FLOTANTES else 'I') for nombre in COLUMNAS}
+    ids, frecuencias, kn = columnas['ids'], columnas['frecuencias'], columnas['frecuencias_kn']
+    ids.extend(codigos[i] % base for i in permutacion)
+    frecuencias.extend(ngramas[claves[i]] for i in permutacion)
+    kn.extend(frecuencias_kn.get(claves[i], 0) for i in permutacion)
+    por_contexto = Counter(codigo // base for codigo in codigos)
+    del claves, codigos, permutacion, frecuencias_kn
+
+    # Sumas acumuladas para el denominador y las continuaciones distintas
+    acumulado_kn = list(accumulate(kn, initial=0))
+    acumulado_distintas = list(accumulate((frecuencia > 0 for frecuencia in kn), initial=0))
+
+    contextos = conteos[orden - 1] if orden > 1 else {(): total_palabras}
+    contextos = sorted(zip(map(codificar, contextos), contextos.values()))
+    columnas['inicios'].append(0)
+    grupos = array('I')
+    fin = 0
+    for posicion, (codigo, frecuencia_contexto) in enumerate(contextos):
+        inicio = fin
+        fin += por_contexto.get(codigo, 0)
+        grupos.extend(repeat(posicion, fin - inicio))
+        contexto = []
+        for _ in range(orden - 1):
+            codigo, id_palabra = divmod(codigo, base)
+            contexto.append(id_palabra)
+        columnas['claves'].extend(reversed(contexto))
+        denominador = acumulado_kn[fin] - acumulado_kn[inicio]
+        distintas = acumulado_distintas[fin] - acumulado_distintas[inicio]
+        columnas['frecuencias_contexto'].append(frecuencia_contexto)
+        columnas['denominadores'].append(denominador)
+        columnas['pesos'].append(descuento * distintas / denominador if denominador else 0.0)
+        columnas['inicios'].append(fin)
+
+    # Continuaciones de cada contexto de mayor a menor frecuencia; en los
+    # empates se mantiene el orden de aparición en el texto
+    tope = max(frecuencias, default=0) + 1
+    prioridades = [
+        (grupo * tope + tope - frecuencia) * base + original[id_palabra]
+        for grupo, frecuencia, id_palabra in zip(grupos, frecuencias, ids)
+    ]
+    columnas['orden_frecuencia'].extend(sorted(range(len(prioridades)), key=prioridades.__getitem__))
+    return columnas, descuento
+
+
+def escribir_modelo(palabras, conteos, n, usar_fronteras, total_palabras):
+    """
+    Serializa un modelo. palabras es la lista id -> palabra de los ids que
+    usan los conteos; conteos es {orden: Counter de tuplas de ids} con todos
+    los órdenes de 1 a n. Devuelve los bytes del archivo.
+    """
+    # Se renumera el vocabulario en orden alfabético para buscar por bisect
+    orden_alfabetico = sorted(range(len(palabras)), key=palabras.__getitem__)
+    rango = array('I', bytes(4 * len(palabras)))
+    for posicion, id_palabra in enumerate(orden_alfabetico):
+        rango[id_palabra] = posicion
+
+    inicios_palabras = array('I', [0])
+    texto = bytearray()
+    for id_palabra in orden_alfabetico:
+        texto += palabras[id_palabra].encode('utf-8')
+        inicios_palabras.append(len(texto))
+    bytes_texto = len(texto)
+    texto += bytes(-bytes_texto % 4)
+
+    tablas = [
+        _escribir_tabla(orden, n, conteos, total_palabras, rango, orden_alfabetico)
+        for orden in range(1, n + 1)
+    ]
+
+    inicio_directorio = TAMANO_CABECERA + len(inicios_palabras) + len(texto) // 4
+    posicion = inicio_directorio + n * len(DIRECTORIO)
+    directorio = array('I')
+    secciones = []
+    for columnas, descuento in tablas:
+        directorio.extend([
+            len(columnas['frecuencias_contexto']), len(columnas['ids']),
+            _flotante_como_entero(descuento),
+        ])
+        for nombre in COLUMNAS:
+            directorio.append(posicion)
+            posicion += len(columnas[nombre])
+            secciones.append(columnas[nombre])
+
+    cabecera = array('I', [
+        MAGIA, ORDEN_BYTES, VERSION, n, int(usar_fronteras), total_palabras,
+        len(palabras), TAMANO_CABECERA, TAMANO_CABECERA + len(inicios_palabras), bytes_texto,
+        inicio_directorio,
+    ])
+    cabecera.extend([0] * (TAMANO_CABECERA - len(cabecera)))
+    return b''.join(
+        [cabecera.tobytes(), inicios_palabras.tobytes(), bytes(texto), directorio.tobytes()]
+        + [seccion.tobytes() for seccion in secciones]
+    )
+
+
+class _Secuencia:
+    """Vista indexable para usar bisect sobre datos del archivo sin copiarlos"""
+
+    def __init__(self, longitud, elemento):
+        self._longitud = longitud
+        self._elemento = elemento
+
+    def __len__(self):
+        return self._longitud
+
+    def __getitem__(self, posicion):
+        return self._elemento(posicion)
+
+
+class _MaximosPorRango:
+    """Árbol de segmentos con la posición del valor máximo de cada rango"""
+
+    def __init__(self, valores):
+        self._valores = valores
+        tamano = 1
+        while tamano < len(valores):
+            tamano *= 2
+        self._tamano = tamano
+        arbol = [-1] * (2 * tamano)
+        arbol[tamano:tamano + len(valores)] = range(len(valores))
+        for nodo in range(tamano - 1, 0, -1):
+            arbol[nodo] = self._mejor(arbol[2 * nodo], arbol[2 * nodo + 1])
+        self._arbol = arbol
+
+    def _mejor(self, a, b):
+        # En los empates gana la posición menor
+        if a < 0:
+            return b
+        if b < 0 or self._valores[a] >= self._valores[b]:
+            return a
+        return b
+
+    def maximo(self, desde, hasta):
+        """Posición del máximo en [desde, hasta), o -1 si el rango está vacío"""
+        mejor = -1
+        desde += self._tamano
+        hasta += self._tamano
+        while desde < hasta:
+            if desde & 1:
+                mejor = self._mejor(mejor, self._arbol[desde])
+                desde += 1
+            if hasta & 1:
+                hasta -= 1
+                mejor = self._mejor(mejor, self._arbol[hasta])
+            desde //= 2
+            hasta //= 2
+        return mejor
+
+    def mayores(self, desde, hasta, limite):
+        """Hasta `limite` posiciones de [desde, hasta) de mayor a menor valor"""
+        resultado = []
+        pendientes = []
+
+        def agregar(inicio, fin):
+            if inicio < fin:
+                posicion = self.maximo(inicio, fin)
+                heapq.heappush(pendientes, (-self._valores[posicion], posicion, inicio, fin))
+
+        agregar(desde, hasta)
+        while pendientes and len(resultado) < limite:
+            _, posicion, inicio, fin = heapq.heappop(pendientes)
+            resultado.append(posicion)
+            agregar(inicio, posicion)
+            agregar(posicion + 1, fin)
+        return resultado
+
+
+class TablaOrden:
+    """Tabla de un orden k: contextos de k - 1 ids y sus continuaciones"""
+
+    def __init__(self, orden, enteros, flotantes, entrada):
+        self.orden = orden
+        self._ancho = orden - 1
+        self.num_contextos = entrada['num_contextos']
+        self.num_continuaciones = entrada['num_continuaciones']
+        self.descuento = array('f', array('I', [entrada['descuento']]).tobytes())[0]
+
+        longitudes = {
+            'claves': self.num_contextos * self._ancho,
+            'inicios': self.num_contextos + 1,
+        }
+        for nombre in COLUMNAS:
+            if nombre in ('ids', 'frecuencias', 'frecuencias_kn', 'orden_frecuencia'):
+                longitud = self.num_continuaciones
+            else:
+                longitud = longitudes.get(nombre, self.num_contextos)
+            datos = flotantes if nombre in COLUMNAS_FLOTANTES else enteros
+            setattr(self, nombre, datos[entrada[nombre]:entrada[nombre] + longitud])
+        self._contextos = _Secuencia(self.num_contextos, self.contexto)
+        self._maximos = None
+        self._contextos_filas = None
+
+    def contexto(self, posicion):
+        inicio = posicion * self._ancho
+        return tuple(self.claves[inicio:inicio + self._ancho])
+
+    def posicion(self, clave):
+        """Posición de un contexto (tupla de ids), o None si no está"""
+        if len(clave) != self._ancho or None in clave:
+            return None
+        if self._ancho == 0:
+            return 0 if self.num_contextos else None
+        if self._ancho == 1:
+            # Con contextos de una palabra la columna de claves ya está ordenada
+            posicion = bisect_left(self.claves, clave[0])
+            if posicion < self.num_contextos and self.claves[posicion] == clave[0]:
+                return posicion
+            return None
+        posicion = bisect_left(self._contextos, clave)
+        if posicion < self.num_contextos and self.contexto(posicion) == clave:
+            return posicion
+        return None
+
+    def buscar(self, posicion, id_palabra):
+        """Índice de la continuación id_palabra del contexto, o None"""
+        inicio, fin = self.inicios[posicion], self.inicios[posicion + 1]
+        indice = bisect_left(self.ids, id_palabra, inicio, fin)
+        if indice < fin and self.ids[indice] == id_palabra:
+            return indice
+        return None
+
+    def continuaciones(self, posicion, limite=None):
+        """(id, C(contexto, palabra)) de mayor a menor frecuencia"""
+        inicio, fin = self.inicios[posicion], self.inicios[posicion + 1]
+        if limite is not None:
+            fin = min(fin, inicio + limite)
+        return [(self.ids[i], self.frecuencias[i]) for i in self.orden_frecuencia[inicio:fin]]
+
+    def mejores(self, posicion, desde, hasta, limite):
+        """
+        Como continuaciones, pero solo las palabras con id en [desde, hasta)
+        (por ejemplo las que empiezan con un prefijo, ver rango_prefijo)
+        """
+        inicio, fin = self.inicios[posicion], self.inicios[posicion + 1]
+        inicio = bisect_left(self.ids, desde, inicio, fin)
+        fin = bisect_left(self.ids, hasta, inicio, fin)
+        if self.orden == 1:
+            # El contexto vacío tiene todo el vocabulario: se usa el árbol de máximos
+            if self._maximos is None:
+                self._maximos = _MaximosPorRango(self.frecuencias)
+            indices = self._maximos.mayores(inicio, fin, limite)
+        else:
+            indices = heapq.nlargest(limite, range(inicio, fin), key=self.frecuencias.__getitem__)
+        return [(self.ids[i], self.frecuencias[i]) for i in indices]
+
+    def contexto_fila(self, indice):
+        """Posición del contexto de la continuación número indice"""
+        return bisect_right(self.inicios, indice) - 1
+
+    def contextos_filas(self):
+        """Posición del contexto de cada continuación, calculada una sola vez"""
+        if self._contextos_filas is None:
+            contextos = array('I')
+            for posicion in range(self.num_contextos):
+                contextos.extend(array('I', [posicion]) * (self.inicios[posicion + 1] - self.inicios[posicion]))
+            self._contextos_filas = contextos
+        return self._contextos_filas
+
+
+class ModeloBinario:
+    """
+    Modelo abierto en modo lectura. Para el orden n se comporta como el
+    índice contexto -> (C(contexto), [(palabra, frecuencia), ...]) que usa
+    almacen; las tablas de todos los órdenes están en ``tablas``.
+    """
+
+    def __init__(self, datos):
+        # datos: un mmap o cualquier objeto que exponga el buffer del archivo
+        self._datos = datos
+        # Un archivo de otro formato (JSON) o cortado no siempre mide un múltiplo de 4
+        tamano = memoryview(datos).nbytes
+        if tamano % 4 or tamano < TAMANO_CABECERA * 4:
+            raise ValueError('Archivo de modelo incompleto')
+        enteros = memoryview(datos).cast('I')
+        flotantes = memoryview(datos).cast('f')
+        cabecera = dict(zip(CAMPOS, enteros[:TAMANO_CABECERA]))
+        if cabecera['magia'] != MAGIA or cabecera['orden_bytes'] != ORDEN_BYTES:
+            raise ValueError('No es un modelo binario de esta máquina')
+        if cabecera['version'] != VERSION:
+            raise ValueError(f"Versión de formato binario {cabecera['version']} no soportada")
+
+        self.n = cabecera['n']
+        self.usar_fronteras = bool(cabecera['usar_fronteras'])
+        self.total_palabras = cabecera['total_palabras']
+        self.num_palabras = cabecera['num_palabras']
+
+        inicio = cabecera['inicio_vocabulario']
+        self._inicios_palabras = enteros[inicio:inicio + self.num_palabras + 1]
+        inicio_texto = cabecera['inicio_texto'] * 4
+        self._texto = memoryview(datos)[inicio_texto:inicio_texto + cabecera['bytes_texto']]
+        self._vocabulario = _Secuencia(self.num_palabras, self._palabra_bytes)
+
+        self.tablas = {}
+        inicio = cabecera['inicio_directorio']
+        for orden in range(1, self.n + 1):
+            entrada = dict(zip(DIRECTORIO, enteros[inicio:inicio + len(DIRECTORIO)]))
+            self.tablas[orden] = TablaOrden(orden, enteros, flotantes, entrada)
+            inicio += len(DIRECTORIO)
+        self._tabla = self.tablas[self.n]
+
+    @classmethod
+    def abrir(cls, ruta):
+        """Abre un archivo con mmap (las páginas se comparten entre procesos)"""
+        with open(ruta, 'rb') as archivo:
+            return cls(mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _palabra_bytes(self, id_palabra):
+        return bytes(self._texto[self._inicios_palabras[id_palabra]:self._inicios_palabras[id_palabra + 1]])
+
+    def palabra(self, id_palabra):
+        return self._palabra_bytes(id_palabra).decode('utf-8')
+
+    def id(self, palabra):
+        """Id de una palabra por búsqueda binaria, o None si no está"""
+        buscada = palabra.encode('utf-8')
+        posicion = bisect_left(self._vocabulario, buscada)
+        if posicion < self.num_palabras and self._palabra_bytes(posicion) == buscada:
+            return posicion
+        return None
+
+    def rango_prefijo(self, prefijo):
+        """Ids [desde, hasta) de las palabras que empiezan con prefijo"""
+        buscado = prefijo.encode('utf-8')
+        desde = bisect_left(self._vocabulario, buscado)
+        # Ningún byte de UTF-8 vale 0xff, así que acota todas las extensiones
+        hasta = bisect_left(self._vocabulario, buscado + b'\xff', desde)
+        return desde, hasta
+
+    def posicion_contexto(self, contexto):
+        """Posición en la tabla de orden n de un contexto (cadena de n-1 palabras), o None"""
+        return self._tabla.posicion(tuple(map(self.id, contexto.split(' '))))
+
+    def get(self, contexto, default=None, limite=None):
+        """(C(contexto), continuaciones); con limite solo las primeras"""
+        posicion = self.posicion_contexto(contexto)
+        if posicion is None:
+            return default
+        continuaciones = self._tabla.continuaciones(posicion, limite)
+        return (
+            self._tabla.frecuencias_contexto[posicion],
+            [(self.palabra(id_palabra), frecuencia) for id_palabra, frecuencia in continuaciones],
+        )
+
+    def __contains__(self, contexto):
+        return self.posicion_contexto(contexto) is not None
+
+    def __len__(self):
+        return self._tabla.num_contextos
+
+    def items(self):
+        """Recorre todos los contextos de orden n en orden alfabético"""
+        # Al recorrer todo el modelo conviene decodificar cada palabra una vez
+        palabras = self.palabras()
+        tabla = self._tabla
+        for posicion in range(tabla.num_contextos):
+            contexto = ' '.join(palabras[i] for i in tabla.contexto(posicion))
+            yield contexto, (
+                tabla.frecuencias_contexto[posicion],
+                [(palabras[id_palabra], frecuencia) for id_palabra, frecuencia in tabla.continuaciones(posicion)],
+            )
+
+    def palabras(self):
+        """Lista id -> palabra de todo el vocabulario"""
+        return [self.palabra(i) for i in range(self.num_palabras)]
+
+    def conteos(self):
+        """Reconstruye {orden: Counter de tuplas de ids} de todos los órdenes"""
+        conteos = {}
+        for orden, tabla in self.tablas.items():
+            conteo = Counter()
+            for posicion in range(tabla.num_contextos):
+                contexto = tabla.contexto(posicion)
+                for i in range(tabla.inicios[posicion], tabla.inicios[posicion + 1]):
+                    conteo[contexto + (tabla.ids[i],)] = tabla.frecuencias[i]
+            conteos[orden] = conteo
+        return conteos
@@ -0,0 +1,174 @@
+"""Flujo de tokens de un texto, codificado una sola vez al subirlo.
+
+Como formato_binario.py, el archivo es una secuencia de enteros uint32 (en
+el orden de bytes de la máquina) que se abre con ``mmap``. Guarda los
+tokens limpios del texto como ids de un vocabulario propio del texto,
+compartido por las dos formas de tokenizar: sin fronteras son los tokens
+de ``limpiar_texto`` y, rodeando cada oración con ``<s>`` y ``</s>``, los
+de ``limpiar_texto_con_fronteras``. Así ninguna vista vuelve a decodificar
+ni limpiar el archivo original.
+
+Secciones, en este orden:
+
+* cabecera (``TAMANO_CABECERA`` enteros, ver ``CAMPOS``)
+* vocabulario: posiciones de inicio de cada palabra en el bloque de texto y
+  el bloque UTF-8, con relleno hasta un múltiplo de 4 bytes. Los ids siguen
+  el orden de primera aparición; si el texto tiene oraciones, ``<s>`` y
+  ``</s>`` van al final (ids ``num_palabras`` y ``num_palabras + 1``).
+* ids: los ``total_tokens`` tokens, sin marcadores de oración.
+* oraciones: posición en ids donde empieza cada oración y, al final,
+  ``total_tokens`` (``num_oraciones + 1`` enteros). Una oración de solo
+  stopwords queda vacía, como en ``limpiar_texto_con_fronteras``.
+"""
+import mmap
+from array import array
+
+from .conteo import TAMANO_LOTE, Vocabulario
+
+MAGIA = 0x534B4F54  # 'TOKS'
+# Permite detectar un archivo escrito en una máquina con otro orden de bytes
+ORDEN_BYTES = 0x01020304
+VERSION = 1
+
+CAMPOS = (
+    'magia', 'orden_bytes', 'version', 'total_tokens', 'num_palabras', 'num_oraciones',
+    'inicio_vocabulario', 'inicio_texto', 'bytes_texto', 'inicio_ids', 'inicio_oraciones',
+)
+TAMANO_CABECERA = 16
+
+INICIO_ORACION = '<s>'
+FIN_ORACION = '</s>'
+
+
+def codificar_tokens(tokens):
+    """
+    Codifica los tokens con fronteras de un texto (utils.iterar_tokens con
+    usar_fronteras): (Vocabulario, ids sin marcadores, inicios de oración)
+    """
+    vocabulario = Vocabulario()
+    ids_vocabulario = vocabulario.ids
+    palabras = vocabulario.palabras
+    ids = array('I')
+    oraciones = array('I')
+    for token in tokens:
+        id_palabra = ids_vocabulario.get(token)
+        if id_palabra is None:
+            # Los marcadores nunca entran al vocabulario: van al final al escribir
+            if token == INICIO_ORACION:
+                oraciones.append(len(ids))
+                continue
+            if token == FIN_ORACION:
+                continue
+            id_palabra = ids_vocabulario[token] = len(palabras)
+            palabras.append(token)
+        ids.append(id_palabra)
+    return vocabulario, ids, oraciones
+
+
+def escribir_flujo(palabras, ids, oraciones):
+    """
+    Serializa un flujo de tokens (lo que devuelve codificar_tokens, con el
+    vocabulario como lista de palabras). Devuelve los bytes del archivo.
+    """
+    vocabulario = list(palabras) + ([INICIO_ORACION, FIN_ORACION] if oraciones else [])
+    inicios_palabras = array('I', [0])
+    texto = bytearray()
+    for palabra in vocabulario:
+        texto += palabra.encode('utf-8')
+        inicios_palabras.append(len(texto))
+    bytes_texto = len(texto)
+    texto += bytes(-bytes_texto % 4)
+
+    inicio_ids = TAMANO_CABECERA + len(inicios_palabras) + len(texto) // 4
+    cabecera = array('I', [
+        MAGIA, ORDEN_BYTES, VERSION, len(ids), len(palabras), len(oraciones),
+        TAMANO_CABECERA, TAMANO_CABECERA + len(inicios_palabras), bytes_texto,
+        inicio_ids, inicio_ids + len(ids),
+    ])
+    cabecera.extend([0] * (TAMANO_CABECERA - len(cabecera)))
+    return b''.join([
+        cabecera.tobytes(), inicios_palabras.tobytes(), bytes(texto), ids.tobytes(),
+        oraciones.tobytes(), array('I', [len(ids)]).tobytes(),
+    ])
+
+
+class FlujoTokens:
+    """Flujo de tokens abierto en modo lectura"""
+
+    def __init__(self, datos):
+        # datos: un mmap o cualquier objeto que exponga el buffer del archivo
+        self._datos = datos
+        tamano = memoryview(datos).nbytes
+        if tamano % 4 or tamano < TAMANO_CABECERA * 4:
+            raise ValueError('Archivo de tokens incompleto')
+        enteros = memoryview(datos).cast('I')
+        cabecera = dict(zip(CAMPOS, enteros[:TAMANO_CABECERA]))
+        if cabecera['magia'] != MAGIA or cabecera['orden_bytes'] != ORDEN_BYTES:
+            raise ValueError('No es un flujo de tokens de esta máquina')
+        if cabecera['version'] != VERSION:
+            raise ValueError(f"Versión de flujo de tokens {cabecera['version']} no soportada")
+
+        self.total_tokens = cabecera['total_tokens']
+        self.num_palabras = cabecera['num_palabras']
+        self.num_oraciones = cabecera['num_oraciones']
+
+        inicio = cabecera['inicio_vocabulario']
+        marcadores = 2 if self.num_oraciones else 0
+        self._inicios_palabras = enteros[inicio:inicio + self.num_palabras + marcadores + 1]
+        inicio_texto = cabecera['inicio_texto'] * 4
+        self._texto = memoryview(datos)[inicio_texto:inicio_texto + cabecera['bytes_texto']]
+        # Los ids se copian por bytes a los arreglos de cada lote
+        inicio = cabecera['inicio_ids'] * 4
+        self._ids = memoryview(datos)[inicio:inicio + self.total_tokens * 4]
+        inicio = cabecera['inicio_oraciones']
+        self._oraciones = enteros[inicio:inicio + self.num_oraciones + 1]
+
+    @classmethod
+    def abrir(cls, ruta):
+        """Abre un archivo con mmap (las páginas se comparten entre procesos)"""
+        with open(ruta, 'rb') as archivo:
+            return cls(mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def palabras(self, usar_fronteras=False):
+        """Lista id -> palabra; con fronteras incluye <s> y </s> si hay oraciones"""
+        cantidad = self.num_palabras + (2 if usar_fronteras and self.num_oraciones else 0)
+        texto = bytes(self._texto)
+        inicios = self._inicios_palabras
+        return [texto[inicios[i]:inicios[i + 1]].decode('utf-8') for i in range(cantidad)]
+
+    def longitud(self, usar_fronteras=False):
+        """Cantidad de tokens, contando los marcadores si se usan fronteras"""
+        return self.total_tokens + (2 * self.num_oraciones if usar_fronteras else 0)
+
+    def lotes(self, usar_fronteras=False, tamano=TAMANO_LOTE):
+        """
+        Los ids de los tokens en arreglos de unos `tamano` ids, sin copiar el
+        flujo completo. Con fronteras cada oración va entre <s> y </s>.
+        """
+        if not usar_fronteras:
+            for desde in range(0, self.total_tokens, tamano):
+                lote = array('I')
+                lote.frombytes(self._ids[desde * 4:(desde + tamano) * 4])
+                yield lote
+            return
+
+        inicio, fin = self.num_palabras, self.num_palabras + 1
+        ids = self._ids
+        oraciones = self._oraciones
+        lote = array('I')
+        for i in range(self.num_oraciones):
+            lote.append(inicio)
+            lote.frombytes(ids[oraciones[i] * 4:oraciones[i + 1] * 4])
+            lote.append(fin)
+            if len(lote) >= tamano:
+                yield lote
+                lote = array('I')
+        if lote:
+            yield lote
+
+    def ids(self, usar_fronteras=False):
+        """Arreglo con todos los ids, los de limpiar_texto o limpiar_texto_con_fronteras"""
+        resultado = array('I')
+        for lote in self.lotes(usar_fronteras, tamano=max(self.longitud(usar_fronteras), 1)):
+            resultado.extend(lote)
+        return resultado
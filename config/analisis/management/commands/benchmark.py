@@ -0,0 +1,195 @@
+import os
+import random
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from analisis.almacen import obtener_modelo, N_GRAMA_DEFECTO, FRONTERAS_DEFECTO
+from analisis.benchmark import (
+    cargar_resultados, comparar_con_base, escribir_corpus_sintetico, generar_corpus_sintetico,
+    guardar_resultados, medir, medir_peticiones, TOLERANCIA_DEFECTO,
+)
+from analisis.cache_textos import cache
+from analisis.models import TextoAnalizado
+from analisis.utils import (
+    calcular_probabilidad_ngramas_general, generar_ngramas, iterar_tokens, leer_bloques, limpiar_texto,
+    limpiar_texto_con_fronteras, normalizar_acentos,
+)
+
+# Hasta este tamaño (bytes) el corpus se carga entero en memoria; los más
+# grandes solo se miden con la lectura por bloques
+LIMITE_EN_MEMORIA = 64_000_000
+
+# Las dos caches en memoria: cada ejecución empieza en frío y no deja nada en disco
+CACHES_BENCHMARK = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+    'analisis': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark_analisis'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el procesamiento de texto y los endpoints sobre un corpus sintético en español '
+        '(percentiles, throughput y memoria pico) y lo compara con una línea base'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanos', nargs='+', type=float, default=[0.01, 1, 10],
+            help='Tamaños del corpus en MB (por defecto: 0.01 1 10; hasta 500)',
+        )
+        parser.add_argument(
+            '--ordenes', nargs='+', type=int, default=list(range(2, 21)),
+            help='Órdenes de n-gramas a medir (por defecto: 2 a 20)',
+        )
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument(
+            '--peticiones', type=int, default=100,
+            help='Peticiones HTTP por endpoint (0 para no medir endpoints)',
+        )
+        parser.add_argument('--tamano-http', type=float, default=1, help='Corpus de los endpoints en MB')
+        parser.add_argument('--sin-memoria', action='store_true', help='No medir la memoria pico')
+        parser.add_argument('--guardar', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--comparar', help='Archivo JSON con una línea base guardada con --guardar')
+        parser.add_argument(
+            '--tolerancia', type=float, default=TOLERANCIA_DEFECTO,
+            help='Cuánto más lenta puede ser la mediana antes de contar como regresión (0.10 = 10 %%)',
+        )
+
+    def handle(self, *args, **opciones):
+        self.memoria = not opciones['sin_memoria']
+        self.repeticiones = opciones['repeticiones']
+        self.resultados = {}
+
+        for tamano_mb in opciones['tamanos']:
+            self.medir_pipeline(int(tamano_mb * 1_000_000), tamano_mb, opciones['ordenes'], opciones['semilla'])
+        if opciones['peticiones'] > 0:
+            self.medir_endpoints(
+                int(opciones['tamano_http'] * 1_000_000), opciones['peticiones'], opciones['semilla']
+            )
+
+        if opciones['guardar']:
+            parametros = {clave: opciones[clave] for clave in (
+                'tamanos', 'ordenes', 'repeticiones', 'semilla', 'peticiones', 'tamano_http',
+            )}
+            guardar_resultados(opciones['guardar'], self.resultados, parametros)
+            self.stdout.write(f"Resultados guardados en {opciones['guardar']}")
+        if opciones['comparar']:
+            self.comparar(cargar_resultados(opciones['comparar']), opciones['tolerancia'])
+
+    def registrar(self, nombre, resultado):
+        self.resultados[nombre] = resultado
+        columnas = [f"p50 {resultado['p50'] * 1000:10.2f} ms", f"p90 {resultado['p90'] * 1000:10.2f} ms"]
+        if resultado.get('mb_por_segundo'):
+            columnas.append(f"{resultado['mb_por_segundo']:8.2f} MB/s")
+        if 'peticiones_por_segundo' in resultado:
+            columnas.append(f"{resultado['peticiones_por_segundo']:8.1f} pet/s")
+            columnas.append(f"primera {resultado['primera'] * 1000:8.2f} ms")
+        if 'memoria_pico_mb' in resultado:
+            columnas.append(f"pico {resultado['memoria_pico_mb']:8.1f} MB")
+        self.stdout.write(f'  {nombre:<58} ' + '  '.join(columnas))
+
+    def medir_pipeline(self, tamano_bytes, tamano_mb, ordenes, semilla):
+        self.stdout.write(f'Corpus de {tamano_mb:g} MB')
+        etiqueta = f'{tamano_mb:g}MB'
+
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'corpus.txt')
+            with open(ruta, 'wb') as archivo:
+                bytes_corpus = escribir_corpus_sintetico(archivo, tamano_bytes, semilla)
+
+            def tokens_por_bloques():
+                with open(ruta, 'rb') as archivo:
+                    for _ in iterar_tokens(leer_bloques(archivo)):
+                        pass
+
+            self.registrar(f'iterar_tokens (archivo) {etiqueta}', medir(
+                tokens_por_bloques, self.repeticiones, bytes_corpus, self.memoria
+            ))
+
+        if tamano_bytes > LIMITE_EN_MEMORIA:
+            self.stdout.write(f'  (más de {LIMITE_EN_MEMORIA // 1_000_000} MB: solo la lectura por bloques)')
+            return
+
+        texto = generar_corpus_sintetico(tamano_bytes, semilla)
+        limpieza = (
+            ('normalizar_acentos', normalizar_acentos),
+            ('limpiar_texto', limpiar_texto),
+            ('limpiar_texto_con_fronteras', limpiar_texto_con_fronteras),
+        )
+        for nombre, funcion in limpieza:
+            self.registrar(f'{nombre} {etiqueta}', medir(
+                lambda: funcion(texto), self.repeticiones, bytes_corpus, self.memoria
+            ))
+
+        tokens = limpiar_texto(texto)
+        for n in ordenes:
+            self.registrar(f'generar_ngramas n={n} {etiqueta}', medir(
+                lambda: generar_ngramas(tokens, n), self.repeticiones, bytes_corpus, self.memoria
+            ))
+            self.registrar(f'calcular_probabilidad_ngramas_general n={n} {etiqueta}', medir(
+                lambda: calcular_probabilidad_ngramas_general(tokens, n), self.repeticiones, bytes_corpus, self.memoria
+            ))
+
+    def medir_endpoints(self, tamano_bytes, cantidad, semilla):
+        """
+        Endpoints por el cliente de pruebas de Django, sobre una base de
+        datos de pruebas y un MEDIA_ROOT temporal que se borran al terminar
+        """
+        self.stdout.write(f'Endpoints ({cantidad} peticiones cada uno)')
+        contenido = generar_corpus_sintetico(tamano_bytes, semilla)
+
+        setup_test_environment()
+        nombre_base = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                MEDIA_ROOT=media, ANALISIS_TAREAS_SINCRONAS=True, CACHES=CACHES_BENCHMARK,
+            ):
+                cache.vaciar()
+                texto = TextoAnalizado(titulo='Benchmark')
+                texto.archivo.save('benchmark.txt', ContentFile(contenido.encode('utf-8')))
+                # El modelo se entrena antes: se mide la consulta, no el entrenamiento
+                obtener_modelo(texto, N_GRAMA_DEFECTO, FRONTERAS_DEFECTO)
+
+                generador = random.Random(semilla)
+                tokens = limpiar_texto(contenido[:200_000])
+                sugerencias = []
+                for i in range(cantidad):
+                    posicion = generador.randrange(max(len(tokens) - 2, 1))
+                    sugerencias.append(('get', reverse('obtener_sugerencias'), {
+                        'texto': ' '.join(tokens[posicion:posicion + 2]),
+                        'texto_id': texto.id,
+                        'n_grama': N_GRAMA_DEFECTO,
+                        'suavizado': ('mle', 'kneser_ney')[i % 2],
+                    }))
+                analisis = [
+                    ('get', reverse('analizar_texto', args=[texto.id]), {'n_grama': 1 + i % 5})
+                    for i in range(cantidad)
+                ]
+
+                cliente = Client()
+                self.registrar('GET obtener_sugerencias', medir_peticiones(cliente, sugerencias, self.memoria))
+                self.registrar('GET analizar_texto', medir_peticiones(cliente, analisis, self.memoria))
+        finally:
+            connection.creation.destroy_test_db(nombre_base, verbosity=0)
+            teardown_test_environment()
+
+    def comparar(self, base, tolerancia):
+        self.stdout.write(f'Comparación con la línea base (tolerancia {tolerancia:.0%})')
+        regresiones = []
+        for nombre, actual, anterior, cambio, es_regresion in comparar_con_base(self.resultados, base, tolerancia):
+            linea = f'  {nombre:<58} {anterior * 1000:10.2f} ms -> {actual * 1000:10.2f} ms  {cambio:+7.1%}'
+            if es_regresion:
+                regresiones.append(nombre)
+                self.stdout.write(self.style.ERROR(linea))
+            else:
+                self.stdout.write(self.style.SUCCESS(linea))
+        if regresiones:
+            raise CommandError(f'{len(regresiones)} mediciones más lentas que la línea base: {", ".join(regresiones)}')
@@ -0,0 +1,99 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analisis.models import TareaEntrenamiento
+from analisis.tareas import (
+    cerrar_conexiones, devolver_tareas, ejecutar_tarea, inicializar_proceso, reclamar_pendientes, reencolar_abandonadas,
+)
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta en segundo plano las tareas de entrenamiento pendientes con un pool de procesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Número de procesos del pool (por defecto: núcleos disponibles)',
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2.0,
+            help='Segundos de espera entre consultas cuando no hay tareas',
+        )
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa las tareas pendientes y termina',
+        )
+
+    def handle(self, *args, **opciones):
+        procesos = max(opciones['procesos'], 1)
+        en_curso = {}
+
+        # Las tareas que siguen en proceso al arrancar quedaron de un worker
+        # anterior que murió (se asume un solo procesar_tareas por base de datos)
+        reencoladas = reencolar_abandonadas(timezone.now())
+        if reencoladas:
+            self.stdout.write(self.style.WARNING(f'{reencoladas} tareas abandonadas reencoladas'))
+
+        pool = self.crear_pool(procesos)
+        try:
+            while True:
+                libres = procesos - len(en_curso)
+                if libres > 0:
+                    reclamadas = reclamar_pendientes(libres)
+                    try:
+                        while reclamadas:
+                            # Los hijos no deben heredar la conexión abierta
+                            cerrar_conexiones()
+                            futuro = pool.submit(ejecutar_tarea, reclamadas[0])
+                            tarea_id = reclamadas.pop(0)
+                            en_curso[futuro] = tarea_id
+                            self.stdout.write(f'Tarea {tarea_id} iniciada')
+                    except BrokenProcessPool:
+                        # Un hijo murió y el pool ya no acepta tareas: se informan las
+                        # que estaban en curso, se devuelven las que no se enviaron y
+                        # se empieza con un pool nuevo
+                        devolver_tareas(reclamadas)
+                        wait(en_curso)
+                        for futuro, tarea_id in en_curso.items():
+                            self.informar(tarea_id, futuro)
+                        en_curso.clear()
+                        pool.shutdown(wait=True)
+                        pool = self.crear_pool(procesos)
+                        self.stdout.write(self.style.WARNING('Pool de procesos reiniciado'))
+                        continue
+
+                if not en_curso:
+                    if opciones['una_vez']:
+                        break
+                    time.sleep(opciones['intervalo'])
+                    continue
+
+                terminadas, _ = wait(en_curso, timeout=opciones['intervalo'], return_when=FIRST_COMPLETED)
+                for futuro in terminadas:
+                    tarea_id = en_curso.pop(futuro)
+                    self.informar(tarea_id, futuro)
+        finally:
+            pool.shutdown(wait=True)
+
+    def crear_pool(self, procesos):
+        return ProcessPoolExecutor(max_workers=procesos, initializer=inicializar_proceso)
+
+    def informar(self, tarea_id, futuro):
+        try:
+            exito = futuro.result()
+        except Exception as e:
+            # El proceso hijo murió sin poder registrar el error
+            TareaEntrenamiento.objects.filter(id=tarea_id).update(
+                estado=TareaEntrenamiento.ERROR, mensaje=str(e), fecha_fin=timezone.now()
+            )
+            exito = False
+
+        if exito:
+            self.stdout.write(self.style.SUCCESS(f'Tarea {tarea_id} completada'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Tarea {tarea_id} con error'))
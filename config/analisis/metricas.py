@@ -0,0 +1,285 @@
+"""Tiempos por etapa del procesamiento y de cada petición.
+
+Las funciones costosas marcan sus etapas con ``etapa('nombre')`` (un
+context manager) o ``@medir('nombre')``. Cada duración se suma a un
+histograma por etapa de este proceso y, si hay una petición en curso, a
+sus tiempos: ``ServerTimingMiddleware`` los devuelve en la cabecera
+``Server-Timing`` (visible en las herramientas de desarrollo del
+navegador) y ``PlantillasMedidas`` agrega el renderizado de plantillas.
+Los histogramas se consultan en la API de métricas, en JSON o en el
+formato de texto de Prometheus.
+
+Cada llamada cuenta como una observación: lo que se mide por tramos (un
+bloque del archivo cada vez) se acumula con ``etapa_acumulada('nombre')``
+y se registra una sola vez al cerrarla, así un archivo grande no pesa más
+en los percentiles que una petición chica.
+
+Las etapas pueden anidarse (la lectura ocurre mientras se tokeniza y se
+cuenta), así que sus tiempos no se suman al total. Con
+``ANALISIS_METRICAS = False`` etapa() devuelve siempre el mismo context
+manager vacío y el middleware no hace nada.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+# Límites superiores (en segundos) de las cubetas de los histogramas
+LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Tiempos por etapa de la petición en curso, o None fuera de una petición
+_tiempos_peticion = ContextVar('tiempos_peticion', default=None)
+_activo = None
+_NULA = nullcontext()
+
+
+def activo():
+    """Si se están midiendo tiempos (ANALISIS_METRICAS en settings)"""
+    global _activo
+    if _activo is None:
+        _activo = getattr(settings, 'ANALISIS_METRICAS', True)
+    return _activo
+
+
+@receiver(setting_changed)
+def _reiniciar_activo(setting, **kwargs):
+    global _activo
+    if setting == 'ANALISIS_METRICAS':
+        _activo = None
+
+
+class Histograma:
+    """Cuántas duraciones cayeron en cada cubeta de LIMITES, más su suma"""
+
+    def __init__(self):
+        self.cubetas = [0] * (len(LIMITES) + 1)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, segundos):
+        self.cubetas[bisect_left(LIMITES, segundos)] += 1
+        self.suma += segundos
+        self.cuenta += 1
+
+    def acumuladas(self):
+        """(límite, observaciones <= límite) como en Prometheus; el último es +Inf"""
+        total = 0
+        resultado = []
+        for limite, cantidad in zip(LIMITES + (float('inf'),), self.cubetas):
+            total += cantidad
+            resultado.append((limite, total))
+        return resultado
+
+
+class RegistroMetricas:
+    """Histogramas de duraciones por familia ('etapa', 'vista') y nombre, seguro entre hilos"""
+
+    def __init__(self):
+        self._histogramas = {}
+        self._candado = threading.Lock()
+
+    def observar(self, familia, nombre, segundos):
+        with self._candado:
+            histograma = self._histogramas.get((familia, nombre))
+            if histograma is None:
+                histograma = self._histogramas[(familia, nombre)] = Histograma()
+            histograma.observar(segundos)
+
+    def vaciar(self):
+        with self._candado:
+            self._histogramas.clear()
+
+    def exportar(self):
+        """{familia: {nombre: {cuenta, suma, promedio, cubetas}}}"""
+        resultado = {}
+        with self._candado:
+            for (familia, nombre), histograma in sorted(self._histogramas.items()):
+                resultado.setdefault(familia, {})[nombre] = {
+                    'cuenta': histograma.cuenta,
+                    'suma': histograma.suma,
+                    'promedio': histograma.suma / histograma.cuenta,
+                    'cubetas': {
+                        ('+Inf' if limite == float('inf') else str(limite)): cantidad
+                        for limite, cantidad in histograma.acumuladas()
+                    },
+                }
+        return resultado
+
+    def prometheus(self):
+        """Los histogramas en el formato de texto de exposición de Prometheus"""
+        lineas = []
+        for familia, histogramas in self.exportar().items():
+            metrica = f'analisis_{familia}_segundos'
+            lineas.append(f'# HELP {metrica} Duración por {familia} en segundos')
+            lineas.append(f'# TYPE {metrica} histogram')
+            for nombre, datos in histogramas.items():
+                for limite, cantidad in datos['cubetas'].items():
+                    lineas.append(f'{metrica}_bucket{{{familia}="{nombre}",le="{limite}"}} {cantidad}')
+                lineas.append(f'{metrica}_sum{{{familia}="{nombre}"}} {datos["suma"]}')
+                lineas.append(f'{metrica}_count{{{familia}="{nombre}"}} {datos["cuenta"]}')
+        return '\n'.join(lineas) + '\n'
+
+
+registro = RegistroMetricas()
+
+
+def registrar(nombre, segundos):
+    """Suma la duración de una etapa a su histograma y a la petición en curso"""
+    tiempos = _tiempos_peticion.get()
+    if tiempos is not None:
+        tiempos[nombre] = tiempos.get(nombre, 0.0) + segundos
+    registro.observar('etapa', nombre, segundos)
+
+
+class _Etapa:
+    __slots__ = ('nombre', 'inicio')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *excepcion):
+        registrar(self.nombre, time.perf_counter() - self.inicio)
+
+
+def etapa(nombre):
+    """Context manager que mide el bloque como la etapa `nombre`"""
+    return _Etapa(nombre) if activo() else _NULA
+
+
+class _EtapaAcumulada:
+    __slots__ = ('nombre', 'inicio', 'segundos')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.segundos = 0.0
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *excepcion):
+        self.segundos += time.perf_counter() - self.inicio
+
+    def cerrar(self):
+        registrar(self.nombre, self.segundos)
+
+
+class _EtapaAcumuladaNula:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *excepcion):
+        pass
+
+    def cerrar(self):
+        pass
+
+
+_NULA_ACUMULADA = _EtapaAcumuladaNula()
+
+
+def etapa_acumulada(nombre):
+    """
+    Como etapa(), pero se puede entrar varias veces: los tramos se suman y
+    cerrar() los registra como una sola observación de la etapa `nombre`
+    """
+    return _EtapaAcumulada(nombre) if activo() else _NULA_ACUMULADA
+
+
+def medir(nombre):
+    """Decorador que mide cada llamada a la función como la etapa `nombre`"""
+    def decorador(funcion):
+        @wraps(funcion)
+        def medida(*args, **kwargs):
+            with etapa(nombre):
+                return funcion(*args, **kwargs)
+        return medida
+    return decorador
+
+
+class ServerTimingMiddleware:
+    """
+    Mide cada petición y agrega la cabecera Server-Timing con el total y
+    el tiempo de cada etapa, en milisegundos. El total también se guarda
+    en el histograma de la vista (familia 'vista').
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        if not activo():
+            return self.get_response(request)
+        tiempos = {}
+        marca = _tiempos_peticion.set(tiempos)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _tiempos_peticion.reset(marca)
+        return self.anotar(request, respuesta, tiempos, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        if not activo():
+            return await self.get_response(request)
+        tiempos = {}
+        marca = _tiempos_peticion.set(tiempos)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _tiempos_peticion.reset(marca)
+        return self.anotar(request, respuesta, tiempos, time.perf_counter() - inicio)
+
+    def anotar(self, request, respuesta, tiempos, total):
+        coincidencia = getattr(request, 'resolver_match', None)
+        if coincidencia is not None and coincidencia.url_name:
+            registro.observar('vista', coincidencia.url_name, total)
+        respuesta['Server-Timing'] = ', '.join(
+            f'{nombre};dur={segundos * 1000:.2f}'
+            for nombre, segundos in [('total', total)] + sorted(tiempos.items())
+        )
+        return respuesta
+
+
+class PlantillaMedida:
+    """Plantilla que mide su renderizado como la etapa 'plantilla'"""
+
+    def __init__(self, plantilla):
+        self.plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self.plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        with etapa('plantilla'):
+            return self.plantilla.render(context, request)
+
+
+class PlantillasMedidas(DjangoTemplates):
+    """Backend DjangoTemplates cuyas plantillas miden su renderizado"""
+
+    def from_string(self, template_code):
+        return PlantillaMedida(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return PlantillaMedida(super().get_template(template_name))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModeloNgramas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n', models.PositiveSmallIntegerField()),
+                ('usar_fronteras', models.BooleanField(default=False)),
+                ('archivo', models.FileField(upload_to='modelos/')),
+                ('total_palabras', models.PositiveIntegerField(default=0)),
+                ('total_ngramas', models.PositiveIntegerField(default=0)),
+                ('fecha_entrenamiento', models.DateTimeField(auto_now=True)),
+                ('texto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='modelos', to='analisis.textoanalizado')),
+            ],
+            options={
+                'unique_together': {('texto', 'n', 'usar_fronteras')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0002_modelongramas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TareaEntrenamiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n', models.PositiveSmallIntegerField()),
+                ('usar_fronteras', models.BooleanField(default=False)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completada', 'Completada'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('progreso', models.FloatField(default=0.0)),
+                ('mensaje', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('modelo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='analisis.modelongramas')),
+                ('texto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tareas', to='analisis.textoanalizado')),
+            ],
+            options={
+                'ordering': ['fecha_creacion'],
+            },
+        ),
+    ]
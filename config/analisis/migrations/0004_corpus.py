@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0003_tareaentrenamiento'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='modelongramas',
+            name='texto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modelos', to='analisis.textoanalizado'),
+        ),
+        migrations.AlterField(
+            model_name='tareaentrenamiento',
+            name='texto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tareas', to='analisis.textoanalizado'),
+        ),
+        migrations.CreateModel(
+            name='Corpus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titulo', models.CharField(max_length=200)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('textos', models.ManyToManyField(related_name='corpus', to='analisis.textoanalizado')),
+            ],
+            options={
+                'verbose_name_plural': 'corpus',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='modelongramas',
+            unique_together={('texto', 'n', 'usar_fronteras')},
+        ),
+        migrations.AddField(
+            model_name='modelongramas',
+            name='corpus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modelos', to='analisis.corpus'),
+        ),
+        migrations.AddField(
+            model_name='tareaentrenamiento',
+            name='corpus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tareas', to='analisis.corpus'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='modelongramas',
+            unique_together={('corpus', 'n', 'usar_fronteras'), ('texto', 'n', 'usar_fronteras')},
+        ),
+    ]
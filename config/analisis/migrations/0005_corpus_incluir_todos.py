@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0004_corpus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpus',
+            name='incluir_todos',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0005_corpus_incluir_todos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='estadisticas',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0006_textoanalizado_estadisticas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='suma',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='tamano_vocabulario',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='tokens',
+            field=models.FileField(blank=True, editable=False, upload_to='tokens/'),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='total_tokens',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
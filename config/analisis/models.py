@@ -5,5 +5,86 @@ class TextoAnalizado(models.Model):
     titulo = models.CharField(max_length=200) 
     archivo = models.FileField(upload_to='textos/') 
     fecha_subida = models.DateTimeField(auto_now_add=True) 
+    # Estadísticas de la limpieza, calculadas al subirlo (ver utils.estadisticas_procesamiento)
+    estadisticas = models.JSONField(null=True, blank=True, editable=False)
+    # Tokens limpios ya codificados (ver formato_tokens.py), también armados al subirlo
+    tokens = models.FileField(upload_to='tokens/', blank=True, editable=False)
+    total_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    tamano_vocabulario = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # SHA-256 del archivo del que salieron las estadísticas y los tokens
+    suma = models.CharField(max_length=64, blank=True, editable=False)
     def __str__(self): 
-        return self.titulo
\ No newline at end of file
+        return self.titulo
+
+class Corpus(models.Model):
+    """Conjunto de textos con el que se entrena un único modelo combinado"""
+    titulo = models.CharField(max_length=200)
+    textos = models.ManyToManyField(TextoAnalizado, related_name='corpus')
+    # Los textos que se suban después se agregan solos al corpus
+    incluir_todos = models.BooleanField(default=False)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'corpus'
+
+    def __str__(self):
+        return self.titulo
+
+class ModeloNgramas(models.Model):
+    """Modelo de n-gramas ya entrenado y guardado en disco para un texto o un corpus"""
+    texto = models.ForeignKey(TextoAnalizado, on_delete=models.CASCADE, related_name='modelos', null=True, blank=True)
+    corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE, related_name='modelos', null=True, blank=True)
+    n = models.PositiveSmallIntegerField()
+    usar_fronteras = models.BooleanField(default=False)
+    archivo = models.FileField(upload_to='modelos/')
+    total_palabras = models.PositiveIntegerField(default=0)
+    total_ngramas = models.PositiveIntegerField(default=0)
+    fecha_entrenamiento = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('texto', 'n', 'usar_fronteras'), ('corpus', 'n', 'usar_fronteras')]
+
+    @property
+    def fuente(self):
+        """Texto o corpus con el que se entrenó el modelo"""
+        return self.corpus if self.corpus_id else self.texto
+
+    def __str__(self):
+        fronteras = 'con fronteras' if self.usar_fronteras else 'sin fronteras'
+        return f'{self.fuente} ({self.n}-gramas, {fronteras})'
+
+class TareaEntrenamiento(models.Model):
+    """Entrenamiento de un modelo que se ejecuta en segundo plano"""
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    COMPLETADA = 'completada'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (COMPLETADA, 'Completada'),
+        (ERROR, 'Error'),
+    ]
+
+    texto = models.ForeignKey(TextoAnalizado, on_delete=models.CASCADE, related_name='tareas', null=True, blank=True)
+    corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE, related_name='tareas', null=True, blank=True)
+    n = models.PositiveSmallIntegerField()
+    usar_fronteras = models.BooleanField(default=False)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    progreso = models.FloatField(default=0.0)
+    mensaje = models.TextField(blank=True)
+    modelo = models.ForeignKey(ModeloNgramas, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['fecha_creacion']
+
+    @property
+    def fuente(self):
+        """Texto o corpus que se va a entrenar"""
+        return self.corpus if self.corpus_id else self.texto
+
+    def __str__(self):
+        return f'Entrenar {self.n}-gramas de {self.fuente} ({self.get_estado_display()})'
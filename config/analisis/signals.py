@@ -0,0 +1,30 @@
+"""Mantiene al día los modelos de corpus y la cache cuando cambian los textos"""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .almacen import agregar_texto_corpus, quitar_texto_corpus
+from .cache_textos import invalidar_texto
+from .models import Corpus, TextoAnalizado
+
+
+@receiver(post_save, sender=TextoAnalizado)
+def agregar_a_corpus_abiertos(sender, instance, created, **kwargs):
+    """Un texto nuevo entra en los corpus marcados con incluir_todos"""
+    if not created:
+        return
+    for corpus in Corpus.objects.filter(incluir_todos=True):
+        agregar_texto_corpus(corpus, instance)
+
+
+@receiver(pre_delete, sender=TextoAnalizado)
+def descontar_de_corpus(sender, instance, **kwargs):
+    """Antes de borrar un texto (aún está en disco) se descuenta de sus corpus"""
+    for corpus in instance.corpus.all():
+        quitar_texto_corpus(corpus, instance)
+
+
+@receiver(post_save, sender=TextoAnalizado)
+@receiver(post_delete, sender=TextoAnalizado)
+def invalidar_cache_texto(sender, instance, **kwargs):
+    """Los tokens y conteos guardados de un texto dejan de ser válidos"""
+    invalidar_texto(instance.id)
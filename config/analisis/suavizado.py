@@ -0,0 +1,215 @@
+"""Modelos de lenguaje suavizados sobre los modelos binarios.
+
+La estimación por máxima verosimilitud (``mle``) da probabilidad cero a lo
+que no aparece en el corpus: con un contexto nuevo no hay sugerencias. Los
+otros métodos estiman P(palabra | contexto) también en ese caso:
+
+* ``laplace``: add-k, (C(h w) + k) / (C(h) + k |V|)
+* ``kneser_ney``: Kneser-Ney interpolado; los órdenes inferiores usan
+  conteos de continuación (con cuántas palabras distintas a la izquierda
+  aparece cada n-grama) en lugar de frecuencias
+* ``stupid_backoff``: si C(h w) = 0 se retrocede al contexto más corto
+  multiplicando por ``ALFA_STUPID_BACKOFF`` (puntuación, no probabilidad)
+
+Los conteos de continuación, descuentos, denominadores y pesos de back-off
+se calculan al entrenar y se guardan en el archivo (formato_binario.py): al
+consultar, cada orden del back-off cuesta una búsqueda binaria del contexto
+y otra de la palabra.
+"""
+import heapq
+import math
+
+METODOS = ('mle', 'laplace', 'kneser_ney', 'stupid_backoff')
+K_DEFECTO = 1.0
+ALFA_STUPID_BACKOFF = 0.4
+
+# Candidatas que se toman de cada orden por cada sugerencia pedida
+CANDIDATAS_POR_SUGERENCIA = 4
+
+# Búsqueda en haz de frases: frases que se conservan en cada paso y palabras
+ANCHO_HAZ_DEFECTO = 5
+LONGITUD_FRASE_DEFECTO = 3
+
+
+class ModeloSuavizado:
+    """Estimador de P(palabra | contexto) sobre un ModeloBinario"""
+
+    def __init__(self, modelo, metodo='kneser_ney', k=K_DEFECTO, alfa=ALFA_STUPID_BACKOFF, orden=None):
+        """orden limita el modelo a sus órdenes 1..orden (por defecto, n)"""
+        if metodo not in METODOS:
+            raise ValueError(f'Método de suavizado desconocido: {metodo}')
+        if k <= 0:
+            raise ValueError('k debe ser mayor que cero')
+        self.modelo = modelo
+        self.orden = min(orden or modelo.n, modelo.n)
+        self.metodo = metodo
+        self.k = k
+        self.alfa = alfa
+
+    def niveles(self, palabras):
+        """
+        Tablas y posiciones del contexto (las últimas orden-1 palabras) y de sus
+        sufijos, del orden más alto al unigrama. La posición es None si el
+        contexto no aparece en el corpus.
+        """
+        return self.niveles_ids([self.modelo.id(palabra) for palabra in palabras])
+
+    def niveles_ids(self, ids):
+        """Como niveles, con el contexto ya convertido a ids del modelo"""
+        ids = ids[max(len(ids) - self.orden + 1, 0):]
+        niveles = []
+        for inicio in range(len(ids) + 1):
+            tabla = self.modelo.tablas[len(ids) - inicio + 1]
+            niveles.append((tabla, tabla.posicion(tuple(ids[inicio:]))))
+        return niveles
+
+    def probabilidad(self, palabra, contexto):
+        """P(palabra | contexto), con el contexto como lista de palabras"""
+        id_palabra = self.modelo.id(palabra)
+        return self.puntuar(self.niveles(contexto), id_palabra)
+
+    def puntuar(self, niveles, id_palabra):
+        return getattr(self, '_' + self.metodo)(niveles, id_palabra)
+
+    def _conteos(self, tabla, posicion, id_palabra):
+        """C(contexto, palabra) y C(contexto) en una tabla"""
+        if posicion is None:
+            return 0, 0
+        indice = None if id_palabra is None else tabla.buscar(posicion, id_palabra)
+        frecuencia = tabla.frecuencias[indice] if indice is not None else 0
+        return frecuencia, tabla.frecuencias_contexto[posicion]
+
+    def _mle(self, niveles, id_palabra):
+        frecuencia, frecuencia_contexto = self._conteos(*niveles[0], id_palabra)
+        return frecuencia / frecuencia_contexto if frecuencia_contexto else 0.0
+
+    def _laplace(self, niveles, id_palabra):
+        frecuencia, frecuencia_contexto = self._conteos(*niveles[0], id_palabra)
+        # La palabra desconocida cuenta como un tipo más del vocabulario
+        tipos = self.modelo.num_palabras + (id_palabra is None)
+        return (frecuencia + self.k) / (frecuencia_contexto + self.k * tipos)
+
+    def _stupid_backoff(self, niveles, id_palabra):
+        factor = 1.0
+        for tabla, posicion in niveles:
+            frecuencia, frecuencia_contexto = self._conteos(tabla, posicion, id_palabra)
+            if frecuencia and frecuencia_contexto:
+                return factor * frecuencia / frecuencia_contexto
+            factor *= self.alfa
+        return 0.0
+
+    def _kneser_ney(self, niveles, id_palabra):
+        # Se interpola desde la distribución uniforme hacia el orden más alto:
+        # P_k = max(c - D_k, 0) / den(h) + peso(h) * P_(k-1)
+        probabilidad = 1 / max(self.modelo.num_palabras, 1)
+        for tabla, posicion in reversed(niveles):
+            if posicion is None:
+                continue
+            denominador = tabla.denominadores[posicion]
+            if not denominador:
+                continue
+            indice = None if id_palabra is None else tabla.buscar(posicion, id_palabra)
+            frecuencia = tabla.frecuencias_kn[indice] if indice is not None else 0
+            probabilidad = (
+                max(frecuencia - tabla.descuento, 0) / denominador
+                + tabla.pesos[posicion] * probabilidad
+            )
+        return probabilidad
+
+    def candidatas(self, niveles, max_sugerencias, rango=None):
+        """
+        Ids de palabras candidatas: las más frecuentes tras el contexto y,
+        salvo con mle, tras cada contexto más corto del back-off. Con rango
+        (ids [desde, hasta) de ModeloBinario.rango_prefijo) solo esas palabras.
+        """
+        cupo = max_sugerencias * CANDIDATAS_POR_SUGERENCIA
+        vistas = {}
+        for tabla, posicion in niveles if self.metodo != 'mle' else niveles[:1]:
+            if posicion is None:
+                continue
+            if rango is None:
+                continuaciones = tabla.continuaciones(posicion, limite=cupo)
+            else:
+                continuaciones = tabla.mejores(posicion, *rango, cupo)
+            for id_palabra, _ in continuaciones:
+                vistas.setdefault(id_palabra, tabla.orden)
+        return vistas
+
+    def sugerencias(self, palabras, max_sugerencias, prefijo=None):
+        """
+        Las palabras más probables tras el contexto, de mayor a menor:
+        [(palabra, probabilidad, C(contexto, palabra), C(contexto), orden)]
+        donde orden es el del n-grama más largo visto en el corpus. Con
+        prefijo solo se sugieren palabras que empiezan con él (la palabra
+        que se está escribiendo).
+        """
+        niveles = self.niveles(palabras)
+        rango = self.modelo.rango_prefijo(prefijo) if prefijo else None
+        if rango is not None and rango[0] == rango[1]:
+            return []
+        candidatas = self.candidatas(niveles, max_sugerencias, rango)
+        # sorted es estable: en los empates queda primero lo visto en el orden más alto
+        puntuadas = sorted(
+            ((id_palabra, self.puntuar(niveles, id_palabra)) for id_palabra in candidatas),
+            key=lambda par: -par[1],
+        )
+        resultado = []
+        for id_palabra, probabilidad in puntuadas[:max_sugerencias]:
+            frecuencia, frecuencia_contexto = self._conteos(*niveles[0], id_palabra)
+            resultado.append((
+                self.modelo.palabra(id_palabra), probabilidad,
+                frecuencia, frecuencia_contexto, candidatas[id_palabra],
+            ))
+        return resultado
+
+    def expansiones(self, contexto, ancho):
+        """Las `ancho` palabras más probables tras un contexto de ids: [(id, log P)]"""
+        niveles = self.niveles_ids(contexto)
+        puntuadas = sorted(
+            ((id_palabra, self.puntuar(niveles, id_palabra)) for id_palabra in self.candidatas(niveles, ancho)),
+            key=lambda par: -par[1],
+        )
+        return [(id_palabra, math.log(probabilidad)) for id_palabra, probabilidad in puntuadas[:ancho] if probabilidad > 0]
+
+    def frases(self, palabras, max_frases, ancho=ANCHO_HAZ_DEFECTO, longitud=LONGITUD_FRASE_DEFECTO, expandir=None):
+        """
+        Búsqueda en haz de continuaciones de hasta `longitud` palabras. En
+        cada paso se expande cada frase del haz con sus `ancho` mejores
+        palabras y se conservan las `ancho` frases más probables. Como una
+        frase larga siempre es menos probable que su prefijo, se ordenan por
+        log-probabilidad media por palabra. Devuelve [(palabras, log P)].
+
+        expandir(contexto) reemplaza a expansiones (por ejemplo para usar una
+        cache); dentro de una búsqueda cada contexto se expande una sola vez.
+        """
+        contexto = tuple(self.modelo.id(palabra) for palabra in palabras)
+        ancho_contexto = self.orden - 1
+        fin_oracion = self.modelo.id('</s>')
+        expandidos = {}
+
+        def expandir_contexto(ids):
+            ids = ids[max(len(ids) - ancho_contexto, 0):]
+            resultado = expandidos.get(ids)
+            if resultado is None:
+                resultado = expandidos[ids] = expandir(ids) if expandir else self.expansiones(ids, ancho)
+            return resultado
+
+        haz = [((), 0.0)]
+        terminadas = []
+        for _ in range(longitud):
+            siguientes = []
+            for frase, log_probabilidad in haz:
+                for id_palabra, log_siguiente in expandir_contexto(contexto + frase):
+                    siguientes.append((frase + (id_palabra,), log_probabilidad + log_siguiente))
+            haz = heapq.nlargest(ancho, siguientes, key=lambda par: par[1])
+            terminadas.extend(haz)
+            # Una frase que cierra la oración no se sigue extendiendo
+            haz = [par for par in haz if par[0][-1] != fin_oracion]
+            if not haz:
+                break
+
+        mejores = heapq.nlargest(max_frases, terminadas, key=lambda par: par[1] / len(par[0]))
+        return [
+            ([self.modelo.palabra(id_palabra) for id_palabra in frase], log_probabilidad)
+            for frase, log_probabilidad in mejores
+        ]
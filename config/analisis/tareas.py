@@ -0,0 +1,148 @@
+"""Entrenamiento de modelos en segundo plano.
+
+Las tareas se guardan en la tabla ``TareaEntrenamiento`` y las ejecuta el
+comando ``python manage.py procesar_tareas`` con un pool de procesos, sin
+necesidad de un broker externo. Con ``ANALISIS_TAREAS_SINCRONAS = True`` en
+settings se ejecutan dentro de la misma petición (útil en pruebas).
+"""
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+
+from .almacen import entrenar_modelo_ngramas, filtro_fuente
+from .cache_textos import candado, clave_compartida
+from .models import TareaEntrenamiento
+
+# Segundos mínimos entre dos actualizaciones del progreso en la base de datos
+INTERVALO_PROGRESO = 0.5
+
+ESTADOS_ACTIVOS = [TareaEntrenamiento.PENDIENTE, TareaEntrenamiento.EN_PROCESO]
+
+# Segundos tras los que una tarea en proceso se da por abandonada
+TIEMPO_ABANDONO_DEFECTO = 60 * 60
+
+
+def tareas_sincronas():
+    return getattr(settings, 'ANALISIS_TAREAS_SINCRONAS', False)
+
+
+def tiempo_abandono():
+    return getattr(settings, 'ANALISIS_TIEMPO_ABANDONO', TIEMPO_ABANDONO_DEFECTO)
+
+
+def reencolar_abandonadas(antes=None, **filtro):
+    """
+    Devuelve a pendientes las tareas en proceso que empezaron antes de
+    `antes` (por defecto, hace ANALISIS_TIEMPO_ABANDONO segundos): el
+    proceso que las ejecutaba murió sin poder registrar el resultado.
+    Devuelve cuántas se reencolaron.
+    """
+    if antes is None:
+        antes = timezone.now() - timedelta(seconds=tiempo_abandono())
+    return TareaEntrenamiento.objects.filter(
+        estado=TareaEntrenamiento.EN_PROCESO, fecha_inicio__lt=antes, **filtro
+    ).update(
+        estado=TareaEntrenamiento.PENDIENTE, progreso=0.0, fecha_inicio=None,
+        mensaje='Reencolada: el proceso que la ejecutaba terminó sin informar',
+    )
+
+
+def encolar_entrenamiento(fuente, n, usar_fronteras=False):
+    """
+    Crea una tarea de entrenamiento para un texto o corpus, o devuelve la que
+    ya esté pendiente o en proceso para la misma fuente y configuración. Una
+    tarea en proceso desde hace demasiado se reencola en lugar de esperarla.
+    """
+    filtro = dict(filtro_fuente(fuente), n=n, usar_fronteras=usar_fronteras)
+    # Con el candado, peticiones simultáneas por un modelo frío crean una sola tarea
+    nombre = clave_compartida(('encolar', type(fuente).__name__, fuente.id, n, usar_fronteras))
+    with candado(nombre):
+        reencolar_abandonadas(**filtro)
+        tarea = TareaEntrenamiento.objects.filter(estado__in=ESTADOS_ACTIVOS, **filtro).first()
+        if tarea is None:
+            tarea = TareaEntrenamiento.objects.create(**filtro)
+
+    if tareas_sincronas() and tarea.estado == TareaEntrenamiento.PENDIENTE:
+        if reclamar_tarea(tarea.id):
+            ejecutar_tarea(tarea.id)
+        tarea.refresh_from_db()
+    return tarea
+
+
+def reclamar_tarea(tarea_id):
+    """Marca una tarea pendiente como en proceso; False si otro ya la tomó"""
+    return TareaEntrenamiento.objects.filter(
+        id=tarea_id, estado=TareaEntrenamiento.PENDIENTE
+    ).update(estado=TareaEntrenamiento.EN_PROCESO, fecha_inicio=timezone.now()) == 1
+
+
+def devolver_tareas(ids):
+    """Devuelve a pendientes tareas reclamadas que no se llegaron a ejecutar"""
+    return TareaEntrenamiento.objects.filter(
+        id__in=ids, estado=TareaEntrenamiento.EN_PROCESO
+    ).update(estado=TareaEntrenamiento.PENDIENTE, fecha_inicio=None)
+
+
+def reclamar_pendientes(limite):
+    """Reclama hasta `limite` tareas pendientes, las más antiguas primero"""
+    pendientes = TareaEntrenamiento.objects.filter(
+        estado=TareaEntrenamiento.PENDIENTE
+    ).values_list('id', flat=True)[:limite]
+    return [tarea_id for tarea_id in pendientes if reclamar_tarea(tarea_id)]
+
+
+def ejecutar_tarea(tarea_id):
+    """Entrena el modelo de una tarea ya reclamada, informando el progreso"""
+    tarea = TareaEntrenamiento.objects.select_related('texto', 'corpus').get(id=tarea_id)
+    ultima_actualizacion = [0.0]
+
+    def informar_progreso(fraccion):
+        ahora = time.monotonic()
+        if ahora - ultima_actualizacion[0] >= INTERVALO_PROGRESO:
+            ultima_actualizacion[0] = ahora
+            TareaEntrenamiento.objects.filter(id=tarea_id).update(progreso=fraccion)
+
+    try:
+        modelo = entrenar_modelo_ngramas(
+            tarea.fuente, tarea.n, tarea.usar_fronteras, progreso=informar_progreso
+        )
+    except Exception as e:
+        TareaEntrenamiento.objects.filter(id=tarea_id).update(
+            estado=TareaEntrenamiento.ERROR, mensaje=str(e), fecha_fin=timezone.now()
+        )
+        return False
+
+    TareaEntrenamiento.objects.filter(id=tarea_id).update(
+        estado=TareaEntrenamiento.COMPLETADA, progreso=1.0, modelo=modelo, fecha_fin=timezone.now()
+    )
+    return True
+
+
+def inicializar_proceso():
+    """Inicializador de los procesos del pool (también con spawn/forkserver)"""
+    django.setup()
+
+
+def cerrar_conexiones():
+    """Cierra las conexiones a la base de datos antes de crear procesos hijos"""
+    connections.close_all()
+
+
+def estado_tarea(tarea):
+    """Datos de una tarea para el endpoint JSON de progreso"""
+    datos = {
+        'tarea_id': tarea.id,
+        'estado': tarea.estado,
+        'estado_display': tarea.get_estado_display(),
+        'progreso': round(tarea.progreso * 100, 1),
+        'mensaje': tarea.mensaje,
+        'url_modelo': None,
+    }
+    if tarea.estado == TareaEntrenamiento.COMPLETADA and tarea.modelo_id:
+        datos['url_modelo'] = reverse('ver_modelo', args=[tarea.modelo_id])
+    return datos
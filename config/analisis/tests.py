@@ -1,3 +1,578 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .benchmark import comparar_con_base, escribir_corpus_sintetico, generar_corpus_sintetico
+from .cache_textos import cache, estadisticas_cache, flujo_texto, procesar_texto_guardado, suma_archivo
+from .almacen import (
+    obtener_modelo, entrenar_modelo_ngramas, cargar_probabilidades, cargar_indice, buscar_sugerencias,
+    cargar_indice_async, indice_en_memoria,
+)
+from .conteo import Vocabulario, ContadorIncremental, contar_ngramas_ids, contar_multiorden
+from .metricas import registro
+from .models import TextoAnalizado, Corpus, ModeloNgramas, TareaEntrenamiento
+from .suavizado import ModeloSuavizado
+from .tareas import encolar_entrenamiento, reclamar_pendientes, ejecutar_tarea, tiempo_abandono
+from .utils import (
+    limpiar_texto, limpiar_texto_con_fronteras, normalizar_acentos, iterar_tokens,
+    generar_modelo_autocompletado, predecir_siguiente_palabra, sugerencias_contexto, procesar_texto_completo,
+    estadisticas_procesamiento, fragmento_archivo, calcular_probabilidad_ngramas, leer_bloques,
+)
+
+TEXTO_EJEMPLO = (
+    "El perro come carne fresca. El perro come carne cruda. "
+    "La doctora Julieta revisa al perro grande. El gato come pescado fresco."
+)
+
+MEDIA_PRUEBAS = tempfile.mkdtemp()
+
+
+CACHES_PRUEBAS = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'analisis': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'analisis'},
+}
+
+
+@override_settings(MEDIA_ROOT=MEDIA_PRUEBAS, ANALISIS_TAREAS_SINCRONAS=True, CACHES=CACHES_PRUEBAS)
+class PruebaConTexto(TestCase):
+    """Base para pruebas que necesitan un TextoAnalizado en disco"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_PRUEBAS, ignore_errors=True)
+
+    def crear_texto(self, contenido=TEXTO_EJEMPLO, titulo='Ejemplo'):
+        texto = TextoAnalizado(titulo=titulo)
+        texto.archivo.save('ejemplo.txt', ContentFile(contenido.encode('utf-8')))
+        return texto
+
+
+class AlmacenModelosTests(PruebaConTexto):
+
+    def test_modelo_se_entrena_una_sola_vez(self):
+        texto = self.crear_texto()
+        modelo = obtener_modelo(texto, 3)
+        self.assertEqual(obtener_modelo(texto, 3).pk, modelo.pk)
+        self.assertEqual(ModeloNgramas.objects.count(), 1)
+
+    def test_modelo_json_anterior_se_reentrena(self):
+        texto = self.crear_texto()
+        modelo = obtener_modelo(texto, 2)
+        # Un JSON de la versión anterior, de largo no múltiplo de 4
+        contenido = json.dumps({'perro come': {'frecuencia_ngrama': 2}}).encode('utf-8') + b' '
+        self.assertTrue(len(contenido) % 4)
+        modelo.archivo.delete(save=False)
+        modelo.archivo.save('anterior.json', ContentFile(contenido))
+
+        self.assertEqual(cargar_indice(modelo).get('perro')[0], 3)
+        self.assertTrue(ModeloNgramas.objects.get(pk=modelo.pk).archivo.name.endswith('.bin'))
+
+    def test_probabilidades_cargadas(self):
+        texto = self.crear_texto()
+        probabilidades = cargar_probabilidades(obtener_modelo(texto, 2))
+        datos = probabilidades['perro come']
+        self.assertEqual(datos['frecuencia_ngrama'], 2)
+        self.assertEqual(datos['frecuencia_contexto'], 3)
+        self.assertAlmostEqual(datos['probabilidad'], 2 / 3)
+
+    def test_tabla_paginada_por_criterio(self):
+        texto = self.crear_texto()
+        modelo = obtener_modelo(texto, 2)
+        probabilidades = cargar_probabilidades(modelo)
+        url = reverse('tabla_modelo', args=[modelo.id])
+
+        def filas(orden):
+            respuesta = self.client.get(url, {'orden': orden, 'por_pagina': 4}).json()
+            self.assertEqual(respuesta['total'], len(probabilidades))
+            resultado = []
+            for pagina in range(1, respuesta['paginas'] + 1):
+                resultado += self.client.get(url, {'orden': orden, 'por_pagina': 4, 'pagina': pagina}).json()['filas']
+            return resultado
+
+        # A partir de la segunda página se usa el índice ordenado completo
+        with patch('analisis.utils.CUPO_ORDEN_PARCIAL', 4):
+            por_frecuencia = filas('frecuencia')
+            por_probabilidad = filas('probabilidad')
+        por_contexto = filas('contexto')
+        self.assertEqual(
+            [fila['frecuencia_ngrama'] for fila in por_frecuencia],
+            sorted((datos['frecuencia_ngrama'] for datos in probabilidades.values()), reverse=True),
+        )
+        self.assertEqual({fila['ngrama'] for fila in por_frecuencia}, set(probabilidades))
+        valores = [fila['probabilidad'] for fila in por_probabilidad]
+        self.assertEqual(valores, sorted(valores, reverse=True))
+        self.assertEqual([fila['ngrama'] for fila in por_contexto], sorted(probabilidades, key=str.split))
+
+        respuesta = self.client.get(reverse('ver_modelo', args=[modelo.id]), {'orden': 'contexto', 'pagina': 1})
+        self.assertContains(respuesta, por_contexto[0]['ngrama'])
+
+    def test_sugerencias_usan_modelo_guardado(self):
+        texto = self.crear_texto()
+        respuesta = self.client.post(
+            reverse('obtener_sugerencias'),
+            data=json.dumps({'texto': 'perro come', 'texto_id': texto.id, 'n_grama': 3}),
+            content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        sugerencias = respuesta.json()['sugerencias']
+        self.assertEqual(sugerencias[0]['palabra'], 'carne')
+        self.assertTrue(ModeloNgramas.objects.filter(texto=texto, n=3).exists())
+
+        # A medio escribir se completa la última palabra con el contexto anterior
+        respuesta = self.client.post(
+            reverse('obtener_sugerencias'),
+            data=json.dumps({'texto': 'perro come ca', 'texto_id': texto.id, 'n_grama': 3, 'completar': True}),
+            content_type='application/json',
+        ).json()
+        self.assertEqual((respuesta['contexto'], respuesta['prefijo']), ('perro come', 'ca'))
+        self.assertEqual([s['palabra'] for s in respuesta['sugerencias']], ['carne'])
+
+    def test_sugerencias_get_con_etag_y_lote(self):
+        texto = self.crear_texto()
+        url = reverse('obtener_sugerencias')
+        consulta = {'texto': 'perro come', 'texto_id': texto.id, 'n_grama': 3}
+        respuesta = self.client.get(url, consulta)
+        self.assertEqual(respuesta.json()['sugerencias'][0]['palabra'], 'carne')
+        self.assertIn('max-age', respuesta['Cache-Control'])
+
+        revalidada = self.client.get(url, consulta, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(revalidada.status_code, 304)
+
+        datos = {'textos': ['perro come', 'doctora julieta', ' '], 'texto_id': texto.id, 'n_grama': 3}
+        lote = self.client.post(
+            reverse('sugerencias_lote'), data=json.dumps(datos), content_type='application/json'
+        ).json()['resultados']
+        self.assertEqual(lote[0]['sugerencias'], respuesta.json()['sugerencias'])
+        self.assertEqual(lote[1]['sugerencias'][0]['palabra'], 'revisa')
+        self.assertIn('error', lote[2])
+
+    async def test_sugerencias_async_concurrentes(self):
+        texto = await sync_to_async(self.crear_texto)()
+        modelo = await sync_to_async(obtener_modelo)(texto, 3)
+        consulta = {'texto': 'perro come', 'texto_id': texto.id, 'n_grama': 3}
+        respuestas = await asyncio.gather(*(
+            self.async_client.get(reverse('obtener_sugerencias'), consulta) for _ in range(8)
+        ))
+        self.assertEqual({r.json()['sugerencias'][0]['palabra'] for r in respuestas}, {'carne'})
+        self.assertIs(indice_en_memoria(modelo), await cargar_indice_async(modelo))
+
+    def test_frases_por_busqueda_en_haz(self):
+        texto = self.crear_texto()
+        datos = {'texto': 'el perro', 'texto_id': texto.id, 'n_grama': 3, 'longitud': 2, 'ancho': 3}
+        respuesta = self.client.post(
+            reverse('completar_frases'), data=json.dumps(datos), content_type='application/json'
+        ).json()
+        frases = respuesta['frases']
+        self.assertEqual(frases[0]['frase'], 'come carne')
+        self.assertTrue(all(1 <= len(frase['palabras']) <= 2 for frase in frases))
+
+    @override_settings(ANALISIS_PROCESOS_CORPUS=2)
+    def test_modelo_de_corpus_combina_documentos(self):
+        corpus = Corpus.objects.create(titulo='Corpus')
+        corpus.textos.set([
+            self.crear_texto(),
+            self.crear_texto('El perro come huesos. Un gato grande.', titulo='Otro'),
+        ])
+        # Los documentos se cuentan desde sus flujos de tokens, no desde el original
+        with patch('analisis.almacen.contar_archivo', side_effect=AssertionError):
+            modelo = obtener_modelo(corpus, 2)
+        self.assertEqual(modelo.corpus, corpus)
+        self.assertEqual(modelo.total_palabras, 17 + 5)
+
+        probabilidades = cargar_probabilidades(modelo)
+        self.assertEqual(probabilidades['perro come']['frecuencia_ngrama'], 3)
+        self.assertEqual(probabilidades['perro come']['frecuencia_contexto'], 4)
+        # Los n-gramas no cruzan de un documento a otro
+        self.assertNotIn('fresco perro', probabilidades)
+
+    def test_subir_y_borrar_texto_actualiza_modelo_de_corpus(self):
+        corpus = Corpus.objects.create(titulo='Todos', incluir_todos=True)
+        corpus.textos.add(self.crear_texto())
+        modelo = obtener_modelo(corpus, 3, usar_fronteras=True)
+        conteos_iniciales = self.conteos_modelo(modelo)
+
+        # Subir un texto solo cuenta ese texto y suma sus conteos
+        nuevo = self.crear_texto('El perro come carne. El gato duerme.', titulo='Nuevo')
+        self.assertIn(nuevo, corpus.textos.all())
+        modelo.refresh_from_db()
+        actualizados = self.conteos_modelo(modelo)
+        reentrenado = entrenar_modelo_ngramas(corpus, 3, usar_fronteras=True)
+        self.assertEqual(actualizados, self.conteos_modelo(reentrenado))
+        self.assertEqual(actualizados['<s> perro'][1]['come'], 3)
+
+        # Al borrarlo se descuentan sus conteos
+        nuevo.delete()
+        modelo.refresh_from_db()
+        self.assertEqual(self.conteos_modelo(modelo), conteos_iniciales)
+
+    def conteos_modelo(self, modelo):
+        return {
+            contexto: (frecuencia_contexto, dict(continuaciones))
+            for contexto, (frecuencia_contexto, continuaciones) in cargar_indice(modelo).items()
+        }
+
+
+@override_settings(ANALISIS_TAREAS_SINCRONAS=False)
+class TareasEntrenamientoTests(PruebaConTexto):
+
+    def test_sugerencias_encolan_entrenamiento(self):
+        texto = self.crear_texto()
+        datos = json.dumps({'texto': 'perro', 'texto_id': texto.id, 'n_grama': 2})
+        respuesta = self.client.post(reverse('obtener_sugerencias'), data=datos, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertTrue(respuesta.json()['entrenando'])
+
+        # Una segunda petición no crea otra tarea
+        self.client.post(reverse('obtener_sugerencias'), data=datos, content_type='application/json')
+        self.assertEqual(TareaEntrenamiento.objects.count(), 1)
+
+    def test_encolar_reutiliza_tarea_y_reencola_abandonada(self):
+        texto = self.crear_texto()
+        tarea = encolar_entrenamiento(texto, 2)
+        self.assertEqual(encolar_entrenamiento(texto, 2).pk, tarea.pk)
+        self.assertNotEqual(encolar_entrenamiento(texto, 2, usar_fronteras=True).pk, tarea.pk)
+
+        # Reclamada hace poco: se sigue esperando a su worker
+        self.assertEqual(reclamar_pendientes(1), [tarea.pk])
+        self.assertEqual(encolar_entrenamiento(texto, 2).estado, TareaEntrenamiento.EN_PROCESO)
+
+        # Su worker murió hace rato: vuelve a pendientes y se puede reclamar
+        TareaEntrenamiento.objects.filter(pk=tarea.pk).update(
+            fecha_inicio=timezone.now() - timedelta(seconds=tiempo_abandono() + 1)
+        )
+        reencolada = encolar_entrenamiento(texto, 2)
+        self.assertEqual(reencolada.pk, tarea.pk)
+        self.assertEqual(reencolada.estado, TareaEntrenamiento.PENDIENTE)
+        self.assertEqual(reclamar_pendientes(1), [tarea.pk])
+        self.assertEqual(TareaEntrenamiento.objects.count(), 2)
+
+    def test_worker_ejecuta_tarea_y_vista_muestra_modelo(self):
+        texto = self.crear_texto()
+        respuesta = self.client.post(reverse('entrenar_modelo'), {'texto_id': texto.id, 'n_grama': 3})
+        tarea = TareaEntrenamiento.objects.get()
+        self.assertRedirects(respuesta, reverse('ver_tarea', args=[tarea.id]))
+        self.assertEqual(self.client.get(reverse('estado_tarea', args=[tarea.id])).json()['estado'], 'pendiente')
+
+        for tarea_id in reclamar_pendientes(4):
+            self.assertTrue(ejecutar_tarea(tarea_id))
+
+        estado = self.client.get(reverse('estado_tarea', args=[tarea.id])).json()
+        self.assertEqual(estado['estado'], 'completada')
+        self.assertEqual(estado['progreso'], 100.0)
+        respuesta = self.client.get(reverse('ver_tarea', args=[tarea.id]))
+        self.assertRedirects(respuesta, estado['url_modelo'])
+        self.assertContains(self.client.get(estado['url_modelo']), 'perro come carne')
+
+
+class IndiceContextoTests(PruebaConTexto):
+
+    def test_prediccion_por_contexto_ordenada(self):
+        modelo = generar_modelo_autocompletado(limpiar_texto(TEXTO_EJEMPLO), 2)
+        self.assertEqual(
+            sugerencias_contexto('perro', modelo),
+            [('come', 2 / 3), ('grande', 1 / 3)],
+        )
+        self.assertEqual(sugerencias_contexto('perro', modelo, 1), [('come', 2 / 3)])
+        self.assertEqual(sugerencias_contexto('inexistente', modelo), [])
+
+        # La función anterior sigue recibiendo el diccionario de n-gramas
+        probabilidades = calcular_probabilidad_ngramas(limpiar_texto(TEXTO_EJEMPLO), 2)
+        self.assertEqual(
+            predecir_siguiente_palabra('perro', probabilidades, 2),
+            sugerencias_contexto('perro', modelo),
+        )
+
+    def test_buscar_sugerencias_respeta_maximo(self):
+        indice = cargar_indice(obtener_modelo(self.crear_texto(), 2))
+        sugerencias = buscar_sugerencias(indice, 'perro', 1)
+        self.assertEqual(len(sugerencias), 1)
+        self.assertEqual(sugerencias[0]['ngrama_completo'], 'perro come')
+
+    def test_suavizado_retrocede_en_contexto_desconocido(self):
+        indice = cargar_indice(obtener_modelo(self.crear_texto(), 3))
+        self.assertEqual(buscar_sugerencias(indice, 'gato perro', 3), [])
+
+        for metodo in ('kneser_ney', 'stupid_backoff'):
+            sugerencias = buscar_sugerencias(indice, 'gato perro', 3, suavizado=metodo)
+            self.assertEqual(sugerencias[0]['palabra'], 'come')
+            self.assertEqual(sugerencias[0]['orden'], 2)
+
+        completadas = buscar_sugerencias(indice, 'perro', 3, suavizado='kneser_ney', prefijo='c')
+        self.assertEqual([s['palabra'] for s in completadas], ['come', 'carne', 'cruda'])
+        self.assertEqual(buscar_sugerencias(indice, 'perro', 3, prefijo='xyz'), [])
+
+        estimador = ModeloSuavizado(indice, 'kneser_ney')
+        for contexto in (['perro', 'come'], ['gato', 'perro'], ['inexistente']):
+            total = sum(estimador.probabilidad(palabra, contexto) for palabra in indice.palabras())
+            self.assertAlmostEqual(total, 1.0)
+
+
+class EvaluacionTests(PruebaConTexto):
+
+    def test_evaluar_con_texto_de_prueba_y_division(self):
+        entrenamiento = self.crear_texto()
+        prueba = self.crear_texto('El perro come carne. El gato come carne fresca.', 'Prueba')
+        url = reverse('evaluar_modelo')
+
+        datos = json.dumps({'texto_id': entrenamiento.id, 'prueba_id': prueba.id, 'n_grama': 3})
+        respuesta = self.client.post(url, data=datos, content_type='application/json').json()
+        self.assertEqual([r['orden'] for r in respuesta['resultados']], [2, 3])
+        self.assertEqual(respuesta['tokens_prueba'], 7)
+        for resultado in respuesta['resultados']:
+            self.assertEqual(resultado['tokens'], 7)
+            self.assertGreater(resultado['perplejidad'], 1)
+
+        # Un texto conocido es menos perplejo con contexto que sin él
+        bigramas, trigramas = respuesta['resultados']
+        self.assertLess(trigramas['entropia_cruzada'], bigramas['entropia_cruzada'])
+
+        datos = json.dumps({'texto_id': entrenamiento.id, 'n_grama': 2, 'division': 0.5, 'suavizado': 'mle'})
+        respuesta = self.client.post(url, data=datos, content_type='application/json').json()
+        self.assertEqual(respuesta['tokens_entrenamiento'] + respuesta['tokens_prueba'], 17)
+        self.assertIsNone(respuesta['resultados'][0]['perplejidad'])
+
+    def test_division_con_fronteras_respeta_oraciones(self):
+        texto = self.crear_texto()
+        datos = json.dumps({'texto_id': texto.id, 'n_grama': 2, 'division': 0.6, 'fronteras': True})
+        respuesta = self.client.post(reverse('evaluar_modelo'), data=datos, content_type='application/json').json()
+        # 25 tokens en 4 oraciones de 6, 6, 7 y 6: el corte 15 pasa al fin de la tercera
+        self.assertEqual((respuesta['tokens_entrenamiento'], respuesta['tokens_prueba']), (19, 6))
+        # El <s> de la oración de prueba es contexto, no se puntúa
+        resultado = respuesta['resultados'][0]
+        self.assertEqual(resultado['tokens'] + resultado['desconocidas'], 5)
+
+    def test_fronteras_como_texto(self):
+        entrenamiento = self.crear_texto()
+        prueba = self.crear_texto('El perro come carne. El gato come carne fresca.', 'Prueba')
+        url = reverse('evaluar_modelo')
+
+        # "false" llega como cadena desde algunos clientes y no debe activar las fronteras
+        datos = json.dumps({'texto_id': entrenamiento.id, 'prueba_id': prueba.id, 'n_grama': 2, 'fronteras': 'false'})
+        respuesta = self.client.post(url, data=datos, content_type='application/json').json()
+        self.assertEqual(respuesta['tokens_prueba'], 7)
+        self.assertFalse(ModeloNgramas.objects.filter(texto=entrenamiento, usar_fronteras=True).exists())
+
+        datos = json.dumps({'texto_id': entrenamiento.id, 'prueba_id': prueba.id, 'n_grama': 2, 'fronteras': 'true'})
+        respuesta = self.client.post(url, data=datos, content_type='application/json').json()
+        self.assertGreater(respuesta['tokens_prueba'], 7)
+        self.assertTrue(ModeloNgramas.objects.filter(texto=entrenamiento, usar_fronteras=True).exists())
+
+
+class CacheTextosTests(PruebaConTexto):
+
+    def test_cache_reutiliza_tokens_y_se_invalida(self):
+        cache.vaciar()
+        texto = self.crear_texto()
+        for n in (2, 3, 4):
+            esperado = procesar_texto_completo(TEXTO_EJEMPLO, n, True, [2, 3])
+            resultado = procesar_texto_guardado(texto, n, True, [2, 3])
+            self.assertEqual(resultado['ngramas_probabilidades'], esperado['ngramas_probabilidades'])
+            self.assertEqual(resultado['palabras_comunes'], esperado['palabras_comunes'])
+
+        # El texto se tokenizó una sola vez y cada orden se contó una vez
+        claves = [clave for clave in cache._entradas if clave[0] == texto.id]
+        self.assertEqual(sorted(clave[3] or 0 for clave in claves), [0, 1, 2, 3, 4])
+        self.assertGreater(cache.estadisticas()['aciertos'], 0)
+
+        texto.titulo = 'Modificado'
+        texto.save()
+        self.assertFalse([clave for clave in cache._entradas if clave[0] == texto.id])
+
+    def test_cache_compartida_entre_procesos(self):
+        texto = self.crear_texto()
+        esperado = procesar_texto_guardado(texto, 3)
+        # Otro proceso empieza con su cache local vacía y lee la compartida
+        cache.vaciar()
+        aciertos = estadisticas_cache()['compartida']['aciertos']
+        self.assertEqual(procesar_texto_guardado(texto, 3), esperado)
+        self.assertGreater(estadisticas_cache()['compartida']['aciertos'], aciertos)
+
+    def test_resultado_se_arma_una_vez_por_fragmento(self):
+        texto = self.crear_texto()
+        url = reverse('analizar_texto', args=[texto.id])
+        respuesta = self.client.get(url, {'n_grama': 2})
+        self.assertContains(respuesta, 'perro come')
+        self.assertContains(respuesta, '2/3')
+
+        # Con el fragmento ya renderizado no se vuelven a armar las filas
+        cache.vaciar()
+        respuesta = self.client.get(url, {'n_grama': 2})
+        self.assertContains(respuesta, 'perro come')
+        self.assertFalse([clave for clave in cache._entradas if clave[0] == 'vista_resultado'])
+
+    def test_comparacion_con_error_muestra_pagina_de_error(self):
+        texto = self.crear_texto()
+        url = reverse('comparar_probabilidades', args=[texto.id])
+        with patch('analisis.views.conteos_texto', side_effect=ValueError('conteo roto')):
+            respuesta = self.client.get(url, {'n_grama': 2})
+        self.assertTemplateUsed(respuesta, 'error.html')
+        self.assertContains(respuesta, 'conteo roto')
+
+    def test_comparacion_cachea_por_pagina_resuelta(self):
+        texto = self.crear_texto()
+        url = reverse('comparar_probabilidades', args=[texto.id])
+        fragmentos = caches['default']
+        fragmentos.clear()
+        respuesta = self.client.get(url, {'n_grama': 2})
+        self.assertContains(respuesta, 'perro come')
+        paginas = respuesta.context['tablas']['pagina'].paginator.num_pages
+
+        # Páginas inválidas o fuera de rango reutilizan el fragmento de la que
+        # resuelven: a lo sumo uno por página existente
+        for pagina in ('abc', '1', '999999', '-3', str(paginas), 'x' * 50):
+            self.assertEqual(self.client.get(url, {'n_grama': 2, 'pagina': pagina}).status_code, 200)
+        self.assertEqual(len(fragmentos._cache), min(paginas, 2))
+
+    def test_procesamiento_usa_estadisticas_guardadas(self):
+        texto = self.crear_texto()
+        respuesta = self.client.get(reverse('ver_procesamiento', args=[texto.id]))
+        self.assertContains(respuesta, 'doctora julieta revisa')
+        texto.refresh_from_db()
+        self.assertEqual(texto.estadisticas['palabras_limpias'], 17)
+        self.assertEqual(respuesta.context['total_palabras_limpias'], 17)
+
+    def test_flujo_de_tokens_al_subir(self):
+        contenido = TEXTO_EJEMPLO + ' Y de la... ¡El niño! Oración final sin punto'
+        self.client.post(reverse('subir_texto'), {
+            'titulo': 'Subido', 'archivo': SimpleUploadedFile('subido.txt', contenido.encode('utf-8')),
+        })
+        texto = TextoAnalizado.objects.get(titulo='Subido')
+        self.assertTrue(texto.tokens)
+        self.assertEqual(texto.suma, suma_archivo(texto))
+        self.assertEqual(texto.total_tokens, len(limpiar_texto(contenido)))
+        self.assertEqual(texto.tamano_vocabulario, len(set(limpiar_texto(contenido))))
+
+        # Un mismo vocabulario y los inicios de oración dan las dos tokenizaciones
+        flujo = flujo_texto(texto)
+        for usar_fronteras, limpiar in ((False, limpiar_texto), (True, limpiar_texto_con_fronteras)):
+            palabras = flujo.palabras(usar_fronteras)
+            self.assertEqual([palabras[i] for i in flujo.ids(usar_fronteras)], limpiar(contenido))
+            lotes = [palabras[i] for lote in flujo.lotes(usar_fronteras, tamano=3) for i in lote]
+            self.assertEqual(lotes, limpiar(contenido))
+
+    def test_server_timing_y_metricas(self):
+        texto = self.crear_texto()
+        respuesta = self.client.get(reverse('ver_procesamiento', args=[texto.id]))
+        etapas = dict(parte.split(';dur=') for parte in respuesta['Server-Timing'].split(', '))
+        self.assertIn('total', etapas)
+        self.assertIn('plantilla', etapas)
+        self.assertIn('lectura', etapas)
+
+        metricas = self.client.get(reverse('metricas')).json()
+        self.assertGreaterEqual(metricas['vista']['ver_procesamiento']['cuenta'], 1)
+        texto_prometheus = self.client.get(reverse('metricas'), {'formato': 'prometheus'}).content.decode()
+        self.assertIn('analisis_etapa_segundos_bucket{etapa="plantilla",le="+Inf"}', texto_prometheus)
+
+        with self.settings(ANALISIS_METRICAS=False):
+            respuesta = self.client.get(reverse('ver_procesamiento', args=[texto.id]))
+        self.assertNotIn('Server-Timing', respuesta)
+
+    def test_etapas_por_bloques_cuentan_una_vez(self):
+        registro.vaciar()
+        contador = ContadorIncremental([1, 2])
+        bloques = leer_bloques(io.StringIO(TEXTO_EJEMPLO * 50), tamano=64)
+        contador.agregar_flujo(iterar_tokens(bloques), tamano_lote=10)
+        etapas = registro.exportar()['etapa']
+        # Muchos bloques y lotes, pero una sola observación por etapa
+        for nombre in ('lectura', 'normalizacion', 'tokenizacion', 'conteo'):
+            self.assertEqual(etapas[nombre]['cuenta'], 1)
+
+    def test_sesion_guarda_solo_referencia(self):
+        texto = self.crear_texto()
+        self.client.get(reverse('analizar_texto', args=[texto.id]), {'n_grama': 2})
+        sesion = self.client.session
+        self.assertNotIn('texto_original', sesion)
+        self.assertEqual(sesion['ultimo_analisis']['texto_id'], texto.id)
+        self.assertEqual(sesion['ultimo_analisis']['n_grama'], 2)
+
+
+class LimpiezaTests(TestCase):
+
+    def test_normalizacion_preserva_enie_y_dieresis(self):
+        self.assertEqual(normalizar_acentos('Canción ÑANDÚ pingüino'), 'Cancion ÑANDU pingüino')
+        self.assertEqual(limpiar_texto('¡El Niño comió, en la CANCIÓN!'), ['niño', 'comio', 'cancion'])
+
+    def test_fronteras_por_oracion(self):
+        self.assertEqual(
+            limpiar_texto_con_fronteras('El perro come. La gata duerme! ¿Hola?'),
+            ['<s>', 'perro', 'come', '</s>', '<s>', 'gata', 'duerme', '</s>', '<s>', 'hola', '</s>'],
+        )
+
+    def test_tokens_por_bloques_igual_que_texto_completo(self):
+        texto = TEXTO_EJEMPLO + ' Oración final sin punto'
+        bloques = [texto[i:i + 7] for i in range(0, len(texto), 7)]
+        self.assertEqual(list(iterar_tokens(bloques)), limpiar_texto(texto))
+        self.assertEqual(list(iterar_tokens(bloques, usar_fronteras=True)), limpiar_texto_con_fronteras(texto))
+
+    def test_estadisticas_en_una_pasada_y_vista_previa(self):
+        texto = TEXTO_EJEMPLO + ' ¡Canción del niño, pingüino! ¿Qué tal?'
+        bloques = [texto[i:i + 7] for i in range(0, len(texto), 7)]
+        estadisticas = estadisticas_procesamiento(bloques, muestra=2)
+        originales = re.findall(r'\b[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]+\b', texto.lower())
+        self.assertEqual(estadisticas['caracteres'], len(texto))
+        self.assertEqual(estadisticas['palabras_originales'], len(originales))
+        self.assertEqual(estadisticas['palabras_limpias'], len(limpiar_texto(texto)))
+        self.assertEqual(estadisticas['simbolos_eliminados'], sorted(set('.¡,!¿?')))
+        self.assertEqual(estadisticas['palabras_con_acentos'], 4)
+        self.assertEqual(estadisticas['muestra_acentos'], ['canción', 'niño'])
+
+        # Las páginas de la vista previa no parten palabras ni pierden texto
+        paginas = [
+            fragmento_archivo(io.StringIO(texto), desde, desde + 20, margen=10)
+            for desde in range(0, len(texto), 20)
+        ]
+        self.assertEqual(''.join(paginas), texto)
+        self.assertTrue(all(pagina[:1].isspace() for pagina in paginas[1:] if pagina))
+
+    def test_corpus_de_benchmark_reproducible(self):
+        archivo = io.BytesIO()
+        escritos = escribir_corpus_sintetico(archivo, 5000, semilla=3, tamano_bloque=512)
+        self.assertEqual(escritos, len(archivo.getvalue()))
+        self.assertEqual(archivo.getvalue().decode('utf-8'), generar_corpus_sintetico(5000, semilla=3))
+
+        base = {'a': {'p50': 1.0}, 'b': {'p50': 1.0}}
+        resultados = {'a': {'p50': 1.05}, 'b': {'p50': 1.5}, 'nueva': {'p50': 9.0}}
+        self.assertEqual(
+            [(nombre, es_regresion) for nombre, _, _, _, es_regresion in comparar_con_base(resultados, base, 0.1)],
+            [('a', False), ('b', True)],
+        )
+
+
+class ConteoIdsTests(TestCase):
+
+    def test_conteo_por_tuplas_de_ids(self):
+        vocabulario = Vocabulario()
+        ids = vocabulario.codificar('a b a b c'.split())
+        self.assertEqual(list(ids), [0, 1, 0, 1, 2])
+        conteo = contar_ngramas_ids(ids, 2)
+        self.assertEqual(conteo[vocabulario.buscar(['a', 'b'])], 2)
+        self.assertEqual(vocabulario.decodificar((1, 2)), 'b c')
+        self.assertEqual(contar_ngramas_ids(ids, 6), {})
+
+    def test_multiorden_igual_a_contar_cada_orden(self):
+        ids = Vocabulario().codificar(limpiar_texto(TEXTO_EJEMPLO * 3))
+        conteos = contar_multiorden(ids, [2, 3, 5, 9])
+        self.assertEqual(sorted(conteos), [1, 2, 3, 4, 5, 8, 9])
+        for orden, conteo in conteos.items():
+            self.assertEqual(conteo, contar_ngramas_ids(ids, orden))
+
+    def test_contador_incremental_cruza_lotes(self):
+        tokens = limpiar_texto_con_fronteras(TEXTO_EJEMPLO * 2)
+        contador = ContadorIncremental([2, 4]).agregar_flujo(tokens, tamano_lote=3)
+        referencia = contar_multiorden(Vocabulario().codificar(tokens), [2, 4])
+        self.assertEqual(contador.total, len(tokens))
+        self.assertEqual(contador.conteos, referencia)
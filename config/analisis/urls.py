@@ -10,7 +10,16 @@ urlpatterns = [
     # Nuevas rutas
     path('autocompletado/', views.autocompletado_view, name='autocompletado'),
     path('api/sugerencias/', views.obtener_sugerencias, name='obtener_sugerencias'),
+    path('api/sugerencias/lote/', views.sugerencias_lote, name='sugerencias_lote'),
+    path('api/frases/', views.completar_frases_api, name='completar_frases'),
+    path('api/evaluar/', views.evaluar_modelo, name='evaluar_modelo'),
     path('entrenar-modelo/', views.entrenar_modelo, name='entrenar_modelo'),
+    path('tareas/<int:tarea_id>/', views.ver_tarea, name='ver_tarea'),
+    path('api/tareas/<int:tarea_id>/', views.estado_tarea_api, name='estado_tarea'),
+    path('modelos/<int:modelo_id>/', views.ver_modelo, name='ver_modelo'),
+    path('api/modelos/<int:modelo_id>/ngramas/', views.tabla_modelo_api, name='tabla_modelo'),
+    path('api/cache/', views.estadisticas_cache_api, name='estadisticas_cache'),
+    path('api/metricas/', views.metricas_api, name='metricas'),
     
     # SOLO ESTA RUTA PARA COMPARACIÓN
     path('comparar/<int:texto_id>/', views.vista_comparacion_avanzada, name='comparar_probabilidades'),
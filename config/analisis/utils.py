@@ -1,7 +1,15 @@
 import re
+import codecs
+import heapq
 import unicodedata
 import math  
-from collections import Counter, defaultdict
+from collections.abc import Sequence
+from functools import lru_cache
+from itertools import islice
+
+from .conteo import ContadorIncremental, Vocabulario, contar_multiorden
+from .formato_tokens import FlujoTokens
+from .metricas import etapa, etapa_acumulada, medir
 
 # Lista de stopwords en español (incluyendo versiones acentuadas)
 STOPWORDS_ES = {
@@ -49,70 +57,328 @@ STOPWORDS_ES = {
     'vuestras', 'cuyo', 'cuya', 'cuyos', 'cuyas'
 }
 
+# Caracteres del español que no se pliegan a ASCII
+CARACTERES_PRESERVADOS = 'ñüÑÜ'
+
+# Patrones precompilados del tokenizador
+NO_ASCII_RE = re.compile(r'[^\x00-\x7f]+')
+SIMBOLOS_RE = re.compile(r'[^\w\sñü]')
+FIN_ORACION_RE = re.compile(r'[.!?]')
+FIN_ORACION = '.'
+
+@lru_cache(maxsize=4096)
+def plegar_tramo(tramo):
+    """Quita acentos y caracteres no ASCII de un tramo, preservando ñ y ü"""
+    return ''.join(
+        caracter if caracter in CARACTERES_PRESERVADOS
+        else unicodedata.normalize('NFKD', caracter).encode('ascii', 'ignore').decode('ascii')
+        for caracter in tramo
+    )
+
+def _plegar_coincidencia(coincidencia):
+    return plegar_tramo(coincidencia.group())
+
+# Durante la normalización de textos completos, ñ y ü (ya en minúsculas) se
+# protegen con caracteres de control. Los de control son símbolos y acabarían
+# como espacios, así que los que ya vinieran en el texto se cambian antes.
+CENTINELAS = (('ñ', '\x01'), ('ü', '\x02'))
+
+def _tabla_simbolos(marcar_oraciones):
+    """Tabla de bytes ASCII que cambia los símbolos por espacios"""
+    tabla = bytearray(range(256))
+    for codigo in range(128):
+        caracter = chr(codigo)
+        if marcar_oraciones and FIN_ORACION_RE.match(caracter):
+            tabla[codigo] = ord(FIN_ORACION)
+        elif SIMBOLOS_RE.match(caracter):
+            tabla[codigo] = ord(' ')
+    for _, centinela in CENTINELAS:
+        tabla[ord(centinela)] = ord(centinela)
+    return bytes(tabla)
+
+TABLA_SIMBOLOS = _tabla_simbolos(marcar_oraciones=False)
+TABLA_SIMBOLOS_ORACIONES = _tabla_simbolos(marcar_oraciones=True)
+
 def normalizar_acentos(texto):
     """Normaliza los caracteres acentuados preservando ñ y ü"""
-    texto = texto.replace('ñ', '__n_tilde__').replace('ü', '__u_dieresis__')
-    texto = texto.replace('Ñ', '__N_tilde__').replace('Ü', '__U_dieresis__')
-    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
-    texto = texto.replace('__n_tilde__', 'ñ').replace('__u_dieresis__', 'ü')
-    texto = texto.replace('__N_tilde__', 'Ñ').replace('__U_dieresis__', 'Ü')
-    return texto
+    # Solo los tramos no ASCII necesitan normalización Unicode
+    return NO_ASCII_RE.sub(_plegar_coincidencia, texto)
 
-def limpiar_texto(texto, usar_stopwords=True):
-    """Limpia el texto: minúsculas, elimina puntuación y stopwords"""
+def normalizar_texto(texto, tabla=TABLA_SIMBOLOS):
+    """Minúsculas, sin acentos y con los símbolos convertidos en espacios"""
     texto = texto.lower()
-    texto = normalizar_acentos(texto)
+    for caracter, centinela in CENTINELAS:
+        if centinela in texto:
+            texto = texto.replace(centinela, ' ')
+        texto = texto.replace(caracter, centinela)
     
-    # Eliminar símbolos de puntuación y caracteres especiales
-    texto_limpio = re.sub(r'[^\w\sñü]', ' ', texto)
+    # NFKD + ASCII quita los acentos; la tabla de bytes quita los símbolos
+    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').translate(tabla).decode('ascii')
     
-    # Tokenizar
-    palabras = texto_limpio.split()
+    for caracter, centinela in CENTINELAS:
+        texto = texto.replace(centinela, caracter)
+    return texto
+
+# Stopwords ya normalizadas, calculadas una sola vez
+STOPWORDS_NORMALIZADAS = frozenset(normalizar_acentos(palabra) for palabra in STOPWORDS_ES)
+
+def filtrar_stopwords(palabras):
+    """Elimina stopwords y palabras de una sola letra"""
+    return [
+        palabra for palabra in palabras
+        if len(palabra) > 1 and palabra not in STOPWORDS_NORMALIZADAS
+    ]
+
+def limpiar_texto(texto, usar_stopwords=True):
+    """Limpia el texto: minúsculas, elimina puntuación y stopwords"""
+    # Minúsculas, acentos y puntuación
+    with etapa('normalizacion'):
+        normalizado = normalizar_texto(texto)
     
     # Eliminar stopwords si se solicita
-    if usar_stopwords:
-        stopwords_normalizadas = {normalizar_acentos(palabra) for palabra in STOPWORDS_ES}
-        palabras = [palabra for palabra in palabras if palabra not in stopwords_normalizadas and len(palabra) > 1]
+    with etapa('tokenizacion'):
+        palabras = normalizado.split()
+        if usar_stopwords:
+            palabras = filtrar_stopwords(palabras)
     
     return palabras
 
 def limpiar_texto_con_fronteras(texto):
     """Limpia el texto incluyendo fronteras de oración <s> y </s>"""
-    texto = texto.lower()
-    texto = normalizar_acentos(texto)
-    
-    # Eliminar símbolos de puntuación y caracteres especiales
-    texto_limpio = re.sub(r'[^\w\sñü]', ' ', texto)
-    
-    # Dividir en oraciones usando puntuación
-    oraciones = re.split(r'[.!?]+', texto_limpio)
+    # Minúsculas, acentos y puntuación; los finales de oración (. ! ?)
+    # quedan marcados para dividir antes de perder la puntuación
+    with etapa('normalizacion'):
+        oraciones = normalizar_texto(texto, TABLA_SIMBOLOS_ORACIONES).split(FIN_ORACION)
     
     # Procesar cada oración por separado
     todas_palabras = []
-    for oracion in oraciones:
-        oracion = oracion.strip()
-        if oracion:
-            # Añadir marcador de inicio de oración
-            todas_palabras.append('<s>')
-            
-            # Tokenizar y filtrar stopwords
+    with etapa('tokenizacion'):
+        for oracion in oraciones:
             palabras = oracion.split()
-            stopwords_normalizadas = {normalizar_acentos(palabra) for palabra in STOPWORDS_ES}
-            palabras_filtradas = [
-                palabra for palabra in palabras 
-                if palabra not in stopwords_normalizadas and len(palabra) > 1
-            ]
-            
-            todas_palabras.extend(palabras_filtradas)
-            
-            # Añadir marcador de fin de oración
-            todas_palabras.append('</s>')
+            if palabras:
+                # Añadir marcador de inicio de oración
+                todas_palabras.append('<s>')
+                
+                # Filtrar stopwords
+                todas_palabras.extend(filtrar_stopwords(palabras))
+                
+                # Añadir marcador de fin de oración
+                todas_palabras.append('</s>')
     
     return todas_palabras
 
+# Tamaño de bloque (en caracteres) al leer archivos grandes
+TAMANO_BLOQUE = 1024 * 1024
+
+# Filas de las tablas de palabras y n-gramas más frecuentes de resultado.html
+FILAS_RESULTADO = 20
+
+# Palabras del texto original y símbolos que elimina la limpieza, tal como
+# los cuenta la página de procesamiento
+PALABRA_ORIGINAL_RE = re.compile(r'\b[a-záéíóúñü]+\b')
+SIMBOLO_ORIGINAL_RE = re.compile(r'[^\w\sáéíóúñü]')
+ESPACIO_RE = re.compile(r'\s')
+MUESTRA_ACENTOS = 20
+
+# Caracteres por página de la vista previa de un texto y cuánto se puede
+# correr cada corte para no partir una palabra
+CARACTERES_POR_PAGINA = 5000
+MARGEN_FRAGMENTO = 100
+
+# Criterios de orden de las tablas de probabilidades y filas por página
+CRITERIOS_TABLA = ('frecuencia', 'probabilidad', 'contexto')
+FILAS_POR_PAGINA = 50
+
+# Hasta esta fila las páginas salen de heapq.nlargest; más allá se ordena la tabla entera
+CUPO_ORDEN_PARCIAL = 1000
+
+def leer_bloques(archivo, tamano=TAMANO_BLOQUE, progreso=None):
+    """
+    Lee un archivo abierto bloque por bloque. Si está abierto en modo
+    binario se decodifica como UTF-8 sin partir caracteres entre bloques.
+    progreso(leidos), si se indica, recibe lo leído hasta el momento.
+    """
+    decodificador = None
+    leidos = 0
+    # Los tiempos de todos los bloques son una sola observación de la etapa
+    lectura = etapa_acumulada('lectura')
+    try:
+        while True:
+            with lectura:
+                bloque = archivo.read(tamano)
+                if not bloque:
+                    break
+                leidos += len(bloque)
+                if isinstance(bloque, bytes):
+                    if decodificador is None:
+                        decodificador = codecs.getincrementaldecoder('utf-8')()
+                    bloque = decodificador.decode(bloque)
+            if progreso is not None:
+                progreso(leidos)
+            yield bloque
+        
+        if decodificador is not None:
+            final = decodificador.decode(b'', final=True)
+            if final:
+                yield final
+    finally:
+        lectura.cerrar()
+
+def _separar_resto(texto):
+    """Separa la última palabra si el bloque termina a mitad de ella"""
+    inicio = len(texto)
+    while inicio > 0 and not texto[inicio-1].isspace() and texto[inicio-1] != FIN_ORACION:
+        inicio -= 1
+    return texto[:inicio], texto[inicio:]
+
+def iterar_tokens(bloques, usar_fronteras=False, usar_stopwords=True):
+    """
+    Versión por bloques de limpiar_texto y limpiar_texto_con_fronteras:
+    produce los mismos tokens sin tener todo el texto en memoria. La palabra
+    que queda partida al final de un bloque se une al siguiente, y si una
+    oración cruza el borde sus marcadores <s> y </s> se emiten una sola vez.
+    """
+    tabla = TABLA_SIMBOLOS_ORACIONES if usar_fronteras else TABLA_SIMBOLOS
+    filtrar = filtrar_stopwords if usar_stopwords else list
+    resto = ''
+    oracion_abierta = False
+    # Cada etapa se registra una vez por llamada, no una por bloque
+    normalizacion = etapa_acumulada('normalizacion')
+    tokenizacion = etapa_acumulada('tokenizacion')
+    
+    try:
+        for bloque in bloques:
+            with normalizacion:
+                normalizado = normalizar_texto(bloque, tabla)
+            # Los tokens de cada bloque se arman juntos para medir la etapa
+            with tokenizacion:
+                texto, resto = _separar_resto(resto + normalizado)
+                if not usar_fronteras:
+                    tokens = filtrar(texto.split())
+                else:
+                    tokens = []
+                    for i, segmento in enumerate(texto.split(FIN_ORACION)):
+                        # Cada separador cierra la oración anterior
+                        if i > 0 and oracion_abierta:
+                            tokens.append('</s>')
+                            oracion_abierta = False
+                        palabras = segmento.split()
+                        if palabras:
+                            if not oracion_abierta:
+                                tokens.append('<s>')
+                                oracion_abierta = True
+                            tokens.extend(filtrar(palabras))
+            yield from tokens
+    finally:
+        normalizacion.cerrar()
+        tokenizacion.cerrar()
+    
+    # Última palabra y cierre de la última oración
+    palabras = resto.split()
+    if usar_fronteras and palabras and not oracion_abierta:
+        yield '<s>'
+        oracion_abierta = True
+    yield from filtrar(palabras)
+    if oracion_abierta:
+        yield '</s>'
+
+def estadisticas_procesamiento(bloques, muestra=MUESTRA_ACENTOS, consumir=None):
+    """
+    Estadísticas de la limpieza de un texto en una sola pasada por sus
+    bloques: caracteres, palabras originales y limpias, stopwords
+    eliminadas, símbolos eliminados y una muestra de las palabras con
+    acentos. Cada bloque se revisa al pasar hacia iterar_tokens.
+    
+    consumir(tokens), si se indica, recibe en la misma pasada los tokens
+    con fronteras de oración (por ejemplo para codificarlos) y devuelve
+    cuántos hubo sin contar <s> ni </s>.
+    """
+    caracteres = palabras = acentuadas = 0
+    simbolos = set()
+    con_acentos = []
+    
+    def revisar(texto):
+        nonlocal palabras, acentuadas
+        encontradas = PALABRA_ORIGINAL_RE.findall(texto.lower())
+        palabras += len(encontradas)
+        acentos = [palabra for palabra in encontradas if not palabra.isascii()]
+        acentuadas += len(acentos)
+        con_acentos.extend(acentos[:muestra - len(con_acentos)])
+        simbolos.update(SIMBOLO_ORIGINAL_RE.findall(texto))
+    
+    def observar():
+        nonlocal caracteres
+        resto = ''
+        for bloque in bloques:
+            caracteres += len(bloque)
+            texto, resto = _separar_resto(resto + bloque)
+            revisar(texto)
+            yield bloque
+        revisar(resto)
+    
+    if consumir is None:
+        limpias = sum(1 for _ in iterar_tokens(observar()))
+    else:
+        limpias = consumir(iterar_tokens(observar(), usar_fronteras=True))
+    return {
+        'caracteres': caracteres,
+        'palabras_originales': palabras,
+        'palabras_limpias': limpias,
+        'stopwords_eliminadas': palabras - limpias,
+        'simbolos_eliminados': sorted(simbolos),
+        'palabras_con_acentos': acentuadas,
+        'muestra_acentos': con_acentos,
+    }
+
+def fragmento_archivo(archivo, desde, hasta, margen=MARGEN_FRAGMENTO):
+    """
+    Caracteres [desde, hasta) de un archivo abierto, leído por bloques. Los
+    dos cortes se corren hasta el siguiente espacio (a lo sumo margen
+    caracteres) para no partir palabras; las páginas consecutivas no se
+    solapan ni pierden texto.
+    """
+    partes = []
+    posicion = 0
+    for bloque in leer_bloques(archivo):
+        if posicion + len(bloque) > desde:
+            partes.append(bloque[max(desde - posicion, 0):hasta + margen - posicion])
+        posicion += len(bloque)
+        if posicion >= hasta + margen:
+            break
+    texto = ''.join(partes)
+    
+    def corte(inicio):
+        espacio = ESPACIO_RE.search(texto, inicio, inicio + margen)
+        return min(espacio.start() if espacio else inicio, len(texto))
+    
+    return texto[corte(0) if desde else 0:corte(hasta - desde)]
+
+def contar_archivo(ruta, ordenes, usar_fronteras=False):
+    """
+    Cuenta los n-gramas de un archivo en disco. No depende de Django, así que
+    puede ejecutarse en otro proceso; devuelve (palabras del vocabulario,
+    conteos por orden, total de tokens) para combinarlos después.
+    """
+    contador = ContadorIncremental(ordenes)
+    with open(ruta, 'rb') as archivo:
+        contador.agregar_flujo(iterar_tokens(leer_bloques(archivo), usar_fronteras))
+    return contador.vocabulario.palabras, contador.conteos, contador.total
+
+def contar_archivo_tokens(ruta, ordenes, usar_fronteras=False):
+    """
+    Como contar_archivo, pero a partir del flujo de tokens ya codificado de
+    un texto (formato_tokens.py): no vuelve a decodificar ni limpiar nada.
+    """
+    flujo = FlujoTokens.abrir(ruta)
+    contador = ContadorIncremental(ordenes, Vocabulario(flujo.palabras(usar_fronteras)))
+    with etapa('conteo'):
+        for lote in flujo.lotes(usar_fronteras):
+            contador.agregar_ids(lote)
+    return contador.vocabulario.palabras, contador.conteos, contador.total
+
 def generar_ngramas(tokens, n=2):
     """Genera n-gramas a partir de una lista de tokens"""
-    if n <= 1 or len(tokens) < n:
+    if n < 1 or len(tokens) < n:
         return []
     
     ngramas = []
@@ -130,44 +396,139 @@ def calcular_probabilidad_ngramas_general(tokens, n):
     if n < 2:
         return {}
     
-    # Generar n-gramas
-    ngramas = generar_ngramas(tokens, n)
+    # Internar los tokens como ids enteros una sola vez
+    vocabulario = Vocabulario()
+    ids = vocabulario.codificar(tokens)
     
-    # Generar (n-1)-gramas (contextos)
-    n_minus1_gramas = generar_ngramas(tokens, n-1)
+    # Contar n-gramas y (n-1)-gramas (contextos) en una sola pasada
+    conteos = contar_multiorden(ids, [n])
     
-    # Contar frecuencias
-    freq_ngramas = Counter(ngramas)
-    freq_contextos = Counter(n_minus1_gramas)
+    return probabilidades_desde_conteos(vocabulario, conteos, n)
+
+@medir('probabilidades')
+def probabilidades_desde_conteos(vocabulario, conteos, n):
+    """
+    Calcula la tabla de probabilidades de orden n a partir de conteos
+    multi-orden ya hechos (ver conteo.contar_multiorden)
+    """
+    freq_ngramas = conteos.get(n)
+    if n < 2 or not freq_ngramas:
+        return {}
+    freq_contextos = conteos[n-1]
+    
+    # Calcular probabilidades; las cadenas solo se arman para el resultado
+    palabras_vocabulario = vocabulario.palabras
+    return dict(
+        fila_probabilidad(
+            vocabulario.decodificar(clave[:-1]), palabras_vocabulario[clave[-1]],
+            count_ngrama, freq_contextos.get(clave[:-1], 0), n
+        )
+        for clave, count_ngrama in freq_ngramas.items()
+    )
+
+def fila_probabilidad(contexto, palabra_objetivo, frecuencia, frecuencia_contexto, n):
+    """(n-grama, datos) de una fila de la tabla de probabilidades MLE"""
+    probabilidad = frecuencia / frecuencia_contexto if frecuencia_contexto > 0 else 0.0
+    return f'{contexto} {palabra_objetivo}', {
+        'frecuencia_ngrama': frecuencia,
+        'contexto': contexto,
+        'frecuencia_contexto': frecuencia_contexto,
+        'probabilidad': probabilidad,
+        'log_probabilidad': math.log(probabilidad) if probabilidad > 0 else float('-inf'),
+        'palabra_objetivo': palabra_objetivo,
+        'orden_ngrama': n
+    }
+
+class TablaPaginada:
+    """
+    Filas de una tabla de n-gramas en un orden dado, como secuencia perezosa
+    para django.core.paginator.Paginator: solo se arman las filas de la
+    página pedida. Las primeras páginas salen de heapq.nlargest sin ordenar
+    la tabla; para ir más lejos se ordena una vez el índice completo, que
+    puede guardarse en una CacheLRU (cache, clave_cache) para otras consultas.
+    """
     
-    # Calcular probabilidades
-    probabilidades = {}
-    for ngrama, count_ngrama in freq_ngramas.items():
-        # Extraer el contexto (primeras n-1 palabras)
-        palabras = ngrama.split()
-        contexto = ' '.join(palabras[:-1])
-        
-        count_contexto = freq_contextos.get(contexto, 0)
-        
-        if count_contexto > 0:
-            probabilidad = count_ngrama / count_contexto
-        else:
-            probabilidad = 0.0
-        
-        # Calcular log probabilidad
-        log_probabilidad = math.log(probabilidad) if probabilidad > 0 else float('-inf')
+    def __init__(self, total, elementos, fila, clave=None, descendente=True, cache=None, clave_cache=None):
+        """
+        elementos() itera las filas en su orden natural (si devuelve una
+        secuencia se corta sin recorrerla); clave(elemento) da el criterio de
+        orden (None: el orden natural) y fila(elemento) arma (n-grama, datos)
+        """
+        self.total = total
+        self._elementos = elementos
+        self._fila = fila
+        self._clave = clave
+        self._descendente = descendente
+        self._cache = cache
+        self._clave_cache = clave_cache
+        self._indice = None
+    
+    def __len__(self):
+        return self.total
+    
+    def _indice_ordenado(self):
+        if self._indice is None and self._cache is not None:
+            self._indice = self._cache.buscar(self._clave_cache)
+        return self._indice
+    
+    def elementos(self, desde, hasta):
+        """Elementos de las posiciones [desde, hasta) en el orden pedido"""
+        if self._clave is None:
+            elementos = self._elementos()
+            if isinstance(elementos, Sequence):
+                return elementos[desde:hasta]
+            return list(islice(elementos, desde, hasta))
         
-        probabilidades[ngrama] = {
-            'frecuencia_ngrama': count_ngrama,
-            'contexto': contexto,
-            'frecuencia_contexto': count_contexto,
-            'probabilidad': probabilidad,
-            'log_probabilidad': log_probabilidad,
-            'palabra_objetivo': palabras[-1],
-            'orden_ngrama': n
-        }
-    
-    return probabilidades
+        indice = self._indice_ordenado()
+        if indice is None and hasta <= CUPO_ORDEN_PARCIAL:
+            seleccionar = heapq.nlargest if self._descendente else heapq.nsmallest
+            with etapa('orden'):
+                return seleccionar(hasta, self._elementos(), key=self._clave)[desde:]
+        if indice is None:
+            with etapa('orden'):
+                indice = self._indice = sorted(self._elementos(), key=self._clave, reverse=self._descendente)
+            if self._cache is not None:
+                self._cache.guardar(self._clave_cache, indice, len(indice))
+        return indice[desde:hasta]
+    
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            desde, hasta, paso = posicion.indices(self.total)
+            return [self._fila(elemento) for elemento in self.elementos(desde, hasta)[::paso]]
+        if posicion < 0:
+            posicion += self.total
+        if not 0 <= posicion < self.total:
+            raise IndexError('Fila fuera de la tabla')
+        return self._fila(self.elementos(posicion, posicion + 1)[0])
+
+def tabla_desde_conteos(vocabulario, conteos, n, criterio='frecuencia'):
+    """
+    TablaPaginada con las probabilidades de orden n de unos conteos
+    multi-orden, ordenada por frecuencia, probabilidad (de mayor a menor) o
+    alfabéticamente por contexto
+    """
+    freq_ngramas = conteos.get(n) if n >= 2 else None
+    if not freq_ngramas:
+        return TablaPaginada(0, tuple, None)
+    freq_contextos = conteos[n-1]
+    palabras_vocabulario = vocabulario.palabras
+    
+    def fila(clave):
+        return fila_probabilidad(
+            vocabulario.decodificar(clave[:-1]), palabras_vocabulario[clave[-1]],
+            freq_ngramas[clave], freq_contextos.get(clave[:-1], 0), n
+        )
+    
+    if criterio == 'probabilidad':
+        def clave_orden(clave):
+            return freq_ngramas[clave] / freq_contextos[clave[:-1]], freq_ngramas[clave]
+    elif criterio == 'contexto':
+        clave_orden = vocabulario.decodificar
+    else:
+        clave_orden = freq_ngramas.__getitem__
+    return TablaPaginada(
+        len(freq_ngramas), freq_ngramas.keys, fila, clave_orden, descendente=criterio != 'contexto'
+    )
 
 def calcular_probabilidad_ngramas(tokens, n):
     """Función wrapper para mantener compatibilidad"""
@@ -178,12 +539,13 @@ def generar_tabla_probabilidades_avanzada(probabilidades_dict, n_grama, titulo):
     if not probabilidades_dict:
         return f"<p>No hay {titulo.lower()} para mostrar</p>"
     
-    # Ordenar por frecuencia descendente
-    items_ordenados = sorted(
-        probabilidades_dict.items(), 
-        key=lambda x: x[1]['frecuencia_ngrama'], 
-        reverse=True
-    )
+    # Solo se muestran las 15 filas más frecuentes: no hace falta ordenar todo
+    with etapa('orden'):
+        items_ordenados = heapq.nlargest(
+            15,
+            probabilidades_dict.items(), 
+            key=lambda x: x[1]['frecuencia_ngrama']
+        )
     
     # Determinar la fórmula según el tipo de n-grama
     if n_grama == 2:
@@ -210,7 +572,7 @@ def generar_tabla_probabilidades_avanzada(probabilidades_dict, n_grama, titulo):
             <tbody>
     """
     
-    for ngrama, datos in items_ordenados[:15]:
+    for ngrama, datos in items_ordenados:
         html += f"""
                 <tr>
                     <td><strong>{ngrama}</strong></td>
@@ -242,9 +604,34 @@ def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas
     else:
         palabras_limpias = limpiar_texto(contenido)
     
+    # Contar en una sola pasada palabras, el n-grama pedido, los de
+    # comparación y todos sus contextos
+    vocabulario = Vocabulario()
+    ids = vocabulario.codificar(palabras_limpias)
+    ordenes = ordenes_procesamiento(n_grama, n_gramas_comparacion, len(ids))
+    conteos = contar_multiorden(ids, ordenes)
+    
+    return resultado_desde_conteos(
+        vocabulario, palabras_limpias, conteos, n_grama, usar_fronteras, n_gramas_comparacion
+    )
+
+def ordenes_procesamiento(n_grama, n_gramas_comparacion, total_palabras):
+    """Órdenes que necesita procesar_texto_completo para un texto"""
+    return [1] + [
+        n for n in [n_grama] + list(n_gramas_comparacion)
+        if n > 1 and total_palabras >= n
+    ]
+
+def resultado_desde_conteos(vocabulario, palabras_limpias, conteos, n_grama, usar_fronteras, n_gramas_comparacion):
+    """
+    Arma el resultado de procesar_texto_completo a partir de tokens y
+    conteos ya hechos (por ejemplo, guardados en cache)
+    """
     # Generar histograma con palabras individuales
-    contador_palabras = Counter(palabras_limpias)
-    palabras_comunes = contador_palabras.most_common(20)
+    palabras_comunes = [
+        (vocabulario.palabras[clave[0]], frecuencia)
+        for clave, frecuencia in conteos[1].most_common(20)
+    ]
     
     # Generar n-gramas y probabilidades
     ngramas_comunes = []
@@ -252,16 +639,18 @@ def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas
     ngramas_comparacion = {}
     
     if n_grama > 1 and len(palabras_limpias) >= n_grama:
-        ngramas = generar_ngramas(palabras_limpias, n_grama)
-        if ngramas:
-            contador_ngramas = Counter(ngramas)
-            ngramas_comunes = contador_ngramas.most_common(20)
-            ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
+        contador_ngramas = conteos[n_grama]
+        if contador_ngramas:
+            ngramas_comunes = [
+                (vocabulario.decodificar(clave), frecuencia)
+                for clave, frecuencia in contador_ngramas.most_common(20)
+            ]
+            ngramas_probabilidades = probabilidades_desde_conteos(vocabulario, conteos, n_grama)
     
-    # Calcular n-gramas para comparación
+    # Calcular n-gramas para comparación a partir de los mismos conteos
     for n in n_gramas_comparacion:
         if n != n_grama and len(palabras_limpias) >= n:
-            ngramas_comparacion[n] = calcular_probabilidad_ngramas(palabras_limpias, n)
+            ngramas_comparacion[n] = probabilidades_desde_conteos(vocabulario, conteos, n)
     
     return {
         'palabras_comunes': palabras_comunes,
@@ -275,9 +664,74 @@ def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas
         'n_gramas_comparacion': n_gramas_comparacion
     }
 
+@medir('probabilidades')
+def vista_resultado(vocabulario, total_palabras, conteos, n_grama, n_gramas_comparacion):
+    """
+    Lo que muestra resultado.html, ya armado a partir de los conteos: las
+    palabras y n-gramas más frecuentes (cada n-grama con su probabilidad) y
+    un resumen por orden de comparación. No construye las tablas completas
+    de probabilidades que arma resultado_desde_conteos.
+    """
+    palabras_vocabulario = vocabulario.palabras
+    palabras_comunes = [
+        (palabras_vocabulario[clave[0]], frecuencia)
+        for clave, frecuencia in conteos[1].most_common(FILAS_RESULTADO)
+    ] if conteos.get(1) else []
+    
+    ngramas_comunes = []
+    if n_grama > 1 and total_palabras >= n_grama and conteos.get(n_grama):
+        freq_contextos = conteos[n_grama-1]
+        ngramas_comunes = [
+            fila_probabilidad(
+                vocabulario.decodificar(clave[:-1]), palabras_vocabulario[clave[-1]],
+                frecuencia, freq_contextos.get(clave[:-1], 0), n_grama
+            )
+            for clave, frecuencia in conteos[n_grama].most_common(FILAS_RESULTADO)
+        ]
+    
+    comparacion = []
+    for n in n_gramas_comparacion:
+        if n != n_grama and n > 1 and total_palabras >= n and conteos.get(n):
+            freq_contextos = conteos[n-1]
+            comparacion.append({
+                'n': n,
+                'total_ngramas': len(conteos[n]),
+                'max_probabilidad': max(
+                    frecuencia / freq_contextos[clave[:-1]] for clave, frecuencia in conteos[n].items()
+                ),
+            })
+    
+    return {
+        'total_palabras': total_palabras,
+        'palabras_comunes': palabras_comunes,
+        'ngramas_comunes': ngramas_comunes,
+        'comparacion': comparacion,
+    }
+
+def indexar_por_contexto(ngramas_probabilidades):
+    """
+    Agrupa los n-gramas por contexto:
+    contexto -> (C(contexto), [(palabra, C(contexto, palabra)), ...])
+    con las continuaciones ya ordenadas de mayor a menor probabilidad
+    """
+    indice = {}
+    for datos in ngramas_probabilidades.values():
+        entrada = indice.get(datos['contexto'])
+        if entrada is None:
+            entrada = indice[datos['contexto']] = (datos['frecuencia_contexto'], [])
+        entrada[1].append((datos['palabra_objetivo'], datos['frecuencia_ngrama']))
+    
+    # Dentro de un contexto la probabilidad es proporcional a la frecuencia
+    for _, continuaciones in indice.values():
+        continuaciones.sort(key=lambda x: (-x[1], x[0]))
+    
+    return indice
+
 def predecir_siguiente_palabra(contexto, ngramas_probabilidades, n=2):
     """
     Predice la siguiente palabra dado un contexto y un modelo de n-gramas
+    (el diccionario de calcular_probabilidad_ngramas). Recorre todos los
+    n-gramas; con un modelo de autocompletado usar sugerencias_contexto.
     """
     sugerencias = []
     
@@ -290,6 +744,17 @@ def predecir_siguiente_palabra(contexto, ngramas_probabilidades, n=2):
     
     return sugerencias
 
+def sugerencias_contexto(contexto, modelo, max_sugerencias=None):
+    """
+    Sugerencias para un contexto en un modelo de autocompletado (el que
+    devuelve generar_modelo_autocompletado). Es una sola búsqueda por
+    contexto porque las sugerencias ya vienen ordenadas.
+    """
+    sugerencias = modelo.get(contexto, [])
+    if max_sugerencias is not None:
+        sugerencias = sugerencias[:max_sugerencias]
+    return [(s['palabra'], s['probabilidad']) for s in sugerencias]
+
 def generar_modelo_autocompletado(tokens, n=2):
     """
     Genera un modelo de autocompletado basado en n-gramas
@@ -297,24 +762,18 @@ def generar_modelo_autocompletado(tokens, n=2):
     if n < 2:
         return {}
     
-    # Calcular probabilidades de n-gramas
-    ngramas_prob = calcular_probabilidad_ngramas(tokens, n)
+    # Calcular probabilidades de n-gramas y organizarlas por contextos
+    indice = indexar_por_contexto(calcular_probabilidad_ngramas(tokens, n))
     
-    # Organizar por contextos
     modelo = {}
-    for ngrama, datos in ngramas_prob.items():
-        contexto = datos['contexto']
-        if contexto not in modelo:
-            modelo[contexto] = []
-        
-        modelo[contexto].append({
-            'palabra': datos['palabra_objetivo'],
-            'probabilidad': datos['probabilidad'],
-            'frecuencia': datos['frecuencia_ngrama']
-        })
-    
-    # Ordenar cada lista de sugerencias por probabilidad
-    for contexto in modelo:
-        modelo[contexto].sort(key=lambda x: x['probabilidad'], reverse=True)
-    
-    return modelo
\ No newline at end of file
+    for contexto, (frecuencia_contexto, continuaciones) in indice.items():
+        modelo[contexto] = [
+            {
+                'palabra': palabra,
+                'probabilidad': frecuencia / frecuencia_contexto if frecuencia_contexto else 0.0,
+                'frecuencia': frecuencia
+            }
+            for palabra, frecuencia in continuaciones
+        ]
+    
+    return modelo
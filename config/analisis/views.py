@@ -1,18 +1,55 @@
 # views.py - Actualizar las importaciones
-import re
 import json
+import hashlib
 from collections import Counter
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
 from .forms import TextoAnalizadoForm
-from .models import TextoAnalizado
-from .utils import procesar_texto_completo, limpiar_texto, limpiar_texto_con_fronteras, calcular_probabilidad_ngramas
+from .models import TextoAnalizado, Corpus, ModeloNgramas, TareaEntrenamiento
+from .conteo import Vocabulario
+from .utils import (
+    estadisticas_procesamiento, fragmento_archivo, limpiar_texto, tabla_desde_conteos, vista_resultado,
+    CARACTERES_POR_PAGINA, CRITERIOS_TABLA, FILAS_POR_PAGINA,
+)
+from .cache_textos import (
+    asegurar_preprocesado, conteos_texto, estadisticas_texto, vista_resultado_texto, suma_archivo, estadisticas_cache,
+    tokens_texto,
+)
+from .almacen import (
+    buscar_modelo, tabla_probabilidades, cargar_indice, buscar_sugerencias, completar_frases,
+    cargar_indice_async, pool_carga,
+    N_GRAMA_DEFECTO, FRONTERAS_DEFECTO,
+)
+from .suavizado import (
+    METODOS as METODOS_SUAVIZADO, K_DEFECTO, ANCHO_HAZ_DEFECTO, LONGITUD_FRASE_DEFECTO,
+)
+from .evaluacion import evaluar, evaluar_division, traducir_ids, DIVISION_DEFECTO
+from .metricas import registro
+from .tareas import encolar_entrenamiento, estado_tarea
+
+# Textos que acepta como máximo una petición a sugerencias_lote
+MAX_TEXTOS_LOTE = 50
+
+# Filas por página de cada tabla de la comparación con/sin fronteras
+FILAS_COMPARACION = 15
+
+# Filas que se pueden pedir como máximo en una página de la API de tablas
+MAX_FILAS_POR_PAGINA = 500
 
 def subir_texto(request):
     if request.method == 'POST':
         form = TextoAnalizadoForm(request.POST, request.FILES)
         if form.is_valid():
-            form.save()
+            texto_obj = form.save()
+            # Las estadísticas y el flujo de tokens se arman una vez, al subirlo
+            asegurar_preprocesado(texto_obj)
+            # Entrenar en segundo plano el modelo que usa por defecto el autocompletado
+            encolar_entrenamiento(texto_obj, N_GRAMA_DEFECTO, FRONTERAS_DEFECTO)
             return redirect('lista_textos')
     else:
         form = TextoAnalizadoForm()
@@ -41,173 +78,413 @@ def analizar_texto(request, texto_id, n_grama=1):
     
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer el contenido del archivo
+    # Las filas de las tablas se arman recién al renderizar y solo si el
+    # fragmento no está en la cache; los tokens y conteos quedan en la cache
+    # del proceso para las siguientes consultas con otro n_grama
     try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except:
-        contenido = ""
+        suma = suma_archivo(texto_obj)
+    except OSError:
+        suma = None
     
-    # Procesar el texto
-    resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras, n_gramas_comparacion)
+    def calcular_vista():
+        try:
+            if suma is not None:
+                return vista_resultado_texto(texto_obj, n_grama, usar_fronteras, n_gramas_comparacion, suma)
+        except OSError:
+            pass
+        return vista_resultado(Vocabulario(), 0, {}, n_grama, n_gramas_comparacion)
     
-    # Guardar el contenido original y procesado en la sesión
-    request.session['texto_original'] = contenido
-    request.session['texto_procesado'] = ' '.join(resultado['palabras_limpias'])
+    # En la sesión solo se guarda una referencia al análisis; los tokens se
+    # recuperan de la cache con cache_textos.palabras_texto
+    request.session['ultimo_analisis'] = {
+        'texto_id': texto_obj.id,
+        'suma': suma,
+        'n_grama': n_grama,
+        'usar_fronteras': usar_fronteras,
+    }
     
     return render(request, 'resultado.html', {
         'texto': texto_obj,
-        'palabras_comunes': resultado['palabras_comunes'],
-        'ngramas_comunes': resultado['ngramas_comunes'],
-        'ngramas_probabilidades': resultado['ngramas_probabilidades'],
-        'ngramas_comparacion': resultado['ngramas_comparacion'],
-        'total_palabras': resultado['total_palabras'],
+        'vista': SimpleLazyObject(calcular_vista),
+        'suma': suma,
         'n_grama': n_grama,
         'usar_fronteras': usar_fronteras,
-        'n_gramas_comparacion': resultado['n_gramas_comparacion'],
+        'n_gramas_comparacion': n_gramas_comparacion,
+        'tiempo_fragmentos': tiempo_fragmentos(),
         'texto_id': texto_id
     })
+
+def tiempo_fragmentos():
+    """Segundos que se guardan los fragmentos de plantilla en la cache"""
+    return getattr(settings, 'ANALISIS_FRAGMENTOS_TIEMPO', 600)
     
 def ver_procesamiento(request, texto_id):
     """Vista para mostrar los detalles del procesamiento aplicado"""
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer el contenido del archivo
+    # Las estadísticas se calcularon al subir el texto; del contenido solo
+    # se lee la página pedida de la vista previa
     try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except:
-        contenido = ""
-    
-    # Obtener el texto original y procesado
-    texto_original = contenido
-    palabras_limpias = limpiar_texto(contenido)
-    texto_procesado = ' '.join(palabras_limpias)
-    
-    # Contar estadísticas
-    palabras_originales = re.findall(r'\b[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]+\b', texto_original.lower())
-    stopwords_eliminadas = len(palabras_originales) - len(palabras_limpias)
-    
-    # Encontrar símbolos eliminados
-    simbolos_eliminados = set()
-    for palabra in texto_original.split():
-        simbolos = re.findall(r'[^\w\sáéíóúñüÁÉÍÓÚÑÜ]', palabra)
-        simbolos_eliminados.update(simbolos)
-    
-    # Encontrar palabras con acentos en el texto original
-    palabras_con_acentos = []
-    for palabra in palabras_originales:
-        if re.search(r'[áéíóúÁÉÍÓÚñÑüÜ]', palabra):
-            palabras_con_acentos.append(palabra)
+        estadisticas = estadisticas_texto(texto_obj)
+        pagina = Paginator(range(estadisticas['caracteres']), CARACTERES_POR_PAGINA).get_page(request.GET.get('pagina'))
+        with texto_obj.archivo.open('rb') as archivo:
+            texto_original = fragmento_archivo(archivo, pagina.object_list.start, pagina.object_list.stop)
+    except OSError:
+        estadisticas = estadisticas_procesamiento([])
+        pagina = Paginator([], CARACTERES_POR_PAGINA).get_page(1)
+        texto_original = ''
     
     return render(request, 'procesamiento.html', {
         'texto': texto_obj,
         'texto_original': texto_original,
-        'texto_procesado': texto_procesado,
-        'total_palabras_original': len(palabras_originales),
-        'total_palabras_limpias': len(palabras_limpias),
-        'stopwords_eliminadas': stopwords_eliminadas,
-        'simbolos_eliminados': ', '.join(simbolos_eliminados) if simbolos_eliminados else 'Ninguno',
-        'palabras_con_acentos': palabras_con_acentos[:20]
+        'texto_procesado': ' '.join(limpiar_texto(texto_original)),
+        'pagina': pagina,
+        'total_palabras_original': estadisticas['palabras_originales'],
+        'total_palabras_limpias': estadisticas['palabras_limpias'],
+        'stopwords_eliminadas': estadisticas['stopwords_eliminadas'],
+        'simbolos_eliminados': ', '.join(estadisticas['simbolos_eliminados']),
+        'total_simbolos_eliminados': len(estadisticas['simbolos_eliminados']),
+        'total_palabras_con_acentos': estadisticas['palabras_con_acentos'],
+        'palabras_con_acentos': estadisticas['muestra_acentos'],
     })
 
+def obtener_fuente(valor):
+    """Texto o corpus elegido en un selector ('<id>' o 'corpus:<id>')"""
+    valor = str(valor or '')
+    if valor.startswith('corpus:'):
+        return get_object_or_404(Corpus, id=valor[len('corpus:'):])
+    return get_object_or_404(TextoAnalizado, id=valor)
+
+def crear_corpus(datos):
+    """Crea un corpus con los textos marcados en el formulario (o con todos)"""
+    incluir_todos = datos.get('todos') == 'true'
+    if incluir_todos:
+        textos = list(TextoAnalizado.objects.all())
+    else:
+        textos = list(TextoAnalizado.objects.filter(id__in=datos.getlist('textos')))
+    if not textos:
+        return None
+    
+    titulo = datos.get('titulo_corpus', '').strip() or f'Corpus de {len(textos)} textos'
+    corpus = Corpus.objects.create(titulo=titulo, incluir_todos=incluir_todos)
+    corpus.textos.set(textos)
+    return corpus
+
 def autocompletado_view(request):
     """Vista principal para el autocompletado"""
     textos = TextoAnalizado.objects.all().order_by('-fecha_subida')
     return render(request, 'autocompletado.html', {
-        'textos': textos
+        'textos': textos,
+        'corpus': Corpus.objects.order_by('-fecha_creacion')
     })
 
-def obtener_sugerencias(request):
-    """API para obtener sugerencias de autocompletado"""
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            texto_parcial = data.get('texto', '').strip().lower()
-            texto_id = data.get('texto_id')
-            n_grama = int(data.get('n_grama', 3))
-            max_sugerencias = int(data.get('max_sugerencias', 5))
-            usar_fronteras = data.get('fronteras', False)
-            
-            # Validar n_grama
-            if n_grama < 2:
-                n_grama = 2
-            elif n_grama > 20:
-                n_grama = 20
-                
-            # Validar max_sugerencias
-            if max_sugerencias < 1:
-                max_sugerencias = 1
-            elif max_sugerencias > 20:
-                max_sugerencias = 20
-            
-            if not texto_parcial:
-                return JsonResponse({'error': 'Texto vacío'}, status=400)
-                
-            # Obtener el texto seleccionado
-            texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
-            
-            # Leer el contenido del archivo
-            try:
-                with texto_obj.archivo.open('r') as archivo:
-                    contenido = archivo.read()
-            except:
-                return JsonResponse({'error': 'Error al leer el archivo'}, status=500)
-            
-            # Procesar el texto
-            resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras)
-            palabras_limpias = resultado['palabras_limpias']
-            
-            # Verificar si hay suficientes palabras
-            if len(palabras_limpias) < n_grama:
-                return JsonResponse({
-                    'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {len(palabras_limpias)} palabras.'
-                }, status=400)
-            
-            # Generar n-gramas y calcular probabilidades
-            ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
-            
-            # Obtener el contexto (últimas n-1 palabras)
-            palabras = texto_parcial.split()
-            contexto = ""
-            
-            if n_grama > 1 and len(palabras) >= n_grama - 1:
-                contexto = ' '.join(palabras[-(n_grama-1):])
-            elif palabras:
-                contexto = ' '.join(palabras)
-            else:
-                contexto = texto_parcial
-            
-            # Buscar sugerencias
-            sugerencias = []
-            for ngrama, datos in ngramas_probabilidades.items():
-                if datos['contexto'] == contexto:
-                    sugerencias.append({
-                        'palabra': datos['palabra_objetivo'],
-                        'probabilidad': datos['probabilidad'],
-                        'frecuencia_ngrama': datos['frecuencia_ngrama'],
-                        'frecuencia_contexto': datos['frecuencia_contexto'],
-                        'ngrama_completo': ngrama
-                    })
-            
-            # Ordenar por probabilidad descendente
-            sugerencias.sort(key=lambda x: (x['probabilidad'], x['frecuencia_ngrama']), reverse=True)
-            
-            # Limitar a las mejores sugerencias
-            sugerencias = sugerencias[:max_sugerencias]
-            
-            return JsonResponse({
-                'sugerencias': sugerencias,
-                'contexto': contexto,
-                'n_grama': n_grama,
-                'total_sugerencias': len(sugerencias),
-                'total_ngramas_modelo': len(ngramas_probabilidades)
-            })
-            
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
-    
-    return JsonResponse({'error': 'Método no permitido'}, status=405)
+def modelo_entrenado(fuente, n_grama, usar_fronteras):
+    """
+    (modelo, None) si el modelo ya está entrenado; si no, encola su
+    entrenamiento y devuelve (None, respuesta JSON con el progreso o el error)
+    """
+    modelo = buscar_modelo(fuente, n_grama, usar_fronteras)
+    if modelo is not None:
+        return modelo, None
+    
+    tarea = encolar_entrenamiento(fuente, n_grama, usar_fronteras)
+    if tarea.estado == TareaEntrenamiento.ERROR:
+        return None, JsonResponse({'error': f'Error al entrenar el modelo: {tarea.mensaje}'}, status=500)
+    if tarea.estado != TareaEntrenamiento.COMPLETADA:
+        return None, JsonResponse({
+            'error': 'El modelo se está entrenando, intenta de nuevo en unos segundos',
+            'entrenando': True,
+            **estado_tarea(tarea)
+        }, status=202)
+    return tarea.modelo, None
+
+def valor_booleano(valor):
+    """Booleano de un campo JSON (true/false) o de la query string ('true', '1')"""
+    if isinstance(valor, str):
+        return valor.lower() in ('true', '1', 'on')
+    return bool(valor)
+
+def leer_parametros_sugerencias(data):
+    """
+    Parámetros de las APIs de sugerencias (JSON o query string) ya
+    validados; (parametros, None) o (None, respuesta de error)
+    """
+    parametros = {
+        'texto_id': data.get('texto_id'),
+        'n_grama': int(data.get('n_grama', 3)),
+        'max_sugerencias': int(data.get('max_sugerencias', 5)),
+        'usar_fronteras': valor_booleano(data.get('fronteras', False)),
+        'suavizado': data.get('suavizado', 'mle'),
+        'k': float(data.get('k', K_DEFECTO)),
+        'completar': valor_booleano(data.get('completar', False)),
+    }
+    
+    if parametros['suavizado'] not in METODOS_SUAVIZADO:
+        return None, JsonResponse({'error': f"Método de suavizado desconocido: {parametros['suavizado']}"}, status=400)
+    if parametros['k'] <= 0:
+        return None, JsonResponse({'error': 'k debe ser mayor que cero'}, status=400)
+    
+    # Validar n_grama y max_sugerencias
+    parametros['n_grama'] = min(max(parametros['n_grama'], 2), 20)
+    parametros['max_sugerencias'] = min(max(parametros['max_sugerencias'], 1), 20)
+    return parametros, None
+
+def cargar_modelo_sugerencias(parametros):
+    """(modelo, None) listo para sugerir, o (None, respuesta) si se está entrenando o es muy corto"""
+    fuente = obtener_fuente(parametros['texto_id'])
+    n_grama = parametros['n_grama']
+    
+    # Cargar el modelo ya entrenado; si no existe se encola su entrenamiento
+    modelo, respuesta = modelo_entrenado(fuente, n_grama, parametros['usar_fronteras'])
+    if respuesta is not None:
+        return None, respuesta
+    
+    # Verificar si hay suficientes palabras
+    if modelo.total_palabras < n_grama:
+        return None, JsonResponse({
+            'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {modelo.total_palabras} palabras.'
+        }, status=400)
+    return modelo, None
+
+def sugerencias_para_texto(indice, texto_original, parametros):
+    """Contexto, prefijo y sugerencias para un texto escrito"""
+    n_grama = parametros['n_grama']
+    texto_parcial = texto_original.strip().lower()
+    
+    # Con completar, si el texto no termina en espacio la última palabra
+    # está a medio escribir y se completa en lugar de predecir la siguiente
+    palabras = texto_parcial.split()
+    prefijo = ''
+    if parametros['completar'] and palabras and not texto_original[-1:].isspace():
+        prefijo = palabras.pop()
+    
+    # Obtener el contexto (últimas n-1 palabras)
+    contexto = ""
+    
+    if n_grama > 1 and len(palabras) >= n_grama - 1:
+        contexto = ' '.join(palabras[-(n_grama-1):])
+    elif palabras:
+        contexto = ' '.join(palabras)
+    elif not prefijo:
+        contexto = texto_parcial
+    
+    # Buscar sugerencias (ya vienen ordenadas por probabilidad)
+    sugerencias = buscar_sugerencias(
+        indice, contexto, parametros['max_sugerencias'], parametros['suavizado'], parametros['k'], prefijo
+    )
+    return {'sugerencias': sugerencias, 'contexto': contexto, 'prefijo': prefijo}
+
+def etag_sugerencias(modelo, parametros, texto):
+    """ETag de una respuesta: cambia si cambian los parámetros, el texto o el modelo"""
+    datos = json.dumps(
+        [modelo.pk, modelo.fecha_entrenamiento.isoformat(), sorted(parametros.items()), texto.lower()],
+        default=str,
+    )
+    return '"%s"' % hashlib.sha1(datos.encode('utf-8')).hexdigest()
+
+async def obtener_sugerencias(request):
+    """
+    API para obtener sugerencias de autocompletado. Por POST (JSON) o por
+    GET con los mismos campos en la query string: la respuesta GET lleva
+    ETag y Cache-Control, así el navegador reutiliza o revalida (304) las
+    consultas repetidas sin que el servidor vuelva a calcularlas.
+    
+    Es una vista async: la base de datos y la apertura del modelo se
+    esperan en hilos y la búsqueda en el índice ya abierto no bloquea.
+    """
+    if request.method not in ('GET', 'POST'):
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body) if request.method == 'POST' else request.GET
+        texto_original = data.get('texto', '')
+        
+        parametros, respuesta = leer_parametros_sugerencias(data)
+        if respuesta is not None:
+            return respuesta
+        
+        if not texto_original.strip():
+            return JsonResponse({'error': 'Texto vacío'}, status=400)
+        
+        modelo, respuesta = await sync_to_async(cargar_modelo_sugerencias)(parametros)
+        if respuesta is not None:
+            return respuesta
+        
+        etag = None
+        if request.method == 'GET':
+            etag = etag_sugerencias(modelo, parametros, texto_original)
+            no_modificada = get_conditional_response(request, etag=etag)
+            if no_modificada is not None:
+                return no_modificada
+        
+        indice = await cargar_indice_async(modelo)
+        resultado = sugerencias_para_texto(indice, texto_original, parametros)
+        respuesta = JsonResponse({
+            **resultado,
+            'n_grama': parametros['n_grama'],
+            'suavizado': parametros['suavizado'],
+            'total_sugerencias': len(resultado['sugerencias']),
+            'total_ngramas_modelo': modelo.total_ngramas
+        })
+        if etag is not None:
+            respuesta['ETag'] = etag
+            patch_cache_control(respuesta, private=True, max_age=getattr(settings, 'ANALISIS_SUGERENCIAS_MAX_AGE', 60))
+        return respuesta
+        
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+async def sugerencias_lote(request):
+    """
+    API de sugerencias para varios textos con el mismo modelo en una sola
+    petición (campo `textos`, máximo MAX_TEXTOS_LOTE); por ejemplo, para
+    precargar lo que sigue a cada sugerencia mostrada
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        textos = data.get('textos', [])
+        if not isinstance(textos, list) or not textos:
+            return JsonResponse({'error': 'Indica una lista de textos'}, status=400)
+        if len(textos) > MAX_TEXTOS_LOTE:
+            return JsonResponse({'error': f'Máximo {MAX_TEXTOS_LOTE} textos por lote'}, status=400)
+        
+        parametros, respuesta = leer_parametros_sugerencias(data)
+        if respuesta is not None:
+            return respuesta
+        
+        modelo, respuesta = await sync_to_async(cargar_modelo_sugerencias)(parametros)
+        if respuesta is not None:
+            return respuesta
+        
+        indice = await cargar_indice_async(modelo)
+        
+        def calcular():
+            return [
+                dict(sugerencias_para_texto(indice, texto, parametros), texto=texto) if texto.strip()
+                else {'texto': texto, 'error': 'Texto vacío'}
+                for texto in map(str, textos)
+            ]
+        
+        # Un lote completo se calcula en el pool de carga para no retener el bucle de eventos
+        resultados = await sync_to_async(calcular, thread_sensitive=False, executor=pool_carga())()
+        return JsonResponse({
+            'resultados': resultados,
+            'n_grama': parametros['n_grama'],
+            'suavizado': parametros['suavizado'],
+        })
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def completar_frases_api(request):
+    """
+    API de frases completas: las continuaciones más probables de hasta
+    `longitud` palabras del texto escrito, por búsqueda en haz
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        texto_parcial = data.get('texto', '').strip().lower()
+        n_grama = min(max(int(data.get('n_grama', 3)), 2), 20)
+        usar_fronteras = valor_booleano(data.get('fronteras', False))
+        suavizado = data.get('suavizado', 'kneser_ney')
+        k = float(data.get('k', K_DEFECTO))
+        max_frases = min(max(int(data.get('max_frases', 5)), 1), 20)
+        ancho = min(max(int(data.get('ancho', ANCHO_HAZ_DEFECTO)), 1), 20)
+        longitud = min(max(int(data.get('longitud', LONGITUD_FRASE_DEFECTO)), 1), 10)
+        
+        if suavizado not in METODOS_SUAVIZADO:
+            return JsonResponse({'error': f'Método de suavizado desconocido: {suavizado}'}, status=400)
+        if k <= 0:
+            return JsonResponse({'error': 'k debe ser mayor que cero'}, status=400)
+        if not texto_parcial:
+            return JsonResponse({'error': 'Texto vacío'}, status=400)
+        
+        fuente = obtener_fuente(data.get('texto_id'))
+        modelo, respuesta = modelo_entrenado(fuente, n_grama, usar_fronteras)
+        if respuesta is not None:
+            return respuesta
+        
+        contexto = ' '.join(texto_parcial.split()[-(n_grama - 1):])
+        frases = completar_frases(modelo, contexto, max_frases, suavizado, k, ancho, longitud)
+        
+        return JsonResponse({
+            'frases': frases,
+            'contexto': contexto,
+            'n_grama': n_grama,
+            'suavizado': suavizado,
+            'ancho': ancho,
+            'longitud': longitud,
+        })
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def evaluar_modelo(request):
+    """
+    API de evaluación: entropía cruzada y perplejidad por orden (2..n) de
+    un texto de prueba (prueba_id) con el modelo guardado de un texto o
+    corpus. Sin prueba_id se divide el texto: se entrena con la fracción
+    `division` y se evalúa con el resto.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        n_grama = min(max(int(data.get('n_grama', 3)), 2), 20)
+        usar_fronteras = valor_booleano(data.get('fronteras', False))
+        suavizado = data.get('suavizado', 'kneser_ney')
+        k = float(data.get('k', K_DEFECTO))
+        division = float(data.get('division', DIVISION_DEFECTO))
+        prueba_id = data.get('prueba_id')
+        
+        if suavizado not in METODOS_SUAVIZADO:
+            return JsonResponse({'error': f'Método de suavizado desconocido: {suavizado}'}, status=400)
+        if k <= 0:
+            return JsonResponse({'error': 'k debe ser mayor que cero'}, status=400)
+        
+        fuente = obtener_fuente(data.get('texto_id'))
+        opciones = {'metodo': suavizado, 'k': k}
+        
+        if prueba_id:
+            modelo, respuesta = modelo_entrenado(fuente, n_grama, usar_fronteras)
+            if respuesta is not None:
+                return respuesta
+            prueba = get_object_or_404(TextoAnalizado, id=prueba_id)
+            vocabulario, ids = tokens_texto(prueba, usar_fronteras)
+            indice = cargar_indice(modelo)
+            ids_prueba = traducir_ids(indice, vocabulario.palabras, ids)
+            tokens_entrenamiento = modelo.total_palabras
+            resultados = evaluar(indice, ids_prueba, **opciones)
+            tokens_prueba = len(ids_prueba)
+        else:
+            if not isinstance(fuente, TextoAnalizado):
+                return JsonResponse({'error': 'La división solo se aplica a un texto; indica prueba_id'}, status=400)
+            if not 0 < division < 1:
+                return JsonResponse({'error': 'division debe estar entre 0 y 1'}, status=400)
+            vocabulario, ids = tokens_texto(fuente, usar_fronteras)
+            tokens_entrenamiento, tokens_prueba, resultados = evaluar_division(
+                vocabulario.palabras, ids, n_grama, usar_fronteras, division, **opciones
+            )
+        
+        return JsonResponse({
+            'fuente': str(fuente),
+            'prueba_id': prueba_id,
+            'n_grama': n_grama,
+            'suavizado': suavizado,
+            'tokens_entrenamiento': tokens_entrenamiento,
+            'tokens_prueba': tokens_prueba,
+            'resultados': resultados,
+        })
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
 
 def entrenar_modelo(request):
     """Vista para entrenar y visualizar el modelo de n-gramas"""
@@ -222,49 +499,131 @@ def entrenar_modelo(request):
         elif n_grama > 20:
             n_grama = 20
         
-        texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
-        
-        # Leer el contenido del archivo
-        try:
-            with texto_obj.archivo.open('r') as archivo:
-                contenido = archivo.read()
-        except:
-            contenido = ""
-        
-        # Procesar el texto
-        resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras)
-        palabras_limpias = resultado['palabras_limpias']
-        
-        # Verificar si hay suficientes palabras
-        if len(palabras_limpias) < n_grama:
-            return render(request, 'entrenar_modelo.html', {
-                'textos': TextoAnalizado.objects.all().order_by('-fecha_subida'),
-                'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {len(palabras_limpias)} palabras.'
-            })
+        if texto_id == 'nuevo_corpus':
+            fuente = crear_corpus(request.POST)
+            if fuente is None:
+                return render(request, 'error.html', {
+                    'error': 'Selecciona al menos un texto para el corpus',
+                    'n_grama': n_grama
+                })
+        else:
+            fuente = obtener_fuente(texto_id)
         
-        # Calcular probabilidades
-        ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
-        
-        # Preparar datos para la visualización
-        ngramas_ordenados = sorted(
-            ngramas_probabilidades.items(), 
-            key=lambda x: x[1]['frecuencia_ngrama'], 
-            reverse=True
-        )[:50]
-        
-        return render(request, 'modelo_entrenado.html', {
-            'texto': texto_obj,
-            'n_grama': n_grama,
-            'usar_fronteras': usar_fronteras,
-            'ngramas_probabilidades': ngramas_ordenados,
-            'total_ngramas': len(ngramas_probabilidades),
-            'palabras_limpias': palabras_limpias,
-            'max_mostrar': 50
-        })
+        # Entrenar en segundo plano y seguir el progreso
+        tarea = encolar_entrenamiento(fuente, n_grama, usar_fronteras)
+        return redirect('ver_tarea', tarea_id=tarea.id)
     
     textos = TextoAnalizado.objects.all().order_by('-fecha_subida')
     return render(request, 'entrenar_modelo.html', {
-        'textos': textos
+        'textos': textos,
+        'corpus': Corpus.objects.order_by('-fecha_creacion')
+    })
+
+def ver_tarea(request, tarea_id):
+    """Vista con el progreso de una tarea de entrenamiento"""
+    tarea = get_object_or_404(TareaEntrenamiento.objects.select_related('texto', 'corpus'), id=tarea_id)
+    if tarea.estado == TareaEntrenamiento.COMPLETADA and tarea.modelo_id:
+        return redirect('ver_modelo', modelo_id=tarea.modelo_id)
+    
+    return render(request, 'tarea_entrenamiento.html', {
+        'tarea': tarea,
+        'texto': tarea.fuente
+    })
+
+def estado_tarea_api(request, tarea_id):
+    """API con el estado y progreso de una tarea de entrenamiento"""
+    tarea = get_object_or_404(TareaEntrenamiento, id=tarea_id)
+    return JsonResponse(estado_tarea(tarea))
+
+def metricas_api(request):
+    """
+    API con los histogramas de tiempos por etapa y por vista de este
+    proceso; con ?formato=prometheus, en el formato de texto de Prometheus
+    """
+    if request.GET.get('formato') == 'prometheus':
+        return HttpResponse(registro.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return JsonResponse(registro.exportar())
+
+def estadisticas_cache_api(request):
+    """API con los contadores de la cache de textos de este proceso"""
+    return JsonResponse(estadisticas_cache())
+
+def criterio_tabla(request):
+    """Criterio de orden de una tabla de probabilidades pedido por GET"""
+    criterio = request.GET.get('orden', 'frecuencia')
+    return criterio if criterio in CRITERIOS_TABLA else 'frecuencia'
+
+def paginar_tabla(request, tabla, por_pagina=FILAS_POR_PAGINA):
+    """Página pedida (parámetro GET pagina) de una TablaPaginada"""
+    return Paginator(tabla, por_pagina).get_page(request.GET.get('pagina'))
+
+def numero_pagina(paginador, numero):
+    """Número de la página que devolvería Paginator.get_page, sin armar sus filas"""
+    try:
+        return paginador.validate_number(numero)
+    except PageNotAnInteger:
+        return 1
+    except EmptyPage:
+        return paginador.num_pages
+
+def ver_modelo(request, modelo_id):
+    """Vista para visualizar un modelo de n-gramas ya entrenado"""
+    modelo = get_object_or_404(ModeloNgramas.objects.select_related('texto', 'corpus'), id=modelo_id)
+    criterio = criterio_tabla(request)
+    
+    try:
+        tabla = tabla_probabilidades(modelo, criterio)
+    except (OSError, ValueError) as e:
+        return render(request, 'error.html', {
+            'error': f'Error al cargar el modelo: {str(e)}',
+            'texto': modelo.fuente,
+            'n_grama': modelo.n
+        })
+    
+    # Solo se arman las filas de la página pedida
+    pagina = paginar_tabla(request, tabla)
+    
+    return render(request, 'modelo_entrenado.html', {
+        'modelo': modelo,
+        'texto': modelo.fuente,
+        'n_grama': modelo.n,
+        'usar_fronteras': modelo.usar_fronteras,
+        'ngramas_probabilidades': pagina.object_list,
+        'pagina': pagina,
+        'orden': criterio,
+        'criterios': CRITERIOS_TABLA,
+        'total_ngramas': len(tabla),
+        'total_palabras': modelo.total_palabras,
+    })
+
+def tabla_modelo_api(request, modelo_id):
+    """
+    API con una página de la tabla de probabilidades de un modelo:
+    parámetros GET orden (frecuencia, probabilidad o contexto), pagina y
+    por_pagina
+    """
+    modelo = get_object_or_404(ModeloNgramas, id=modelo_id)
+    try:
+        por_pagina = min(max(int(request.GET.get('por_pagina', FILAS_POR_PAGINA)), 1), MAX_FILAS_POR_PAGINA)
+    except ValueError:
+        return JsonResponse({'error': 'por_pagina debe ser un entero'}, status=400)
+    criterio = criterio_tabla(request)
+    
+    try:
+        pagina = paginar_tabla(request, tabla_probabilidades(modelo, criterio), por_pagina)
+    except (OSError, ValueError) as e:
+        return JsonResponse({'error': f'Error al cargar el modelo: {str(e)}'}, status=500)
+    
+    return JsonResponse({
+        'modelo_id': modelo.id,
+        'orden': criterio,
+        'pagina': pagina.number,
+        'paginas': pagina.paginator.num_pages,
+        'total': pagina.paginator.count,
+        'filas': [
+            {'ngrama': ngrama, **datos}
+            for ngrama, datos in pagina.object_list
+        ],
     })
 
 def vista_comparacion_avanzada(request, texto_id):
@@ -297,56 +656,62 @@ def comparar_probabilidades(request, texto_id, n_grama=3):
     
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer contenido
+    # La suma del archivo identifica la versión del texto en la cache de fragmentos
     try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except Exception as e:
+        suma = suma_archivo(texto_obj)
+    except OSError as e:
         return render(request, 'error.html', {
             'error': f'Error al leer el archivo: {str(e)}',
             'texto': texto_obj
         })
+    criterio = criterio_tabla(request)
     
+    # Tokens y conteos desde la cache del proceso (se leen del archivo solo la
+    # primera vez). Las tablas son perezosas: aquí solo se preparan
     try:
-        # Procesar SIN fronteras
-        palabras_sin_fronteras = limpiar_texto(contenido, usar_stopwords=True)
-        ngramas_prob_sin = calcular_probabilidad_ngramas(palabras_sin_fronteras, n_grama) if palabras_sin_fronteras else {}
-        
-        # Procesar CON fronteras
-        palabras_con_fronteras = limpiar_texto_con_fronteras(contenido)
-        ngramas_prob_con = calcular_probabilidad_ngramas(palabras_con_fronteras, n_grama) if palabras_con_fronteras else {}
-        
-        # Obtener top n-gramas para comparación
-        top_sin = sorted(ngramas_prob_sin.items(), 
-                        key=lambda x: x[1]['frecuencia_ngrama'], 
-                        reverse=True)[:15] if ngramas_prob_sin else []
-        
-        top_con = sorted(ngramas_prob_con.items(), 
-                        key=lambda x: x[1]['frecuencia_ngrama'], 
-                        reverse=True)[:15] if ngramas_prob_con else []
-        
-        return render(request, 'comparacion.html', {
-            'texto': texto_obj,
-            'n_grama': n_grama,
-            'sin_fronteras': {
-                'palabras': palabras_sin_fronteras,
-                'total_palabras': len(palabras_sin_fronteras),
-                'ngramas_probabilidades': ngramas_prob_sin,
-                'top_ngramas': top_sin,
-                'total_ngramas': len(ngramas_prob_sin)
-            },
-            'con_fronteras': {
-                'palabras': palabras_con_fronteras,
-                'total_palabras': len(palabras_con_fronteras),
-                'ngramas_probabilidades': ngramas_prob_con,
-                'top_ngramas': top_con,
-                'total_ngramas': len(ngramas_prob_con)
-            }
-        })
-    
+        ordenes = [n_grama - 1, n_grama]
+        tablas_variantes = {}
+        for nombre, usar_fronteras in (('sin_fronteras', False), ('con_fronteras', True)):
+            vocabulario, ids, conteos = conteos_texto(texto_obj, usar_fronteras, ordenes)
+            tabla = tabla_desde_conteos(vocabulario, conteos, n_grama, criterio)
+            tablas_variantes[nombre] = (len(ids), Paginator(tabla, FILAS_COMPARACION))
     except Exception as e:
         return render(request, 'error.html', {
             'error': f'Error en el procesamiento: {str(e)}',
             'texto': texto_obj,
             'n_grama': n_grama
-        })
\ No newline at end of file
+        })
+    
+    # La navegación sigue a la variante con más páginas. La página resuelta
+    # (no el parámetro tal cual) va en la clave del fragmento en la cache
+    navegacion = max((paginador for _, paginador in tablas_variantes.values()), key=lambda p: p.num_pages)
+    numero = numero_pagina(navegacion, request.GET.get('pagina'))
+    
+    def calcular_tablas():
+        # De cada tabla se arma solo la página pedida
+        variantes = {}
+        for nombre, (total_palabras, paginador) in tablas_variantes.items():
+            pagina = paginador.page(min(numero, paginador.num_pages))
+            variantes[nombre] = {
+                'total_palabras': total_palabras,
+                'top_ngramas': pagina.object_list,
+                'total_ngramas': paginador.count,
+                'pagina': pagina,
+            }
+        variantes['pagina'] = max(
+            variantes['sin_fronteras']['pagina'], variantes['con_fronteras']['pagina'],
+            key=lambda pagina: pagina.paginator.num_pages,
+        )
+        return variantes
+    
+    # Las tablas se calculan al renderizar y solo si el fragmento no está en la cache
+    return render(request, 'comparacion.html', {
+        'texto': texto_obj,
+        'n_grama': n_grama,
+        'orden': criterio,
+        'criterios': CRITERIOS_TABLA,
+        'suma': suma,
+        'numero_pagina': numero,
+        'tiempo_fragmentos': tiempo_fragmentos(),
+        'tablas': SimpleLazyObject(calcular_tablas),
+    })
@@ -3,6 +3,12 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The suggestion APIs (analisis.views.obtener_sugerencias and
+sugerencias_lote) are async views, so one process can serve many
+concurrent autocomplete sessions, e.g.:
+
+    uvicorn config.asgi:application --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'analisis.metricas.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el renderizado (Server-Timing)
+        'BACKEND': 'analisis.metricas.PlantillasMedidas',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -119,4 +122,53 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Entrenamiento de modelos de n-gramas en segundo plano.
+# Las tareas las ejecuta: python manage.py procesar_tareas
+# Con True se ejecutan dentro de la misma petición (sin worker).
+ANALISIS_TAREAS_SINCRONAS = False
+
+# Segundos tras los que una tarea que sigue en proceso se da por
+# abandonada (el worker murió) y se vuelve a encolar.
+ANALISIS_TIEMPO_ABANDONO = 60 * 60
+
+# Procesos para contar los documentos de un corpus en paralelo
+# (None = todos los núcleos disponibles).
+ANALISIS_PROCESOS_CORPUS = None
+
+# Tamaño de la cache en memoria de textos tokenizados y conteos de cada
+# proceso, en unidades (un token o un n-grama distinto cada una).
+ANALISIS_CACHE_TAMANO = 5_000_000
+
+# Cache compartida entre procesos (workers de gunicorn, procesar_tareas)
+# para tokens y tablas de conteo. En producción conviene un backend con add()
+# atómico como Redis o Memcached; el de archivos sirve para una sola máquina.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analisis': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'sistema_pln_cache',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+ANALISIS_CACHE_COMPARTIDA = 'analisis'
+
+# Segundos que el navegador puede reutilizar una respuesta GET de
+# sugerencias sin revalidarla (después se revalida con su ETag).
+ANALISIS_SUGERENCIAS_MAX_AGE = 60
+
+# Hilos por proceso para abrir modelos desde las vistas async de
+# sugerencias (config.asgi bajo uvicorn) sin bloquear el bucle de eventos.
+ANALISIS_HILOS_CARGA = 4
+
+# Segundos que se guardan en la cache 'default' los fragmentos ya
+# renderizados de las tablas de análisis y comparación de un texto.
+ANALISIS_FRAGMENTOS_TIEMPO = 600
+
+# Tiempos por etapa (lectura, normalización, conteo, plantillas...) en la
+# cabecera Server-Timing y en la API de métricas (analisis/metricas.py).
+ANALISIS_METRICAS = True